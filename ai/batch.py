@@ -0,0 +1,188 @@
+# ai/batch.py
+#
+# Пакетная диагностика без GUI:
+#   python -m ai.batch путь/к/папке -o results.jsonl
+#   python -m ai.batch manifest.txt --manifest -o results.jsonl
+#   python -m ai.batch путь/к/папке --archive report.zip --overlay
+# Каждый снимок дописывается отдельной строкой JSON сразу после обработки,
+# поэтому прерванный запуск можно продолжить той же командой.
+# С --archive полные отчёты (маски в RLE, версии моделей, при --overlay
+# и наложение) дописываются в zip-архив, см. ai/report.py.
+
+import os
+import json
+import argparse
+import numpy as np
+from tqdm import tqdm
+
+from ai.diagnosis import analyze_batch, associate, open_error
+from ai.cache import get_cache
+from ai.report import ReportArchive, build_record, model_versions, render_overlay
+from ai.scan_image import ScanImage
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".tif", ".tiff", ".raw")
+
+def collect_images(root):
+    paths = []
+    for dirpath, _, filenames in os.walk(root):
+        for name in filenames:
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                paths.append(os.path.join(dirpath, name))
+    return sorted(paths)
+
+def read_manifest(manifest_path):
+    # Один путь на строку, пустые строки и комментарии (#) пропускаются.
+    # Относительные пути считаются от папки манифеста
+    base = os.path.dirname(os.path.abspath(manifest_path))
+    paths = []
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            paths.append(line if os.path.isabs(line) else os.path.join(base, line))
+    return paths
+
+def read_done(output_path):
+    # Пути, уже обработанные без ошибки. Последняя строка могла
+    # оборваться при аварийной остановке — такие строки пропускаем.
+    # Снимки с ошибкой повторяются; если повтор удался, строка с
+    # результатом идёт в файле после строки с ошибкой
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+                path = record["path"]
+            except (ValueError, KeyError, TypeError):
+                continue
+            if "error" in record:
+                done.discard(path)
+            else:
+                done.add(path)
+    return done
+
+def end_partial_line(output_path):
+    # Оборванная строка закрывается переводом строки, чтобы первая
+    # новая запись не склеилась с ней
+    if not os.path.exists(output_path) or os.path.getsize(output_path) == 0:
+        return
+    with open(output_path, "rb+") as f:
+        f.seek(-1, os.SEEK_END)
+        if f.read(1) != b"\n":
+            f.write(b"\n")
+
+def result_to_record(path, messages, segments):
+    record = {"path": path, "messages": messages, "teeth": [], "pathologies": [], "extra": []}
+    for seg in segments:
+        points = np.asarray(seg['points']).astype(int).tolist()
+        if seg.get('is_tooth', False):
+            record["teeth"].append({
+                "label": seg['label'],
+                "points": points,
+                "findings": seg.get('findings', []),
+            })
+        else:
+            key = "pathologies" if seg.get('is_pathology', False) else "extra"
+            record[key].append({
+                "label": seg['label'],
+                "human_label": seg['human_label'],
+                "points": points,
+            })
+    return record
+
+def chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+def add_to_archive(archive, path, messages, segments, overlap_threshold, conf_threshold, models, overlay):
+    # Для наложения снимок декодируется ещё раз: держать декодированными
+    # все снимки батча до записи отчётов дороже
+    png = render_overlay(ScanImage.open(path), segments) if overlay else None
+    archive.add(build_record(path, messages, segments, overlap_threshold, conf_threshold, models), png)
+
+def run_batch(paths, output_path, batch_size=8, overlap_threshold=0.15, conf_threshold=0.0, cache=None,
+              archive_path=None, overlay=False):
+    done = read_done(output_path)
+    archive = ReportArchive(archive_path) if archive_path else None
+    if archive is not None:
+        # Снимки, отмеченные готовыми, но без отчёта в архиве (например,
+        # архив прежнего формата или удалён), обрабатываются заново
+        lost = done - set(archive.paths)
+        if lost:
+            print(f"Нет в архиве, будут обработаны заново: {len(lost)}")
+        done -= lost
+    todo = [p for p in paths if p not in done]
+    if done:
+        print(f"Пропущено уже обработанных снимков: {len(paths) - len(todo)}")
+
+    models = model_versions()
+    end_partial_line(output_path)
+    try:
+        with open(output_path, "a", encoding="utf-8") as out, tqdm(total=len(todo)) as bar:
+            for batch in chunks(todo, batch_size):
+                # Сбой модели и нечитаемый снимок пишутся с "error": при
+                # следующем запуске такие снимки обрабатываются заново
+                results = [None] * len(batch)
+                try:
+                    records = []
+                    for i, (path, outputs) in enumerate(zip(batch, analyze_batch(batch, cache=cache))):
+                        if outputs.error == open_error(path):
+                            records.append({"path": path, "error": outputs.error})
+                            continue
+                        results[i] = associate(outputs, overlap_threshold, conf_threshold)
+                        records.append(result_to_record(path, *results[i]))
+                except Exception as e:
+                    results = [None] * len(batch)
+                    records = [{"path": path, "error": str(e)} for path in batch]
+
+                # Отчёт пишется в архив (на диск, атомарно) до строки JSONL:
+                # снимок, отмеченный в выходном файле как готовый, уже есть
+                # и в архиве, даже если запуск прервётся до close()
+                if archive is not None:
+                    for i, (path, result) in enumerate(zip(batch, results)):
+                        if result is None:
+                            continue
+                        messages, segments = result
+                        try:
+                            add_to_archive(archive, path, messages, segments, overlap_threshold, conf_threshold, models, overlay)
+                        except Exception as e:
+                            records[i] = {"path": path, "error": f"Отчёт не записан: {e}"}
+
+                for record in records:
+                    out.write(json.dumps(record, ensure_ascii=False) + "\n")
+                out.flush()
+                bar.update(len(batch))
+    finally:
+        if archive is not None:
+            archive.close()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Пакетная диагностика ОПТГ-снимков")
+    parser.add_argument("input", help="папка со снимками или файл-манифест")
+    parser.add_argument("-o", "--output", default="results.jsonl", help="выходной JSONL-файл")
+    parser.add_argument("--manifest", action="store_true", help="input — список путей, по одному на строку")
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--overlap-threshold", type=float, default=0.15)
+    parser.add_argument("--conf-threshold", type=float, default=0.0)
+    parser.add_argument("--no-cache", action="store_true", help="не использовать кэш результатов")
+    parser.add_argument("--archive", help="zip-архив для полных отчётов (маски в RLE, версии моделей)")
+    parser.add_argument("--overlay", action="store_true", help="добавлять в архив наложение в разрешении снимка")
+    args = parser.parse_args(argv)
+
+    if args.manifest:
+        paths = read_manifest(args.input)
+    else:
+        paths = collect_images(args.input)
+
+    if args.overlay and not args.archive:
+        parser.error("--overlay работает только вместе с --archive")
+
+    cache = None if args.no_cache else get_cache()
+    run_batch(paths, args.output, args.batch_size, args.overlap_threshold, args.conf_threshold, cache,
+              args.archive, args.overlay)
+
+if __name__ == "__main__":
+    main()
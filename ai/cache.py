@@ -0,0 +1,165 @@
+# ai/cache.py
+#
+# Кэш выходов моделей по снимку (ModelOutputs из ai/diagnosis.py).
+# Ключ — хэш содержимого снимка, идентичность весов моделей и настройки
+# конвейера, поэтому переименованный или скопированный снимок тоже
+# находится в кэше, а смена весов или настроек его сбрасывает. Пороги
+# в ключ не входят: сопоставление с ними повторяется на каждый запрос.
+# Два уровня: горячий в памяти (LRU по числу записей) и на диске
+# (LRU по суммарному размеру, время доступа — mtime файла).
+
+import os
+import json
+import pickle
+import hashlib
+import threading
+from collections import OrderedDict
+
+from ai import teeth_detect, disease_seg
+from ai.config import get_config
+from ai.engines import active_weights
+
+# Увеличивается при изменении формата кэшируемых результатов
+CACHE_VERSION = 4
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "opg_scanner", "results")
+
+def file_hash(path, chunk_size=1 << 20):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def weights_identity():
+    parts = []
+    for path in active_weights(teeth_detect.WEIGHTS_PATH, disease_seg.WEIGHTS_PATH):
+        try:
+            st = os.stat(path)
+            parts.append(f"{path}:{st.st_size}:{st.st_mtime_ns}")
+        except OSError:
+            parts.append(f"{path}:missing")
+    return "|".join(parts)
+
+def make_key(image_path):
+    # Настройки трассировки, сервера анализа и батчинга на результат не влияют
+    config = {k: v for k, v in get_config().items() if not k.startswith(("trace", "remote", "batch_"))}
+    config = json.dumps(config, sort_keys=True)
+    ident = f"{CACHE_VERSION}|{file_hash(image_path)}|{weights_identity()}|{config}"
+    return hashlib.sha256(ident.encode("utf-8")).hexdigest()
+
+class ResultCache:
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=1 << 30, memory_items=32):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.memory_items = memory_items
+        self._memory = OrderedDict()
+        self._index = None  # путь -> (mtime, размер), строится при первой записи
+        self._lock = threading.Lock()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + ".pkl")
+
+    def _remember(self, key, value):
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+
+    def get(self, key):
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                return self._memory[key]
+
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                value = pickle.load(f)
+            os.utime(path)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return None
+
+        with self._lock:
+            self._remember(key, value)
+            if self._index is not None and path in self._index:
+                self._index[path] = (os.path.getmtime(path), self._index[path][1])
+        return value
+
+    def put(self, key, value):
+        # Запись в кэш не обязательна: при ошибке диска результат
+        # остаётся только в памяти, анализ продолжается
+        with self._lock:
+            self._remember(key, value)
+
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp_path, "wb") as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+            st = os.stat(path)
+        except OSError as e:
+            print(f"Не удалось записать кэш {path}: {e}")
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            return
+
+        with self._lock:
+            if self._index is None:
+                self._index = self._scan()
+            self._index[path] = (st.st_mtime, st.st_size)
+            self._evict()
+
+    def _scan(self):
+        index = {}
+        for dirpath, _, filenames in os.walk(self.cache_dir):
+            for name in filenames:
+                if not name.endswith(".pkl"):
+                    continue
+                path = os.path.join(dirpath, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                index[path] = (st.st_mtime, st.st_size)
+        return index
+
+    def _evict(self):
+        total = sum(size for _, size in self._index.values())
+        if total <= self.max_bytes:
+            return
+        for path, (_, size) in sorted(self._index.items(), key=lambda kv: kv[1][0]):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+            del self._index[path]
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            for path in self._scan():
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            self._index = {}
+
+_default_cache = None
+
+def get_cache():
+    # Общий кэш процесса; папка и лимит задаются через
+    # OPG_CACHE_DIR и OPG_CACHE_MAX_MB
+    global _default_cache
+    if _default_cache is None:
+        cache_dir = os.environ.get("OPG_CACHE_DIR", DEFAULT_CACHE_DIR)
+        max_mb = int(os.environ.get("OPG_CACHE_MAX_MB", "1024"))
+        _default_cache = ResultCache(cache_dir, max_bytes=max_mb << 20)
+    return _default_cache
@@ -45,4 +45,24 @@ RAW_TO_HUMAN = {
     "retailer": "Ретейнеры",
     "sealed channel": "Обтурация канала",
     "supplemental": "Сверхкомплектный зуб"
-}
\ No newline at end of file
+}
+
+# Цвета заливки классов (R, G, B, альфа) для Canvas и отчётов
+CLASS_COLORS = {
+    "Periodontit": (255, 60, 60, 180),
+    "caries": (255, 120, 60, 180),
+    "cyst": (255, 80, 180, 180),
+    "radix": (200, 60, 255, 180),
+    "supplemental": (230, 180, 60, 180),
+    "missing teeth": (255, 80, 80, 180),
+    # Приглушённые цвета для следов лечения и extra
+    "filling": (60, 180, 255, 80),
+    "crown": (130, 190, 255, 80),
+    "implant": (60, 120, 220, 70),
+    "mini implant": (120, 180, 220, 70),
+    "sealed channel": (100, 150, 220, 70),
+    "artefact": (150, 150, 150, 40),
+    "bracket": (200, 200, 80, 60),
+    "eights": (100, 100, 180, 30),
+    "retailer": (150, 100, 200, 40),
+}
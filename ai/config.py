@@ -0,0 +1,55 @@
+# ai/config.py
+#
+# Настройки конвейера. Значения по умолчанию перекрываются файлом
+# config.yaml в папке запуска (путь можно задать через OPG_CONFIG), например:
+#
+#   seg_tiled: true        # UNet по перекрывающимся тайлам полного разрешения
+#   seg_tile_size: 256
+#   seg_tile_overlap: 64
+#   seg_tile_batch: 8
+#   seg_min_area: 10       # находки меньше (в пикселях карты UNet) отбрасываются
+#   backend: onnx          # torch | onnx (см. ai/engines.py)
+#   seg_mode: int8         # fp32 | fast | int8 для backend: torch
+#   trace: true            # трассировка этапов, см. ai/trace.py
+#   trace_max_events: 200000   # в памяти — только последние события
+#   remote_url: http://192.168.1.10:8765   # анализ на сервере (python -m ai.server)
+#   batch_max_size: 8      # микробатчинг одновременных запросов, см. ai/scheduler.py
+#   batch_max_wait_ms: 10
+
+import os
+import yaml
+
+DEFAULTS = {
+    "seg_tiled": False,
+    "seg_tile_size": 256,
+    "seg_tile_overlap": 64,
+    "seg_tile_batch": 8,
+    "backend": "torch",
+    "teeth_onnx_path": "ai/yolo_data/best.onnx",
+    "seg_onnx_path": "ai/unet_data/u-net.onnx",
+    "seg_mode": "fp32",
+    "seg_int8_path": "ai/unet_data/u-net_int8.pt",
+    "seg_min_area": 10,
+    "trace": False,
+    "trace_path": "",
+    "trace_log": False,
+    "trace_max_events": 200000,
+    "remote_url": "",
+    "remote_token": "",
+    "remote_timeout": 300,
+    "batch_max_size": 8,
+    "batch_max_wait_ms": 10,
+}
+
+_config = None
+
+def get_config():
+    global _config
+    if _config is None:
+        config = dict(DEFAULTS)
+        path = os.environ.get("OPG_CONFIG", "config.yaml")
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                config.update(yaml.safe_load(f) or {})
+        _config = config
+    return _config
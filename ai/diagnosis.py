@@ -1,17 +1,49 @@
 # ai/diagnosis.py
 
 import os
-import tempfile
 import numpy as np
 import cv2
 from PIL import Image, ImageOps
 from collections import namedtuple, defaultdict
 
-from ai.teeth_detect import predict_teeth
-from ai.disease_seg import predict_masks
+from ai import teeth_detect, disease_seg, trace
+from ai.teeth_detect import predict_teeth, predict_teeth_batch
+from ai.disease_seg import predict_masks_batch, predict_masks_tiled
 from ai.valid import valid_teeth, valid_masks 
+from ai.cache import make_key
+from ai.config import get_config
+from ai.scan_image import ScanImage, as_scan
+from ai.teeth_set import ToothSet
 Segment = namedtuple('Segment', ['points', 'label'])
 
+# Преобразование координат снимка в систему зоны интереса (выход UNet):
+# x' = (x - x_min) * scale, y' = (y + pad_top) * scale
+ZoneTransform = namedtuple('ZoneTransform', ['x_min', 'pad_top', 'scale'])
+
+# Выходы моделей по снимку до сопоставления с порогами: зубы (ToothSet),
+# маски UNet, зона интереса и сообщения о полноте зубного ряда. При
+# ошибке (снимок не открылся, мало зубов) остальные поля — None, а error —
+# текст сообщения. От порогов не зависят, поэтому кэшируются и хранятся
+# в GUI: смена порогов перезапускает только associate()
+ModelOutputs = namedtuple('ModelOutputs', ['teeth', 'masks_seg', 'zone', 'results', 'error'])
+
+# Этапы diagnose_image в порядке выполнения (для индикации прогресса)
+STAGES = ["detect", "crop", "segment", "associate"]
+
+class AnalysisCancelled(Exception):
+    pass
+
+def load_models():
+    teeth_detect.get_model()
+    disease_seg.get_model()
+
+def warmup():
+    # Первый прогон моделей заметно дольше последующих (инициализация
+    # ядер, выделение буферов), поэтому делаем его на пустом снимке заранее
+    load_models()
+    predict_teeth_batch([np.zeros((640, 640, 3), dtype=np.uint8)])
+    predict_masks_batch([Image.new('RGB', (256, 256))])
+
 def get_row_from_label(label):
     try:
         n = int(label.split()[-1])
@@ -97,22 +129,27 @@ def teeth_fullness(teeth_labels):
         results.append("Полный набор зубов")
     return results
 
-def to_interest_zone(image_path, teeth_segments, desired_size=256, extra_percent=0.08, debug_save_path=None, return_bbox=False):
-    img = Image.open(image_path).convert('RGB')
-    w, h = img.size
-
-    # Собираем все x-координаты крайних точек зубов
-    all_x = []
-    for seg in teeth_segments:
-        points = seg['points']
-        all_x.extend([x for x, y in points])
+def to_interest_zone(image, teeth_segments, desired_size=256, extra_percent=0.08, debug_save_path=None, return_bbox=False):
+    # image — путь или ScanImage; из уже открытого снимка
+    # в RGB переводится только вырезаемая зона
+    scan = as_scan(image)
+    w, h = scan.size
 
-    x_min, x_max = min(all_x), max(all_x)
+    # Крайние x-координаты зубов — по их bbox
+    teeth = ToothSet.from_segments(teeth_segments)
+    x_min, x_max = int(teeth.bboxes[:, 0].min()), int(teeth.bboxes[:, 2].max())
     width_teeth = x_max - x_min
     extra_padding = int(width_teeth * extra_percent)
     x_min = max(0, x_min - extra_padding)
     x_max = min(w, x_max + extra_padding)
-    img_cropped = img.crop((x_min, 0, x_max, h))
+    img_cropped = scan.to_pil((x_min, 0, x_max, h))
+    bbox = (x_min, 0, x_max, h)
+
+    # Без desired_size возвращается кроп полного разрешения (тайловый режим UNet)
+    if desired_size is None:
+        if debug_save_path:
+            img_cropped.save(debug_save_path)
+        return (img_cropped, bbox) if return_bbox else img_cropped
 
     # Паддинг по высоте для квадрата
     cw, ch = img_cropped.size
@@ -121,7 +158,6 @@ def to_interest_zone(image_path, teeth_segments, desired_size=256, extra_percent
     img_padded = ImageOps.expand(img_cropped, border=(0, pad_top, 0, pad_bottom), fill=0)
 
     img_final = img_padded.resize((desired_size, desired_size), Image.BILINEAR)
-    bbox = (x_min, 0, x_max, h)
     if debug_save_path:
         img_final.save(debug_save_path)
     if return_bbox:
@@ -129,68 +165,218 @@ def to_interest_zone(image_path, teeth_segments, desired_size=256, extra_percent
     return img_final
 
 
-def diagnose_image(image_path, overlap_threshold=0.15, conf_threshold=0.7):
+def zone_from_bbox(bbox, desired_size=256):
+    x_min, y_min, x_max, y_max = bbox
+    if desired_size is None:
+        return ZoneTransform(x_min, 0, 1.0)
+    cw, ch = x_max - x_min, y_max - y_min
+    return ZoneTransform(x_min, (cw - ch) // 2, desired_size / cw)
+
+def prepare_zone(image, teeth, debug_save_path=None):
+    # Зона интереса для UNet: квадрат 256x256, а в режиме seg_tiled —
+    # кроп полного разрешения без масштабирования
+    desired_size = None if get_config()["seg_tiled"] else 256
+    cropped_image, bbox = to_interest_zone(
+        image, teeth, desired_size=desired_size, debug_save_path=debug_save_path, return_bbox=True
+    )
+    return cropped_image, zone_from_bbox(bbox, desired_size)
+
+def segment_zones(crops):
+    config = get_config()
+    if config["seg_tiled"]:
+        return [
+            predict_masks_tiled(crop, config["seg_tile_size"], config["seg_tile_overlap"], config["seg_tile_batch"])
+            for crop in crops
+        ]
+    return predict_masks_batch(crops)
+
+def points_to_zone(points, zone):
+    pts = np.asarray(points, dtype=np.float32).reshape(-1, 2)
+    return np.column_stack([(pts[:, 0] - zone.x_min) * zone.scale, (pts[:, 1] + zone.pad_top) * zone.scale])
+
+def points_from_zone(points, zone):
+    pts = np.asarray(points, dtype=np.float32).reshape(-1, 2)
+    return np.column_stack([pts[:, 0] / zone.scale + zone.x_min, pts[:, 1] / zone.scale - zone.pad_top])
+
+def diagnose_image(image, overlap_threshold=0.15, conf_threshold=0.0, progress=None, cancelled=None, debug_dir=None, cache=None, scheduler=None):
+    # image — путь к снимку или уже открытый ScanImage: снимок
+    # декодируется один раз и общий для детектора и вырезания зоны.
+    # progress(stage) вызывается перед каждым этапом из STAGES,
+    # cancelled() проверяется между этапами и прерывает анализ.
+    # debug_dir — папка для сохранения вырезанной зоны интереса (отладка).
+    # cache — ResultCache (ai/cache.py); при попадании модели не запускаются.
+    # scheduler — Scheduler (ai/scheduler.py): модели вызываются общими
+    # батчами вместе с запросами из других потоков
+    outputs = analyze_image(image, progress, cancelled, debug_dir, cache, scheduler)
+    if progress is not None:
+        progress("associate")
+    return associate(outputs, overlap_threshold, conf_threshold)
+
+def analyze_image(image, progress=None, cancelled=None, debug_dir=None, cache=None, scheduler=None):
+    # Этапы до сопоставления (параметры — как у diagnose_image) -> ModelOutputs
+    image_path = image.path if isinstance(image, ScanImage) else image
+    if image_path is None:
+        cache = None
+    key = None
+    if cache is not None:
+        try:
+            key = make_key(image_path)
+        except OSError:
+            return ModelOutputs(None, None, None, None, open_error(image_path))
+        hit = cache.get(key)
+        if hit is not None:
+            trace.count("cache.hit")
+            return hit
+        trace.count("cache.miss")
+
+    with trace.span("diagnose_image", path=image_path):
+        outputs = run_models(image, progress, cancelled, debug_dir, scheduler)
+    # Ошибки не кэшируются: сбой модели (predict_teeth возвращает пустой
+    # набор) может быть временным, повтор должен запустить её снова
+    if cache is not None and not outputs.error:
+        cache.put(key, outputs)
+    return outputs
+
+def run_models(image, progress=None, cancelled=None, debug_dir=None, scheduler=None):
+    def stage(name):
+        if cancelled is not None and cancelled():
+            raise AnalysisCancelled()
+        if progress is not None:
+            progress(name)
+
     # Детекция зубов
-    teeth = predict_teeth(image_path)
-    teeth_labels = [tooth['label'] for tooth in teeth]
+    stage("detect")
+    with trace.span("stage.decode"):
+        try:
+            scan = as_scan(image)
+        except OSError as e:
+            return ModelOutputs(None, None, None, None, f"[Ошибка] {e}")
+    with trace.span("stage.detect"):
+        teeth = predict_teeth(scan) if scheduler is None else scheduler.detect(scan)
+        results, error_message = check_teeth(teeth)
+    if error_message:
+        return ModelOutputs(None, None, None, None, error_message)
+
+    # Подготовка и сегментация масок
+    stage("crop")
+    debug_save_path = None
+    if debug_dir:
+        name = os.path.splitext(os.path.basename(scan.path or "scan"))[0]
+        debug_save_path = os.path.join(debug_dir, f"{name}_crop.png")
+    with trace.span("stage.crop"):
+        cropped_image, zone = prepare_zone(scan, teeth, debug_save_path)
+    stage("segment")
+    with trace.span("stage.segment"):
+        masks_seg = segment_zones([cropped_image])[0] if scheduler is None else scheduler.segment(cropped_image)
+    if cancelled is not None and cancelled():
+        raise AnalysisCancelled()
+    return ModelOutputs(teeth, masks_seg, zone, results, None)
+
+def associate(outputs, overlap_threshold=0.15, conf_threshold=0.0):
+    # Сопоставление находок с зубами по сохранённым выходам моделей:
+    # миллисекунды, поэтому повторяется при каждой смене порогов.
+    # Находки с уверенностью не выше conf_threshold не показываются
+    # и не сопоставляются. outputs не изменяется -> (messages, segments)
+    if outputs.error:
+        return [outputs.error], []
+    masks_seg = dict(
+        outputs.masks_seg,
+        pathologies=[dict(item) for item in outputs.masks_seg["pathologies"]
+                     if float(item.get("confidence", 1.0)) > conf_threshold],
+        extra=[dict(item) for item in outputs.masks_seg["extra"]],
+    )
+    with trace.span("stage.associate"):
+        return interpret_masks(outputs.teeth, masks_seg, outputs.zone, list(outputs.results), overlap_threshold, conf_threshold)
+
+def check_teeth(teeth):
+    teeth_labels = ToothSet.from_segments(teeth).labels
     results = []
     results.extend(teeth_fullness(teeth_labels))
 
     error_message, expected_teeth = valid_teeth(teeth, results)
-    if error_message:
-        return [error_message], []
+    return results, error_message
 
-    # Подготовка и сегментация масок
-    cropped_image = to_interest_zone(image_path, teeth, desired_size=256)
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".jpg") as tmp:
-        cropped_image.save(tmp.name)
-        cropped_path = tmp.name
-    masks_seg = predict_masks(cropped_path)
+def associate_findings(teeth, masks_seg, zone, overlap_threshold=0.15, conf_threshold=0.0):
+    # Все зубы растеризуются в одну карту меток в системе координат UNet
+    # (0 — фон, i + 1 — i-й зуб); один bincount по ней даёт площади зубов.
+    # Каждая находка проверяется только в пределах своего bbox: bincount
+    # карты зубов под её маской даёт пересечение со всеми зубами, которых
+    # она касается. Где полигоны соседних зубов перекрываются, пиксель
+    # достаётся зубу, нарисованному последним
+    pathologies = masks_seg["pathologies"]
+    if not pathologies:
+        return []
+    # Выходы в истории, сохранённые до отказа от карты argmax, — с label_map
+    shape = masks_seg["shape"] if "shape" in masks_seg else masks_seg["label_map"].shape
+    teeth = ToothSet.from_segments(teeth)
+    zone_vertices = np.round(points_to_zone(teeth.vertices, zone)).astype(np.int32)
+    tooth_raster = np.zeros(shape, dtype=np.int32)
+    for i in range(len(teeth)):
+        cv2.fillPoly(tooth_raster, [zone_vertices[teeth.offsets[i]:teeth.offsets[i + 1]]], i + 1)
+    area_tooth = np.bincount(tooth_raster.ravel(), minlength=len(teeth) + 1)[1:]
+
+    findings = []
+    for item in pathologies:
+        confidence = float(item.get("confidence", 1.0))
+        if confidence <= conf_threshold:
+            continue
+        x0, y0, x1, y1 = item["mask"].bbox
+        under = tooth_raster[y0:y1, x0:x1][item["mask"].crop().astype(bool)]
+        overlap = np.bincount(under, minlength=len(teeth) + 1)[1:]
+        frac = overlap / np.maximum(area_tooth, 1)
+        for t in np.flatnonzero((frac > overlap_threshold) & (area_tooth > 0)):
+            findings.append({
+                "tooth": int(t),
+                "label": item["label"],
+                "human_label": item["human_label"],
+                "instance": item.get("instance"),
+                "confidence": confidence,
+                "overlap": float(frac[t]),
+            })
+    return findings
+
+def interpret_masks(teeth, masks_seg, zone, results, overlap_threshold=0.15, conf_threshold=0.0):
+    # Контуры масок переводятся из системы UNet в координаты снимка;
+    # сама маска остаётся в системе UNet, zone нужна для её перевода
+    for item in masks_seg["pathologies"] + masks_seg["extra"]:
+        item['points'] = points_from_zone(item['contour'], zone).astype(np.int32)
+        item['zone'] = zone
 
     early_return = valid_masks(teeth, masks_seg, results)
     if early_return:
         return early_return
 
-    print("[DEBUG]: teeth =", teeth[:3]) 
-    print("[DEBUG]: pathologies =", masks_seg["pathologies"][:3])
-    print("[DEBUG]: extra =", masks_seg["extra"][:3])
-
-    # Размерность для маски зуба
-    if masks_seg["pathologies"]:
-        first_mask = masks_seg["pathologies"][0]["mask"]
-    elif masks_seg["extra"]:
-        first_mask = masks_seg["extra"][0]["mask"]
-    else:
-        first_mask = None
-    mask_shape = first_mask.shape if first_mask is not None else (256, 256) 
+    # Срезы строятся только при включённой трассировке
+    if trace.active():
+        trace.debug("teeth = %s", teeth[:3])
+        trace.debug("pathologies = %s", masks_seg["pathologies"][:3])
+        trace.debug("extra = %s", masks_seg["extra"][:3])
 
     # Проверка наличия патологий для каждого зуба
-    for tooth in teeth:
+    findings = associate_findings(teeth, masks_seg, zone, overlap_threshold, conf_threshold)
+    tooth_findings = defaultdict(list)
+    reported = set()
+    for finding in findings:
+        tooth_findings[finding["tooth"]].append(finding)
+        # Несколько очагов одного класса на зубе — одна строка отчёта
+        if (finding["tooth"], finding["label"]) in reported:
+            continue
+        reported.add((finding["tooth"], finding["label"]))
+        tooth = teeth[finding["tooth"]]
         row = get_row_from_label(tooth['label'])
         pos = tooth_pos_in_row(tooth['label'])
-        tooth_mask = np.zeros(mask_shape, dtype=np.uint8)
-        pts = np.array([tooth['points']], dtype=np.int32)
-        cv2.fillPoly(tooth_mask, pts, 1)
-        for item in masks_seg["pathologies"]:
-            overlap = (tooth_mask & item["mask"])
-            area_tooth = tooth_mask.sum()
-            area_overlap = overlap.sum()
-            if area_tooth == 0:
-                continue
-            frac = area_overlap / area_tooth
-            confidence = item.get("confidence", 1.0)
-            if frac > overlap_threshold and confidence > conf_threshold:
-                msg = (
-                    f"Зуб {pos} ({row} ряд): "
-                    f"{item['human_label']}, уверенность {confidence:.2f}"
-                )
-                results.append(msg)
+        msg = (
+            f"Зуб {pos} ({row} ряд): "
+            f"{finding['human_label']}, уверенность {finding['confidence']:.2f}"
+        )
+        results.append(msg)
 
     # Формируем полный список для визуализации
     segments = []
-    for tooth in teeth:
+    for i, tooth in enumerate(teeth):
         tooth_seg = dict(tooth)
         tooth_seg['is_tooth'] = True
+        tooth_seg['findings'] = tooth_findings.get(i, [])
         segments.append(tooth_seg)
     for item in masks_seg["pathologies"]:
         pathology_seg = dict(item)
@@ -201,9 +387,63 @@ def diagnose_image(image_path, overlap_threshold=0.15, conf_threshold=0.7):
         extra_seg['is_extra'] = True
         segments.append(extra_seg)
 
-    try:
-        os.remove(croped_path)
-    except Exception:
-        pass
+    return results, segments
+
+def open_error(path):
+    # Сообщение для снимка, который не удалось прочитать; по нему
+    # ai/batch.py отличает сбой чтения от результата анализа
+    return f"[Ошибка] Не удалось открыть файл: {path}"
+
+def diagnose_batch(image_paths, overlap_threshold=0.15, conf_threshold=0.0, cache=None):
+    # Пакетный вариант diagnose_image: YOLO и UNet получают сразу
+    # несколько снимков за один вызов модели. Снимки из кэша не пересчитываются
+    outputs = analyze_batch(image_paths, cache)
+    return [associate(o, overlap_threshold, conf_threshold) for o in outputs]
+
+def analyze_batch(image_paths, cache=None):
+    # Пакетный вариант analyze_image -> список ModelOutputs. Сбой модели
+    # не перехватывается: весь батч падает, а не записывается пустым
+    outputs = [None] * len(image_paths)
+    keys = [None] * len(image_paths)
+    if cache is not None:
+        for i, path in enumerate(image_paths):
+            try:
+                keys[i] = make_key(path)
+            except OSError:
+                continue
+            outputs[i] = cache.get(keys[i])
+
+    scans = [None] * len(image_paths)
+    for i, path in enumerate(image_paths):
+        if outputs[i] is not None:
+            continue
+        try:
+            scans[i] = ScanImage.open(path)
+        except OSError:
+            outputs[i] = ModelOutputs(None, None, None, None, open_error(path))
+
+    loaded = [i for i, scan in enumerate(scans) if scan is not None]
+    with trace.span("stage.detect", batch=len(loaded)):
+        teeth_batch = predict_teeth_batch([scans[i].bgr for i in loaded])
+
+    crops, pending = [], []
+    for i, teeth in zip(loaded, teeth_batch):
+        results, error_message = check_teeth(teeth)
+        if error_message:
+            outputs[i] = ModelOutputs(None, None, None, None, error_message)
+            continue
+        with trace.span("stage.crop"):
+            cropped_image, zone = prepare_zone(scans[i], teeth)
+        crops.append(cropped_image)
+        pending.append((i, teeth, zone, results))
+
+    with trace.span("stage.segment", batch=len(crops)):
+        masks_batch = segment_zones(crops)
+    for (i, teeth, zone, results), masks_seg in zip(pending, masks_batch):
+        outputs[i] = ModelOutputs(teeth, masks_seg, zone, results, None)
 
-    return results, segments
\ No newline at end of file
+    if cache is not None:
+        for i in loaded:
+            if keys[i] is not None and not outputs[i].error:
+                cache.put(keys[i], outputs[i])
+    return outputs
@@ -2,75 +2,201 @@
 
 import os
 import csv
-import torch
-from torchvision import transforms
+import threading
 from PIL import Image
 import numpy as np
-import segmentation_models_pytorch as smp
 import cv2
 
-from ai.unet_data.module import create_unet
 from ai.classes import CLASSES, PATHOLOGIES, EXTRA, RAW_TO_HUMAN
+from ai.masks import CompactMask
+from ai import trace
+from ai.engines import load_seg_engine
+from ai.config import get_config
 
 # Подгрузка весов и инициализация модели
 WEIGHTS_PATH = "ai/unet_data/u-net_weights.pth"
 NUM_CLASSES = len(CLASSES)
+INPUT_SIZE = 256
 
+# Движок UNet (PyTorch или ONNX Runtime, см. ai/engines.py)
+# загружается при первом обращении к get_model()
+model = None
+_model_lock = threading.Lock()
 
-device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
-model = create_unet(num_classes=NUM_CLASSES).to(device)
+def get_model():
+    global model
+    with _model_lock:
+        if model is None:
+            model = load_seg_engine(WEIGHTS_PATH, NUM_CLASSES)
+    return model
 
-model.load_state_dict(torch.load(WEIGHTS_PATH, map_location=device))
-model.eval()
+def preprocess(image):
+    # То же, что Resize((256, 256), BILINEAR) + ToTensor из torchvision:
+    # PIL-ресайз и перевод в float32 CHW со значениями 0..1
+    image = to_pil(image).resize((INPUT_SIZE, INPUT_SIZE), Image.BILINEAR)
+    return (np.asarray(image, dtype=np.float32) / 255.0).transpose(2, 0, 1)
 
-transform = transforms.Compose([
-    transforms.Resize((256,256), interpolation=transforms.InterpolationMode.BILINEAR),
-    transforms.ToTensor()
-])
+def softmax(logits, axis=1):
+    e = np.exp(logits - logits.max(axis=axis, keepdims=True))
+    return e / e.sum(axis=axis, keepdims=True)
 
-def mask_to_contour(mask):
+def mask_to_contour(mask, offset=(0, 0)):
     mask_uint8 = (mask * 255).astype(np.uint8)
-    contours, _ = cv2.findContours(mask_uint8, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    contours, _ = cv2.findContours(mask_uint8, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE, offset=offset)
     if not contours:
         return []
     cnt = max(contours, key=cv2.contourArea)
     return [(int(pt[0][0]), int(pt[0][1])) for pt in cnt]
 
-# Основная функция сегменатации
-def predict_masks(image_path):
-    print(f"[DEBUG] Обрабатываю изображение: {image_path}")
-    image = Image.open(image_path).convert('RGB')
-    input_tensor = transform(image).unsqueeze(0).to(device)
-    print(f"[DEBUG] input_tensor shape: {input_tensor.shape}")
+def masks_to_results(masks, min_area=None, prob_map=None):
+    # Один проход по карте argmax: bincount даёт число пикселей каждого
+    # класса, а устойчивая сортировка группирует индексы пикселей по классам.
+    # Внутри bbox класса connectedComponents делит маску на отдельные
+    # находки (два очага кариеса — две находки); компоненты меньше
+    # min_area пикселей карты (seg_min_area) считаются шумом.
+    # Маски хранятся компактно (bbox + биты), контур ищется внутри bbox находки.
+    # shape — размер карты UNet: в нём растеризуются зубы при сопоставлении,
+    # сама карта не хранится (её держали бы кэш, история и GUI).
+    # prob_map — вероятность выбранного класса в каждом пикселе; уверенность
+    # находки — её среднее по пикселям находки (без prob_map — не задаётся)
+    if min_area is None:
+        min_area = get_config()["seg_min_area"]
+    results = {"pathologies": [], "extra": [], "shape": masks.shape}
 
-    with torch.no_grad():
-        output = model(input_tensor)
-        print(f"[DEBUG] Output shape: {output.shape}")
-        probs = torch.softmax(output, dim=1)
-        masks = torch.argmax(probs, dim=1).cpu().numpy()[0]
-        print(f"[DEBUG] masks unique: {np.unique(masks)}")
-
-    results = {"pathologies": [], "extra": []}
+    flat = masks.ravel()
+    counts = np.bincount(flat, minlength=NUM_CLASSES)
+    order = np.argsort(flat, kind='stable')
+    starts = np.concatenate([[0], np.cumsum(counts)])
+    trace.debug("Пикселей по классам: %s", counts)
 
     for class_idx in range(1, len(CLASSES)):
-        mask = (masks == class_idx).astype(np.uint8)
-        pixels = mask.sum()
-        print(f"[DEBUG] Class {class_idx} ({CLASSES[class_idx]}): пикселей = {pixels}")
-        if pixels == 0:
+        if counts[class_idx] == 0:
             continue
 
+        class_mask = CompactMask.from_indices(order[starts[class_idx]:starts[class_idx + 1]], masks.shape)
+        cx0, cy0, _, _ = class_mask.bbox
         label = CLASSES[class_idx]
-        item = {
-            "class_idx": class_idx,
-            "label": label,
-            "human_label": RAW_TO_HUMAN[label],
-            "mask": mask,
-            "contour": mask_to_contour(mask),
-        }
-        if label in PATHOLOGIES:
-            results["pathologies"].append(item)
-        else:
-            results["extra"].append(item)
-
-    print(f"[DEBUG] Обнаружено pathologies: {len(results['pathologies'])}, extra: {len(results['extra'])}")
-    return results
\ No newline at end of file
+        group = results["pathologies"] if label in PATHOLOGIES else results["extra"]
+
+        n, components, stats, centroids = cv2.connectedComponentsWithStats(class_mask.crop(), connectivity=8)
+        instance = 0
+        for k in range(1, n):
+            x, y, w, h, area = (int(v) for v in stats[k])
+            if area < min_area:
+                continue
+            crop = (components[y:y + h, x:x + w] == k).astype(np.uint8)
+            x0, y0 = cx0 + x, cy0 + y
+            mask = CompactMask.from_crop(crop, x0, y0, masks.shape)
+            item = {
+                "class_idx": class_idx,
+                "label": label,
+                "human_label": RAW_TO_HUMAN[label],
+                "instance": instance,
+                "mask": mask,
+                "area": area,
+                "bbox": mask.bbox,
+                "centroid": (float(centroids[k][0] + cx0), float(centroids[k][1] + cy0)),
+                "contour": mask_to_contour(crop, offset=(x0, y0)),
+            }
+            if prob_map is not None:
+                item["confidence"] = float(prob_map[y0:y0 + h, x0:x0 + w][crop.astype(bool)].mean())
+            group.append(item)
+            instance += 1
+
+    trace.count("seg.pathologies", len(results["pathologies"]))
+    trace.count("seg.extra", len(results["extra"]))
+    return results
+
+def to_pil(image):
+    # Вход сегментации: PIL-изображение, RGB-массив HxWx3 или путь к файлу
+    if isinstance(image, Image.Image):
+        return image.convert('RGB')
+    if isinstance(image, np.ndarray):
+        return Image.fromarray(image).convert('RGB')
+    return Image.open(image).convert('RGB')
+
+# Пакетная сегментация: список изображений -> один прогон модели
+def predict_masks_batch(images):
+    if not images:
+        return []
+    model = get_model()
+    with trace.span("seg.preprocess", batch=len(images)):
+        input_batch = np.stack([preprocess(img) for img in images])
+    with trace.span("seg.infer", batch=len(images)):
+        output = model.predict(input_batch)
+    with trace.span("seg.masks", batch=len(images)):
+        masks = output.argmax(axis=1)
+        probs = softmax(output).max(axis=1)
+        return [masks_to_results(m, prob_map=p) for m, p in zip(masks, probs)]
+
+def tile_positions(length, tile_size, stride):
+    # Начала тайлов вдоль одной оси; последний тайл прижат к краю
+    if length <= tile_size:
+        return [0]
+    positions = list(range(0, length - tile_size, stride))
+    positions.append(length - tile_size)
+    return positions
+
+def blend_window(tile_size, overlap):
+    # Вес пикселя тайла: линейно растёт на полосе перекрытия от края к центру,
+    # так что на стыках соседние тайлы плавно сменяют друг друга
+    if overlap <= 0:
+        return np.ones((tile_size, tile_size), dtype=np.float32)
+    ramp = np.minimum(1.0, (np.arange(tile_size) + 0.5) / overlap)
+    ramp = np.minimum(ramp, ramp[::-1]).astype(np.float32)
+    return np.outer(ramp, ramp)
+
+# Сегментация полного разрешения по перекрывающимся тайлам
+def predict_masks_tiled(image, tile_size=256, overlap=64, batch_size=8):
+    # Вероятности классов накапливаются с весами blend_window в полосе
+    # высотой в один тайл: строки выше следующего ряда тайлов уже
+    # окончательны, по ним сразу берётся argmax и полоса сдвигается.
+    # Сумма весов накапливается отдельно: argmax от нормировки не зависит,
+    # а вероятность выбранного класса (уверенность находок) — зависит.
+    # Память — O(классы x тайл x ширина), а не x высота снимка
+    model = get_model()
+    pixels = np.asarray(to_pil(image), dtype=np.float32) / 255.0
+    h, w = pixels.shape[:2]
+
+    # Снимок меньше тайла дополняется нулями
+    ph, pw = max(h, tile_size), max(w, tile_size)
+    if (ph, pw) != (h, w):
+        padded = np.zeros((ph, pw, 3), dtype=np.float32)
+        padded[:h, :w] = pixels
+        pixels = padded
+    pixels = pixels.transpose(2, 0, 1)
+
+    stride = max(1, tile_size - overlap)
+    ys = tile_positions(ph, tile_size, stride)
+    xs = tile_positions(pw, tile_size, stride)
+    window = blend_window(tile_size, overlap)
+
+    # Классов меньше 256: карта argmax полного разрешения — в uint8
+    label_map = np.zeros((ph, pw), dtype=np.uint8)
+    prob_map = np.zeros((ph, pw), dtype=np.float32)
+    acc = np.zeros((NUM_CLASSES, tile_size, pw), dtype=np.float32)
+    weights = np.zeros((tile_size, pw), dtype=np.float32)
+
+    for row, y in enumerate(ys):
+        for start in range(0, len(xs), batch_size):
+            chunk = xs[start:start + batch_size]
+            batch = np.stack([pixels[:, y:y + tile_size, x:x + tile_size] for x in chunk])
+            with trace.span("seg.infer", batch=len(chunk)):
+                logits = model.predict(batch)
+            trace.count("seg.tiles", len(chunk))
+            probs = softmax(logits) * window
+            for x, p in zip(chunk, probs):
+                acc[:, :, x:x + tile_size] += p
+                weights[:, x:x + tile_size] += window
+
+        next_y = ys[row + 1] if row + 1 < len(ys) else y + tile_size
+        done = next_y - y
+        label_map[y:next_y] = acc[:, :done].argmax(axis=0)
+        prob_map[y:next_y] = acc[:, :done].max(axis=0) / np.maximum(weights[:done], 1e-6)
+        acc[:, :tile_size - done] = acc[:, done:]
+        acc[:, tile_size - done:] = 0
+        weights[:tile_size - done] = weights[done:]
+        weights[tile_size - done:] = 0
+
+    with trace.span("seg.masks"):
+        return masks_to_results(label_map[:h, :w], prob_map=prob_map[:h, :w])
@@ -0,0 +1,108 @@
+# ai/engines.py
+#
+# Движки инференса за predict_teeth и predict_masks_batch. Бэкенд выбирается
+# параметром backend в config.yaml:
+#   torch — исходные веса .pt/.pth через ultralytics и PyTorch
+#   onnx  — экспортированные модели через ONNX Runtime на CPU
+#           (python -m ai.export_onnx export)
+#
+# Движок сегментации принимает батч float32 NCHW (значения 0..1)
+# и возвращает логиты NCHW в numpy, поэтому код вокруг него от torch
+# не зависит.
+#
+# Для бэкенда torch параметр seg_mode выбирает вариант UNet на CPU:
+#   fp32 — исходная модель в eager-режиме
+#   fast — channels-last, трассировка и заморозка графа (слияние conv+bn)
+#   int8 — статически квантованная модель, подготовленная командой
+#          python -m ai.optimize_seg calibrate (там же отчёт о расхождениях)
+
+import numpy as np
+
+from ai.config import get_config
+
+class TorchSegEngine:
+    def __init__(self, weights_path, num_classes):
+        import torch
+        from ai.unet_data.module import create_unet
+
+        self.device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+        self.model = create_unet(num_classes=num_classes).to(self.device)
+        self.model.load_state_dict(torch.load(weights_path, map_location=self.device))
+        self.model.eval()
+
+    def predict(self, batch):
+        import torch
+        with torch.no_grad():
+            output = self.model(torch.from_numpy(batch).to(self.device))
+        return output.cpu().numpy()
+
+class FastTorchSegEngine(TorchSegEngine):
+    def __init__(self, weights_path, num_classes, input_size=256):
+        import torch
+
+        super().__init__(weights_path, num_classes)
+        model = self.model.to(memory_format=torch.channels_last)
+        example = torch.zeros(1, 3, input_size, input_size, device=self.device).to(memory_format=torch.channels_last)
+        with torch.no_grad():
+            traced = torch.jit.trace(model, example)
+            self.model = torch.jit.optimize_for_inference(torch.jit.freeze(traced))
+
+    def predict(self, batch):
+        import torch
+        with torch.inference_mode():
+            x = torch.from_numpy(batch).to(self.device).to(memory_format=torch.channels_last)
+            output = self.model(x)
+        return output.float().cpu().numpy()
+
+class Int8TorchSegEngine:
+    # Квантованные ядра PyTorch работают только на CPU
+    def __init__(self, int8_path):
+        import torch
+
+        self.model = torch.jit.load(int8_path, map_location="cpu")
+        self.model.eval()
+
+    def predict(self, batch):
+        import torch
+        with torch.inference_mode():
+            output = self.model(torch.from_numpy(batch))
+        return output.float().numpy()
+
+class OnnxSegEngine:
+    def __init__(self, onnx_path):
+        import onnxruntime as ort
+
+        self.session = ort.InferenceSession(onnx_path, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def predict(self, batch):
+        return self.session.run(None, {self.input_name: np.ascontiguousarray(batch, dtype=np.float32)})[0]
+
+def load_seg_engine(weights_path, num_classes):
+    config = get_config()
+    if config["backend"] == "onnx":
+        return OnnxSegEngine(config["seg_onnx_path"])
+    if config["seg_mode"] == "fast":
+        return FastTorchSegEngine(weights_path, num_classes)
+    if config["seg_mode"] == "int8":
+        return Int8TorchSegEngine(config["seg_int8_path"])
+    return TorchSegEngine(weights_path, num_classes)
+
+def load_teeth_engine(weights_path):
+    # ultralytics сам запускает .onnx через ONNX Runtime, интерфейс
+    # и формат результатов при этом те же, что у .pt
+    from ultralytics import YOLO
+
+    config = get_config()
+    if config["backend"] == "onnx":
+        return YOLO(config["teeth_onnx_path"], task="segment")
+    return YOLO(weights_path)
+
+def active_weights(teeth_weights_path, seg_weights_path):
+    # Файлы весов, которыми реально пользуется выбранный бэкенд
+    config = get_config()
+    if config["backend"] == "onnx":
+        return [config["teeth_onnx_path"], config["seg_onnx_path"]]
+    if config["seg_mode"] == "int8":
+        return [teeth_weights_path, config["seg_int8_path"]]
+    return [teeth_weights_path, seg_weights_path]
@@ -0,0 +1,117 @@
+# ai/export_onnx.py
+#
+# Экспорт моделей в ONNX и проверка совпадения с PyTorch:
+#   python -m ai.export_onnx export
+#   python -m ai.export_onnx parity снимок1.png снимок2.png ...
+# После успешной проверки можно включить backend: onnx в config.yaml.
+
+import sys
+import shutil
+import argparse
+import numpy as np
+
+from ai import teeth_detect, disease_seg
+from ai.config import get_config
+from ai.engines import TorchSegEngine, OnnxSegEngine
+
+def export_seg(onnx_path, opset=17):
+    import torch
+
+    engine = TorchSegEngine(disease_seg.WEIGHTS_PATH, disease_seg.NUM_CLASSES)
+    model = engine.model.to("cpu")
+    dummy = torch.zeros(1, 3, disease_seg.INPUT_SIZE, disease_seg.INPUT_SIZE)
+    torch.onnx.export(
+        model, dummy, onnx_path,
+        input_names=["input"], output_names=["logits"],
+        dynamic_axes={"input": {0: "batch", 2: "height", 3: "width"}, "logits": {0: "batch", 2: "height", 3: "width"}},
+        opset_version=opset,
+    )
+    print(f"UNet экспортирован: {onnx_path}")
+
+def export_teeth(onnx_path):
+    from ultralytics import YOLO
+
+    exported = YOLO(teeth_detect.WEIGHTS_PATH).export(format="onnx", dynamic=True, simplify=True)
+    if exported != onnx_path:
+        shutil.move(exported, onnx_path)
+    print(f"YOLO экспортирован: {onnx_path}")
+
+def box_iou(a, b):
+    x0, y0 = np.maximum(a[:2], b[:2])
+    x1, y1 = np.minimum(a[2:], b[2:])
+    inter = max(0.0, x1 - x0) * max(0.0, y1 - y0)
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0.0
+
+def teeth_boxes(result):
+    # FDI-метка -> bbox с максимальной уверенностью
+    boxes = {}
+    if result.boxes is None:
+        return boxes
+    xyxy = result.boxes.xyxy.cpu().numpy()
+    conf = result.boxes.conf.cpu().numpy()
+    names = result.names or teeth_detect.get_class_names()
+    for box, c, cls in zip(xyxy, conf, result.boxes.cls.cpu().numpy()):
+        label = names[int(cls)]
+        if label not in boxes or c > boxes[label][1]:
+            boxes[label] = (box, c)
+    return {label: box for label, (box, _) in boxes.items()}
+
+def check_parity(image_paths, atol=1e-3, min_agreement=0.999, min_iou=0.9):
+    from ultralytics import YOLO
+
+    config = get_config()
+    torch_seg = TorchSegEngine(disease_seg.WEIGHTS_PATH, disease_seg.NUM_CLASSES)
+    onnx_seg = OnnxSegEngine(config["seg_onnx_path"])
+    torch_yolo = YOLO(teeth_detect.WEIGHTS_PATH)
+    onnx_yolo = YOLO(config["teeth_onnx_path"], task="segment")
+
+    ok = True
+    for path in image_paths:
+        batch = disease_seg.preprocess(path)[None]
+        ref, out = torch_seg.predict(batch), onnx_seg.predict(batch)
+        max_diff = float(np.abs(ref - out).max())
+        agreement = float((ref.argmax(axis=1) == out.argmax(axis=1)).mean())
+
+        ref_teeth = teeth_boxes(torch_yolo(path, verbose=False)[0])
+        out_teeth = teeth_boxes(onnx_yolo(path, verbose=False)[0])
+        common = set(ref_teeth) & set(out_teeth)
+        label_mismatch = len(set(ref_teeth) ^ set(out_teeth))
+        mean_iou = float(np.mean([box_iou(ref_teeth[l], out_teeth[l]) for l in common])) if common else 1.0
+
+        passed = max_diff <= atol and agreement >= min_agreement and label_mismatch == 0 and mean_iou >= min_iou
+        ok = ok and passed
+        print(
+            f"{'OK ' if passed else 'FAIL'} {path}: UNet max|Δ|={max_diff:.2e}, "
+            f"совпадение классов {agreement * 100:.3f}%; YOLO расхождение меток {label_mismatch}, "
+            f"средний IoU {mean_iou:.3f}"
+        )
+    return ok
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Экспорт моделей в ONNX и проверка совпадения с PyTorch")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = sub.add_parser("export", help="экспортировать YOLO и UNet в ONNX")
+    export_parser.add_argument("--only", choices=["teeth", "seg"])
+    export_parser.add_argument("--opset", type=int, default=17)
+
+    parity_parser = sub.add_parser("parity", help="сравнить выходы PyTorch и ONNX Runtime")
+    parity_parser.add_argument("images", nargs="+")
+    parity_parser.add_argument("--atol", type=float, default=1e-3)
+    parity_parser.add_argument("--min-agreement", type=float, default=0.999)
+    parity_parser.add_argument("--min-iou", type=float, default=0.9)
+    args = parser.parse_args(argv)
+
+    config = get_config()
+    if args.command == "export":
+        if args.only in (None, "seg"):
+            export_seg(config["seg_onnx_path"], args.opset)
+        if args.only in (None, "teeth"):
+            export_teeth(config["teeth_onnx_path"])
+        return 0
+
+    return 0 if check_parity(args.images, args.atol, args.min_agreement, args.min_iou) else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
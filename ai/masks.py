@@ -0,0 +1,71 @@
+# ai/masks.py
+
+import numpy as np
+
+class CompactMask:
+    # Бинарная маска, хранимая только в пределах своего bbox и упакованная
+    # по биту на пиксель. Полноразмерный массив собирается по требованию
+    __slots__ = ("shape", "bbox", "pixels", "bits")
+
+    def __init__(self, shape, bbox, pixels, bits):
+        self.shape = tuple(shape)
+        self.bbox = tuple(bbox)  # (x0, y0, x1, y1), x1/y1 не включительно
+        self.pixels = int(pixels)
+        self.bits = bits
+
+    @classmethod
+    def from_indices(cls, flat_indices, shape):
+        # flat_indices — плоские индексы пикселей маски в массиве shape
+        h, w = shape
+        if len(flat_indices) == 0:
+            return cls(shape, (0, 0, 0, 0), 0, np.zeros(0, dtype=np.uint8))
+        ys, xs = np.divmod(flat_indices, w)
+        x0, x1 = int(xs.min()), int(xs.max()) + 1
+        y0, y1 = int(ys.min()), int(ys.max()) + 1
+        crop = np.zeros((y1 - y0, x1 - x0), dtype=np.uint8)
+        crop[ys - y0, xs - x0] = 1
+        return cls(shape, (x0, y0, x1, y1), len(flat_indices), np.packbits(crop, axis=None))
+
+    @classmethod
+    def from_crop(cls, crop, x0, y0, shape):
+        # crop — бинарная маска в пределах bbox, (x0, y0) — её угол в shape
+        crop = np.asarray(crop, dtype=np.uint8)
+        h, w = crop.shape
+        return cls(shape, (x0, y0, x0 + w, y0 + h), int(crop.sum()), np.packbits(crop, axis=None))
+
+    @classmethod
+    def from_dense(cls, mask):
+        mask = np.asarray(mask)
+        return cls.from_indices(np.flatnonzero(mask), mask.shape)
+
+    def crop(self):
+        x0, y0, x1, y1 = self.bbox
+        size = (y1 - y0) * (x1 - x0)
+        return np.unpackbits(self.bits, count=size).reshape(y1 - y0, x1 - x0)
+
+    def decode(self):
+        x0, y0, x1, y1 = self.bbox
+        mask = np.zeros(self.shape, dtype=np.uint8)
+        mask[y0:y1, x0:x1] = self.crop()
+        return mask
+
+    def to_rle(self):
+        # Длины серий полной маски в построчном порядке, начиная с серии нулей
+        flat = self.decode().ravel()
+        changes = np.flatnonzero(np.diff(flat)) + 1
+        bounds = np.concatenate([[0], changes, [flat.size]])
+        counts = np.diff(bounds).tolist()
+        if flat[0] == 1:
+            counts = [0] + counts
+        return {"size": list(self.shape), "counts": counts}
+
+    @classmethod
+    def from_rle(cls, rle):
+        shape = tuple(rle["size"])
+        counts = np.asarray(rle["counts"], dtype=np.int64)
+        values = np.arange(len(counts)) % 2
+        flat = np.repeat(values.astype(np.uint8), counts)
+        return cls.from_dense(flat.reshape(shape))
+
+    def __repr__(self):
+        return f"CompactMask(shape={self.shape}, bbox={self.bbox}, pixels={self.pixels})"
@@ -0,0 +1,142 @@
+# ai/optimize_seg.py
+#
+# Подготовка и проверка оптимизированных вариантов UNet для CPU:
+#   python -m ai.optimize_seg calibrate папка_со_снимками [--limit 64]
+#   python -m ai.optimize_seg report папка_со_снимками --mode int8 [--json report.json]
+# calibrate выполняет статическую int8-квантизацию (FX graph mode) с калибровкой
+# на зонах интереса реальных снимков и сохраняет TorchScript в seg_int8_path.
+# report сравнивает выбранный режим с fp32: IoU по каждому классу,
+# долю совпавших пикселей и время на снимок. Включать seg_mode в config.yaml
+# стоит только после просмотра отчёта.
+
+import sys
+import json
+import time
+import argparse
+import numpy as np
+
+from ai import disease_seg
+from ai.classes import CLASSES
+from ai.config import get_config
+from ai.batch import collect_images
+from ai.engines import TorchSegEngine, FastTorchSegEngine, Int8TorchSegEngine
+
+def zone_inputs(image_paths):
+    # Входы UNet в том виде, в каком их видит конвейер: зона интереса по
+    # найденным зубам; если зубы не найдены — снимок целиком
+    from ai.teeth_detect import predict_teeth
+    from ai.diagnosis import prepare_zone
+
+    for path in image_paths:
+        teeth = predict_teeth(path)
+        if len(teeth):
+            crop, _ = prepare_zone(path, teeth)
+        else:
+            crop = path
+        yield path, disease_seg.preprocess(crop)[None]
+
+def calibrate(image_paths, out_path):
+    import torch
+    from torch.ao.quantization import get_default_qconfig_mapping
+    from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+
+    fp32 = TorchSegEngine(disease_seg.WEIGHTS_PATH, disease_seg.NUM_CLASSES)
+    model = fp32.model.to("cpu").eval()
+    example = (torch.zeros(1, 3, disease_seg.INPUT_SIZE, disease_seg.INPUT_SIZE),)
+
+    prepared = prepare_fx(model, get_default_qconfig_mapping("x86"), example)
+    count = 0
+    with torch.no_grad():
+        for path, batch in zone_inputs(image_paths):
+            prepared(torch.from_numpy(batch))
+            count += 1
+    quantized = convert_fx(prepared)
+
+    with torch.no_grad():
+        traced = torch.jit.freeze(torch.jit.trace(quantized, example))
+    torch.jit.save(traced, out_path)
+    print(f"Калибровка на {count} снимках, модель сохранена: {out_path}")
+
+def make_engine(mode):
+    config = get_config()
+    if mode == "fast":
+        return FastTorchSegEngine(disease_seg.WEIGHTS_PATH, disease_seg.NUM_CLASSES)
+    if mode == "int8":
+        return Int8TorchSegEngine(config["seg_int8_path"])
+    return TorchSegEngine(disease_seg.WEIGHTS_PATH, disease_seg.NUM_CLASSES)
+
+def agreement_report(image_paths, mode):
+    ref_engine = make_engine("fp32")
+    engine = make_engine(mode)
+    num_classes = disease_seg.NUM_CLASSES
+
+    # Совместная гистограмма (класс fp32, класс режима) по всем снимкам
+    confusion = np.zeros((num_classes, num_classes), dtype=np.int64)
+    ref_time = opt_time = 0.0
+    count = 0
+    for path, batch in zone_inputs(image_paths):
+        t0 = time.perf_counter()
+        ref = ref_engine.predict(batch).argmax(axis=1)
+        t1 = time.perf_counter()
+        out = engine.predict(batch).argmax(axis=1)
+        t2 = time.perf_counter()
+        ref_time += t1 - t0
+        opt_time += t2 - t1
+        count += 1
+        confusion += np.bincount(
+            (ref * num_classes + out).ravel(), minlength=num_classes * num_classes
+        ).reshape(num_classes, num_classes)
+
+    inter = np.diag(confusion)
+    union = confusion.sum(axis=0) + confusion.sum(axis=1) - inter
+    per_class = {
+        CLASSES[c]: (float(inter[c] / union[c]) if union[c] else None)
+        for c in range(num_classes)
+    }
+    return {
+        "mode": mode,
+        "images": count,
+        "pixel_agreement": float(inter.sum() / max(confusion.sum(), 1)),
+        "per_class_iou": per_class,
+        "fp32_ms_per_image": 1000 * ref_time / max(count, 1),
+        "mode_ms_per_image": 1000 * opt_time / max(count, 1),
+    }
+
+def print_report(report):
+    print(f"Режим {report['mode']} против fp32, снимков: {report['images']}")
+    print(f"Совпадение пикселей: {report['pixel_agreement'] * 100:.2f}%")
+    print(f"Время на снимок: fp32 {report['fp32_ms_per_image']:.1f} мс, "
+          f"{report['mode']} {report['mode_ms_per_image']:.1f} мс")
+    for label, iou in report["per_class_iou"].items():
+        print(f"  {label:16s} {'—' if iou is None else f'{iou:.3f}'}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Оптимизированные режимы UNet для CPU")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    cal = sub.add_parser("calibrate", help="int8-квантизация с калибровкой")
+    cal.add_argument("images", help="папка с калибровочными снимками")
+    cal.add_argument("--limit", type=int, default=64)
+    cal.add_argument("--out", help="куда сохранить модель (по умолчанию seg_int8_path)")
+
+    rep = sub.add_parser("report", help="сравнение с fp32 по IoU классов")
+    rep.add_argument("images", help="папка со снимками для проверки")
+    rep.add_argument("--mode", choices=["fast", "int8"], default="int8")
+    rep.add_argument("--limit", type=int, default=64)
+    rep.add_argument("--json", help="сохранить отчёт в JSON")
+    args = parser.parse_args(argv)
+
+    paths = collect_images(args.images)[:args.limit]
+    if args.command == "calibrate":
+        calibrate(paths, args.out or get_config()["seg_int8_path"])
+        return 0
+
+    report = agreement_report(paths, args.mode)
+    print_report(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,133 @@
+# ai/remote.py
+#
+# Клиент сервера инференса (ai/server.py). Если в config.yaml задан
+#   remote_url: http://192.168.1.10:8765
+# приложение отправляет снимки на сервер вместо локальных моделей.
+# Здесь же — перевод результатов diagnose_image в JSON и обратно:
+# массивы numpy передаются списками, маски CompactMask — в RLE.
+
+import os
+import json
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import numpy as np
+import cv2
+
+from ai.masks import CompactMask
+from ai.scan_image import ScanImage, FULL_DEPTH_EXTENSIONS
+from ai.config import get_config
+
+class RemoteBusy(Exception):
+    # Очередь сервера заполнена (503), retry_after — подсказка сервера в секундах
+    def __init__(self, message, retry_after=1.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+def encode_value(value):
+    if isinstance(value, CompactMask):
+        return {"__rle__": value.to_rle()}
+    if isinstance(value, np.ndarray):
+        return {"__ndarray__": value.tolist(), "dtype": str(value.dtype)}
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, dict):
+        return {k: encode_value(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [encode_value(v) for v in value]
+    return value
+
+def decode_value(value):
+    if isinstance(value, dict):
+        if "__rle__" in value:
+            return CompactMask.from_rle(value["__rle__"])
+        if "__ndarray__" in value:
+            return np.array(value["__ndarray__"], dtype=value["dtype"])
+        return {k: decode_value(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [decode_value(v) for v in value]
+    return value
+
+def encode_result(messages, segments):
+    return {"messages": list(messages), "segments": encode_value(list(segments))}
+
+def decode_result(data):
+    return data["messages"], decode_value(data["segments"])
+
+class RemoteClient:
+    def __init__(self, url, token="", timeout=300):
+        self.url = url.rstrip("/")
+        self.token = token
+        self.timeout = timeout
+
+    def _request(self, path, data=None, params=None, timeout=None):
+        url = self.url + path
+        if params:
+            url += "?" + urllib.parse.urlencode(params)
+        request = urllib.request.Request(url, data=data, method="POST" if data is not None else "GET")
+        if data is not None:
+            request.add_header("Content-Type", "application/octet-stream")
+        if self.token:
+            request.add_header("X-OPG-Token", self.token)
+        try:
+            with urllib.request.urlopen(request, timeout=timeout or self.timeout) as response:
+                return json.loads(response.read().decode("utf-8"))
+        except urllib.error.HTTPError as e:
+            try:
+                error = json.loads(e.read().decode("utf-8")).get("error", str(e))
+            except ValueError:
+                error = str(e)
+            if e.code == 503:
+                raise RemoteBusy(error, float(e.headers.get("Retry-After", 1)))
+            raise RuntimeError(f"Сервер анализа: {error}")
+
+    def health(self):
+        return self._request("/health", timeout=10)
+
+    def metrics(self):
+        return self._request("/metrics", timeout=10)
+
+    def diagnose_image(self, image, overlap_threshold=0.15, conf_threshold=0.0,
+                       progress=None, cancelled=None, retries=5):
+        # image — путь или ScanImage. Обычный снимок отправляется как есть
+        # (байты файла), 16-битный — уже с окном яркости, в PNG.
+        # При переполненной очереди запрос повторяется с паузой,
+        # которую назвал сервер
+        image_path = image.path if isinstance(image, ScanImage) else image
+        name = os.path.basename(image_path or "scan.png")
+        if image_path is None or image_path.lower().endswith(FULL_DEPTH_EXTENSIONS):
+            scan = image if isinstance(image, ScanImage) else ScanImage.open(image_path)
+            data = cv2.imencode(".png", scan.bgr)[1].tobytes()
+            name = os.path.splitext(name)[0] + ".png"
+        elif not os.path.exists(image_path):
+            return [f"[Ошибка] Не удалось открыть файл: {image_path}"], []
+        else:
+            with open(image_path, "rb") as f:
+                data = f.read()
+        params = {
+            "overlap_threshold": overlap_threshold,
+            "conf_threshold": conf_threshold,
+            "name": name,
+        }
+        if progress is not None:
+            progress("detect")
+        for attempt in range(retries + 1):
+            try:
+                return decode_result(self._request("/diagnose", data=data, params=params))
+            except RemoteBusy as e:
+                if attempt == retries or (cancelled is not None and cancelled()):
+                    raise RuntimeError(f"Сервер анализа перегружен: {e}")
+                time.sleep(e.retry_after)
+
+_client = None
+
+def get_client():
+    # Клиент из настроек или None, если сервер не задан
+    global _client
+    config = get_config()
+    if not config["remote_url"]:
+        return None
+    if _client is None:
+        _client = RemoteClient(config["remote_url"], config["remote_token"], config["remote_timeout"])
+    return _client
@@ -0,0 +1,312 @@
+# ai/report.py
+#
+# Структурированный отчёт по снимку: пороги, вывод teeth_fullness,
+# находки по зубам, контуры зубов, маски патологий в RLE и версии
+# моделей. Отчёты пишутся в zip-архив по одному JSON на снимок
+# (scans/0001_имя.json), при желании вместе с наложением в полном
+# разрешении снимка (overlays/0001_имя.png):
+#
+#   archive = ReportArchive("report.zip")
+#   archive.add(build_record(path, messages, segments), render_overlay(scan, segments))
+#   archive.close()
+#
+# Архив открывается на дозапись, поэтому пакетный режим складывает в
+# один файл сколько угодно снимков, не держа их в памяти; до close()
+# записи лежат в папке рядом с архивом (см. ReportArchive).
+#
+# Маски хранятся в системе координат UNet (квадрат зоны интереса или
+# кроп полного разрешения в режиме seg_tiled); поле zone переводит их
+# в координаты снимка: x = x' / scale + x_min, y = y' / scale - pad_top.
+
+import os
+import json
+import time
+import shutil
+import zipfile
+import numpy as np
+import cv2
+
+from ai import teeth_detect, disease_seg
+from ai.cache import file_hash
+from ai.classes import CLASS_COLORS, RAW_TO_HUMAN
+from ai.config import get_config
+from ai.diagnosis import teeth_fullness
+from ai.engines import active_weights
+from ai.masks import CompactMask
+from ai.scan_image import as_scan
+
+REPORT_VERSION = 1
+
+# Цвета наложения вне таблицы классов — как в Canvas
+DEFAULT_PATHOLOGY_COLOR = (255, 0, 0, 160)
+DEFAULT_EXTRA_COLOR = (80, 130, 180, 60)
+DARKEN_ALPHA = 170
+TEETH_ALPHA = 70
+
+def model_versions():
+    # Файлы весов, которыми пользуется текущий бэкенд: размер и время
+    # изменения, как в ключе кэша (хэш сотен мегабайт на каждый снимок
+    # считать слишком дорого)
+    config = get_config()
+    models = {"backend": config["backend"], "seg_mode": config["seg_mode"], "weights": []}
+    for path in active_weights(teeth_detect.WEIGHTS_PATH, disease_seg.WEIGHTS_PATH):
+        try:
+            st = os.stat(path)
+            models["weights"].append({"path": path, "size": st.st_size, "mtime": int(st.st_mtime)})
+        except OSError:
+            models["weights"].append({"path": path, "missing": True})
+    return models
+
+def json_default(value):
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"Не сериализуется в JSON: {type(value).__name__}")
+
+def zone_to_dict(zone):
+    # ZoneTransform или список из удалённого результата; у записей из
+    # старого кэша и хранилища зоны нет
+    if zone is None:
+        return None
+    x_min, pad_top, scale = zone
+    return {"x_min": int(x_min), "pad_top": int(pad_top), "scale": float(scale)}
+
+def mask_record(seg):
+    record = {
+        "label": seg['label'],
+        "human_label": seg.get('human_label', RAW_TO_HUMAN.get(seg['label'], seg['label'])),
+        "instance": seg.get('instance', 0),
+        "area": seg.get('area'),
+        "bbox": seg.get('bbox'),
+        "centroid": seg.get('centroid'),
+        "polygon": np.asarray(seg['points']).astype(int).tolist(),
+        "mask": None,
+        "zone": zone_to_dict(seg.get('zone')),
+    }
+    mask = seg.get('mask')
+    if isinstance(mask, CompactMask):
+        record["mask"] = mask.to_rle()
+    return record
+
+def build_record(path, messages, segments, overlap_threshold=0.15, conf_threshold=0.0, models=None):
+    teeth = [seg for seg in segments if seg.get('is_tooth', False)]
+    record = {
+        "version": REPORT_VERSION,
+        "path": path,
+        "name": os.path.basename(path) if path else None,
+        "sha256": None,
+        "created_at": time.time(),
+        "thresholds": {"overlap": overlap_threshold, "confidence": conf_threshold},
+        "models": models if models is not None else model_versions(),
+        "fullness": teeth_fullness([seg['label'] for seg in teeth]) if teeth else [],
+        "messages": list(messages),
+        "teeth": [],
+        "pathologies": [],
+        "extra": [],
+    }
+    if path:
+        try:
+            record["sha256"] = file_hash(path)
+        except OSError:
+            pass
+
+    for seg in teeth:
+        record["teeth"].append({
+            "label": seg['label'],
+            "confidence": seg.get('confidence'),
+            "bbox": seg.get('bbox'),
+            "polygon": np.asarray(seg['points']).astype(int).tolist(),
+            "findings": seg.get('findings', []),
+        })
+    for seg in segments:
+        if seg.get('is_pathology', False):
+            record["pathologies"].append(mask_record(seg))
+        elif seg.get('is_extra', False):
+            record["extra"].append(mask_record(seg))
+    return record
+
+def decode_masks(record):
+    # Маски записи обратно в CompactMask (на месте)
+    for item in record.get("pathologies", []) + record.get("extra", []):
+        if item.get("mask") is not None:
+            item["mask"] = CompactMask.from_rle(item["mask"])
+    return record
+
+def blend_polygon(image, points, rgba):
+    # Заливка многоугольника с прозрачностью только в пределах его bbox
+    pts = np.asarray(points, dtype=np.int32).reshape(-1, 2)
+    if len(pts) < 3:
+        return
+    h, w = image.shape[:2]
+    x0, y0 = max(0, int(pts[:, 0].min())), max(0, int(pts[:, 1].min()))
+    x1, y1 = min(w, int(pts[:, 0].max()) + 1), min(h, int(pts[:, 1].max()) + 1)
+    if x1 <= x0 or y1 <= y0:
+        return
+    region = np.zeros((y1 - y0, x1 - x0), dtype=np.uint8)
+    cv2.fillPoly(region, [pts - (x0, y0)], 1)
+    inside = region.astype(bool)
+    r, g, b, a = rgba
+    roi = image[y0:y1, x0:x1]
+    roi[inside] = (roi[inside] * (1 - a / 255.0) + np.array((b, g, r)) * (a / 255.0)).astype(np.uint8)
+
+def render_overlay(image, segments):
+    # Наложение как на Canvas, но в разрешении снимка: вне зубов
+    # затемнение, зубы подсвечены, патологии и extra залиты цветом
+    # класса, подписаны номера зубов и классы патологий. -> PNG (bytes)
+    scan = as_scan(image)
+    out = scan.bgr.copy()
+    teeth = [seg for seg in segments if seg.get('is_tooth', False)]
+
+    teeth_area = np.zeros(out.shape[:2], dtype=np.uint8)
+    cv2.fillPoly(teeth_area, [np.asarray(seg['points'], dtype=np.int32).reshape(-1, 2) for seg in teeth], 1)
+    inside = teeth_area.astype(bool)
+    out[~inside] = (out[~inside] * (1 - DARKEN_ALPHA / 255.0)).astype(np.uint8)
+    out[inside] = (out[inside] * (1 - TEETH_ALPHA / 255.0) + 255 * (TEETH_ALPHA / 255.0)).astype(np.uint8)
+
+    labels = []
+    for seg in segments:
+        if seg.get('is_pathology', False):
+            blend_polygon(out, seg['points'], CLASS_COLORS.get(seg['label'], DEFAULT_PATHOLOGY_COLOR))
+            # Шрифты OpenCV без кириллицы: на наложении исходное имя класса,
+            # русское название есть в JSON
+            labels.append((seg['points'], seg['label'], (0, 255, 255)))
+        elif seg.get('is_extra', False):
+            blend_polygon(out, seg['points'], CLASS_COLORS.get(seg['label'], DEFAULT_EXTRA_COLOR))
+    for seg in teeth:
+        labels.append((seg['points'], seg['label'].split()[-1], (255, 255, 255)))
+
+    # Размер шрифта от ширины снимка, чтобы подписи читались и на 3000 px
+    font_scale = max(0.5, out.shape[1] / 2000)
+    thickness = max(1, int(round(font_scale * 2)))
+    for points, text, color in labels:
+        pts = np.asarray(points, dtype=np.float32).reshape(-1, 2)
+        if len(pts) == 0:
+            continue
+        cx, cy = pts.mean(axis=0)
+        (tw, th), _ = cv2.getTextSize(text, cv2.FONT_HERSHEY_SIMPLEX, font_scale, thickness)
+        cv2.putText(out, text, (int(cx - tw / 2), int(cy + th / 2)), cv2.FONT_HERSHEY_SIMPLEX,
+                    font_scale, color, thickness, cv2.LINE_AA)
+
+    ok, data = cv2.imencode(".png", out)
+    if not ok:
+        raise OSError("Не удалось закодировать наложение в PNG")
+    return data.tobytes()
+
+class ReportArchive:
+    # Zip-архив отчётов. Центральный каталог zip пишется только при
+    # закрытии, поэтому записи сначала складываются в папку рядом с
+    # архивом (отчёт.zip.parts/): каждая — отдельным файлом, атомарно
+    # (временный файл + os.replace). Запись, которую вернул add(),
+    # переживает аварийную остановку. close() переносит папку в zip:
+    # архив собирается заново во временный файл и подменяет старый.
+    # Незакрытая папка от прерванного запуска подхватывается при
+    # следующем открытии. paths — пути снимков, уже лежащих в архиве
+    def __init__(self, path, mode="a"):
+        self.path = path
+        self.spool = path + ".parts"
+        if mode == "w":
+            shutil.rmtree(self.spool, ignore_errors=True)
+            if os.path.exists(path):
+                os.remove(path)
+        for folder in ("scans", "overlays"):
+            os.makedirs(os.path.join(self.spool, folder), exist_ok=True)
+
+        self.paths = {}  # путь снимка -> имя записи
+        self.count = 0
+        for base, scan_path in self._existing():
+            self.paths[scan_path] = base
+            self.count = max(self.count, int(base.split("_", 1)[0]))
+
+    def _existing(self):
+        # (имя записи, путь снимка) из zip и из папки записей. Путь
+        # хранится в комментарии записи zip, чтобы не читать все JSON
+        if os.path.exists(self.path):
+            with zipfile.ZipFile(self.path) as archive:
+                for info in archive.infolist():
+                    if not info.filename.startswith("scans/"):
+                        continue
+                    scan_path = info.comment.decode("utf-8") if info.comment else json.loads(archive.read(info))["path"]
+                    yield os.path.splitext(os.path.basename(info.filename))[0], scan_path
+        folder = os.path.join(self.spool, "scans")
+        for name in sorted(os.listdir(folder)):
+            if name.endswith(".json"):
+                with open(os.path.join(folder, name), "r", encoding="utf-8") as f:
+                    yield os.path.splitext(name)[0], json.load(f)["path"]
+
+    def add(self, record, overlay=None):
+        # overlay — PNG (bytes) из render_overlay или None. Снимок, который
+        # уже есть в архиве, повторно не пишется
+        if record.get("path") in self.paths:
+            return self.paths[record["path"]]
+        self.count += 1
+        stem = os.path.splitext(record.get("name") or "scan")[0]
+        base = f"{self.count:05d}_{stem}"
+        # JSON пишется последним: наложение без JSON при слиянии пропускается
+        if overlay is not None:
+            record = dict(record, overlay=f"overlays/{base}.png")
+            write_atomic(os.path.join(self.spool, "overlays", base + ".png"), overlay)
+        data = json.dumps(record, ensure_ascii=False, default=json_default).encode("utf-8")
+        write_atomic(os.path.join(self.spool, "scans", base + ".json"), data)
+        self.paths[record.get("path")] = base
+        return base
+
+    def close(self):
+        folder = os.path.join(self.spool, "scans")
+        names = sorted(name for name in os.listdir(folder) if name.endswith(".json"))
+        if names or not os.path.exists(self.path):
+            self._merge(names)
+        shutil.rmtree(self.spool, ignore_errors=True)
+
+    def _merge(self, names):
+        tmp_path = self.path + ".tmp"
+        with zipfile.ZipFile(tmp_path, "w", compression=zipfile.ZIP_DEFLATED) as out:
+            if os.path.exists(self.path):
+                with zipfile.ZipFile(self.path) as old:
+                    for info in old.infolist():
+                        with old.open(info) as src, out.open(info, "w") as dst:
+                            shutil.copyfileobj(src, dst)
+            else:
+                meta = {"version": REPORT_VERSION, "created_at": time.time(), "models": model_versions()}
+                out.writestr("meta.json", json.dumps(meta, ensure_ascii=False, indent=2))
+            for name in names:
+                with open(os.path.join(self.spool, "scans", name), "rb") as f:
+                    data = f.read()
+                record = json.loads(data)
+                if record.get("overlay"):
+                    # PNG уже сжат, повторно его не сжимаем
+                    out.write(os.path.join(self.spool, record["overlay"]), record["overlay"],
+                              compress_type=zipfile.ZIP_STORED)
+                info = zipfile.ZipInfo("scans/" + name, time.localtime()[:6])
+                info.compress_type = zipfile.ZIP_DEFLATED
+                info.comment = (record.get("path") or "").encode("utf-8")
+                out.writestr(info, data)
+        os.replace(tmp_path, self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def write_atomic(path, data):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+def iter_records(path, masks=False):
+    # Записи архива по порядку; masks=True декодирует маски в CompactMask
+    with zipfile.ZipFile(path) as archive:
+        for name in sorted(n for n in archive.namelist() if n.startswith("scans/")):
+            record = json.loads(archive.read(name))
+            yield decode_masks(record) if masks else record
+
+def export_report(path, image, messages, segments, overlap_threshold=0.15, conf_threshold=0.0, overlay=False):
+    # Отчёт одного снимка в отдельный архив (сохранение из GUI)
+    scan = as_scan(image)
+    record = build_record(scan.path, messages, segments, overlap_threshold, conf_threshold)
+    with ReportArchive(path, mode="w") as archive:
+        archive.add(record, render_overlay(scan, segments) if overlay else None)
@@ -0,0 +1,221 @@
+# ai/scan_image.py
+#
+# Снимок, декодированный один раз. Детектор получает BGR-массив,
+# зона интереса вырезается срезом (view) без копии всего снимка,
+# а Canvas строит QImage прямо поверх того же буфера.
+#
+# 16-битные снимки датчиков (TIFF и raw) отображаются в память (memmap).
+# Окно яркости считается по прореженной выборке, превью для Canvas —
+# по срезу с шагом, а полный 8-битный буфер строится один раз, полосами,
+# при первом обращении к bgr. Для raw нужен файл описания рядом со
+# снимком (снимок.raw.yaml или снимок.yaml):
+#
+#   width: 2976
+#   height: 1536
+#   dtype: uint16        # по умолчанию
+#   byteorder: little    # little | big
+#   offset: 0            # размер заголовка в байтах
+#   invert: false        # true, если кость на снимке тёмная
+#   window: [800, 3900]  # необязательно, иначе по перцентилям
+
+import os
+import math
+import threading
+import numpy as np
+import cv2
+import yaml
+from PIL import Image
+
+FULL_DEPTH_EXTENSIONS = (".tif", ".tiff", ".raw")
+
+# Перцентили для автоматического окна и размер выборки для них
+WINDOW_PERCENTILES = (0.5, 99.5)
+WINDOW_SAMPLE = 1 << 20
+# Строк за один шаг перевода в 8 бит (ограничивает временную память)
+WINDOW_BAND = 256
+
+def sample_stride(height, width, target):
+    return max(1, int(math.ceil(math.sqrt(height * width / target))))
+
+def auto_window(raw):
+    k = sample_stride(raw.shape[0], raw.shape[1], WINDOW_SAMPLE)
+    low, high = np.percentile(raw[::k, ::k], WINDOW_PERCENTILES)
+    return float(low), float(max(high, low + 1))
+
+def window_lut(dtype, window, invert=False):
+    # Таблица значение -> 8 бит для целочисленного dtype; для знаковых
+    # типов индекс в ней сдвинут на минимум типа (см. apply_window)
+    info = np.iinfo(dtype)
+    low, high = window
+    values = np.arange(info.min, info.max + 1, dtype=np.float32)
+    lut = np.clip((values - low) * (255.0 / (high - low)), 0, 255).astype(np.uint8)
+    return lut[::-1].copy() if invert else lut
+
+def apply_window(raw, window, invert=False, lut=None):
+    # Перевод в 8 бит полосами: и индексация по таблице, и арифметика
+    # создают временные массивы, поэтому снимок целиком в них не
+    # разворачивается. Целые типы — через таблицу, float — напрямую
+    out = np.empty(raw.shape, dtype=np.uint8)
+    offset = int(np.iinfo(raw.dtype).min) if lut is not None else 0
+    low, high = window
+    for y in range(0, raw.shape[0], WINDOW_BAND):
+        band = raw[y:y + WINDOW_BAND]
+        if lut is not None:
+            out[y:y + WINDOW_BAND] = lut[band.astype(np.int64) - offset] if offset else lut[band]
+            continue
+        band = np.clip((band.astype(np.float32) - low) * (255.0 / (high - low)), 0, 255)
+        out[y:y + WINDOW_BAND] = 255 - band if invert else band
+    return out
+
+class ScanImage:
+    def __init__(self, bgr=None, path=None, raw=None, window=None, invert=False):
+        self._bgr = bgr  # HxWx3 uint8, порядок каналов как у cv2.imread
+        self.path = path
+        # Полная глубина (обычно memmap uint16, HxW) и окно яркости
+        self.raw = raw
+        self.window = window
+        self.invert = invert
+        self._lut = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def open(cls, path):
+        ext = os.path.splitext(path)[1].lower()
+        if ext == ".raw":
+            return open_raw(path)
+        if ext in (".tif", ".tiff"):
+            return open_tiff(path)
+        return cls(decode_file(path, cv2.IMREAD_COLOR | cv2.IMREAD_IGNORE_ORIENTATION), path)
+
+    @classmethod
+    def from_array(cls, data, path=None, window=None, invert=False):
+        # 8-битные массивы берутся как есть, 16-битные серые — с окном.
+        # BGR-буфер должен быть непрерывным: поверх него строится QImage
+        if data.dtype == np.uint8:
+            if data.ndim == 2:
+                data = cv2.cvtColor(data, cv2.COLOR_GRAY2BGR)
+            elif data.shape[2] == 4:
+                data = cv2.cvtColor(data, cv2.COLOR_BGRA2BGR)
+            return cls(np.ascontiguousarray(data), path)
+        if data.ndim == 3:
+            # Многоканальный снимок полной глубины приводится к серому
+            data = data[..., :3].mean(axis=2).astype(data.dtype)
+        return cls(None, path, data, window or auto_window(data), invert)
+
+    @property
+    def full_depth(self):
+        return self.raw is not None
+
+    @property
+    def decoded(self):
+        return self._bgr is not None
+
+    @property
+    def bgr(self):
+        if self._bgr is None:
+            with self._lock:
+                if self._bgr is None:
+                    gray = apply_window(self.raw, self.window, self.invert, self.lut())
+                    self._bgr = cv2.cvtColor(gray, cv2.COLOR_GRAY2BGR)
+        return self._bgr
+
+    def lut(self):
+        # Таблица для целых типов до 16 бит, для остальных — None
+        if self._lut is None and self.raw.dtype.kind in "ui" and self.raw.dtype.itemsize <= 2:
+            self._lut = window_lut(self.raw.dtype, self.window, self.invert)
+        return self._lut
+
+    @property
+    def width(self):
+        return (self.raw if self._bgr is None else self._bgr).shape[1]
+
+    @property
+    def height(self):
+        return (self.raw if self._bgr is None else self._bgr).shape[0]
+
+    @property
+    def size(self):
+        return self.width, self.height
+
+    def preview(self, max_side=2048):
+        # Уменьшенная 8-битная копия срезом с шагом: для снимка полной
+        # глубины читается только каждая k-я строка и столбец
+        k = max(1, int(math.ceil(max(self.width, self.height) / max_side)))
+        if self._bgr is not None:
+            return np.ascontiguousarray(self._bgr[::k, ::k])
+        gray = apply_window(self.raw[::k, ::k], self.window, self.invert, self.lut())
+        return cv2.cvtColor(gray, cv2.COLOR_GRAY2BGR)
+
+    def crop(self, x0, y0, x1, y1):
+        # Срез без копирования
+        return self.bgr[y0:y1, x0:x1]
+
+    def to_pil(self, box=None):
+        # RGB-копия только нужной области (по умолчанию всего снимка)
+        view = self.bgr if box is None else self.crop(*box)
+        return Image.fromarray(cv2.cvtColor(view, cv2.COLOR_BGR2RGB))
+
+def decode_file(path, flags):
+    # np.fromfile + imdecode, а не cv2.imread: imread не открывает
+    # пути с кириллицей в Windows. Ориентация из EXIF не применяется —
+    # как в PIL и QImage, чтобы координаты совпадали с показанным снимком
+    try:
+        data = np.fromfile(path, dtype=np.uint8)
+    except OSError:
+        data = np.zeros(0, dtype=np.uint8)
+    image = cv2.imdecode(data, flags) if data.size else None
+    if image is None:
+        raise OSError(f"Не удалось открыть файл: {path}")
+    return image
+
+def read_sidecar(path):
+    for candidate in (path + ".yaml", os.path.splitext(path)[0] + ".yaml"):
+        if os.path.exists(candidate):
+            with open(candidate, "r", encoding="utf-8") as f:
+                return yaml.safe_load(f) or {}
+    return None
+
+def open_raw(path):
+    meta = read_sidecar(path)
+    if not meta or "width" not in meta or "height" not in meta:
+        raise OSError(f"Для {path} нужен файл описания с width и height (снимок.raw.yaml)")
+    dtype = np.dtype(meta.get("dtype", "uint16"))
+    dtype = dtype.newbyteorder("<" if meta.get("byteorder", "little") == "little" else ">")
+    try:
+        raw = np.memmap(path, dtype=dtype, mode="r", offset=int(meta.get("offset", 0)),
+                        shape=(int(meta["height"]), int(meta["width"])))
+    except (OSError, ValueError) as e:
+        raise OSError(f"Не удалось открыть файл: {path} ({e})")
+    window = tuple(meta["window"]) if meta.get("window") else None
+    return ScanImage.from_array(raw, path, window, bool(meta.get("invert", False)))
+
+def open_tiff(path):
+    # tifffile (необязательная зависимость) отображает несжатый TIFF
+    # в память; без него или для сжатого файла снимок читается целиком
+    # один раз через OpenCV
+    meta = read_sidecar(path) or {}
+    window = tuple(meta["window"]) if meta.get("window") else None
+    invert = bool(meta.get("invert", False))
+    try:
+        import tifffile
+    except ImportError:
+        tifffile = None
+
+    data = None
+    if tifffile is not None:
+        try:
+            with tifffile.TiffFile(path) as tif:
+                invert = invert or tif.pages[0].photometric == tifffile.PHOTOMETRIC.MINISWHITE
+            data = tifffile.memmap(path, mode="r")
+        except (OSError, ValueError, tifffile.TiffFileError):
+            data = None
+        if data is not None and data.dtype == np.uint8 and data.ndim == 3:
+            data = cv2.cvtColor(np.asarray(data[..., :3]), cv2.COLOR_RGB2BGR)
+
+    if data is None:
+        data = decode_file(path, cv2.IMREAD_UNCHANGED | cv2.IMREAD_IGNORE_ORIENTATION)
+    return ScanImage.from_array(data, path, window, invert)
+
+def as_scan(image):
+    # Путь или уже открытый ScanImage
+    return image if isinstance(image, ScanImage) else ScanImage.open(image)
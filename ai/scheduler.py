@@ -0,0 +1,162 @@
+# ai/scheduler.py
+#
+# Микробатчинг для одновременных запросов (сервер анализа, несколько
+# потоков): запросы к YOLO и UNet из разных потоков собираются в общие
+# батчи. Батч уходит в модель, как только набран max_batch_size или
+# истёк max_wait_ms с момента поступления первого запроса в нём, —
+# одиночный запрос ждёт не дольше max_wait_ms.
+#
+#   scheduler = get_scheduler()
+#   diagnose_image(path, scheduler=scheduler)   # из любого числа потоков
+
+import time
+import queue
+import threading
+from collections import deque
+from concurrent.futures import Future
+
+from ai import trace
+from ai.config import get_config
+from ai.scan_image import as_scan
+
+# Число последних задержек, по которым считаются перцентили
+# (здесь и в метриках ai/server.py)
+LATENCY_WINDOW = 1000
+
+def latency_summary(latencies):
+    # Задержки в секундах -> перцентили в мс (None, пока задержек нет)
+    latencies = sorted(latencies)
+    def percentile(p):
+        return latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000 if latencies else None
+    return {"p50": percentile(0.5), "p95": percentile(0.95), "max": percentile(1.0)}
+
+class _Request:
+    __slots__ = ("item", "future", "submitted")
+
+    def __init__(self, item):
+        self.item = item
+        self.future = Future()
+        self.submitted = time.perf_counter()
+
+class MicroBatcher:
+    # Один поток-диспетчер на модель: fn(список входов) -> список
+    # результатов той же длины. Результат каждого запроса возвращается
+    # через его Future; задержка (ожидание + прогон) пишется в статистику
+    def __init__(self, name, fn, max_batch_size=8, max_wait_ms=10):
+        self.name = name
+        self.fn = fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self._batches = 0
+        self._items = 0
+        self._thread = threading.Thread(target=self._run, name=f"batcher-{name}", daemon=True)
+        self._thread.start()
+
+    def submit(self, item):
+        request = _Request(item)
+        self._queue.put(request)
+        return request.future
+
+    def __call__(self, item):
+        return self.submit(item).result()
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+
+    def _collect(self, first):
+        batch = [first]
+        deadline = first.submitted + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.perf_counter()
+            try:
+                request = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if request is None:
+                # Закрытие: дорабатываем собранное и выходим после него
+                self._queue.put(None)
+                break
+            batch.append(request)
+        return batch
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            if first is None:
+                return
+            batch = [r for r in self._collect(first) if r.future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            # Любой сбой батча, в том числе BaseException из fn и неполный
+            # ответ, завершает Future всех его запросов: иначе они ждали бы вечно
+            try:
+                with trace.span(f"batch.{self.name}", size=len(batch)):
+                    outputs = list(self.fn([r.item for r in batch]))
+                if len(outputs) != len(batch):
+                    raise RuntimeError(f"batch.{self.name}: {len(outputs)} результатов на {len(batch)} запросов")
+            except BaseException as e:
+                for request in batch:
+                    request.future.set_exception(e)
+                continue
+
+            now = time.perf_counter()
+            with self._lock:
+                self._batches += 1
+                self._items += len(batch)
+                for request in batch:
+                    self._latencies.append(now - request.submitted)
+            trace.count(f"batch.{self.name}.items", len(batch))
+            for request, output in zip(batch, outputs):
+                request.future.set_result(output)
+
+    def stats(self):
+        with self._lock:
+            latencies = list(self._latencies)
+            batches, items = self._batches, self._items
+        return {
+            "batches": batches,
+            "requests": items,
+            "mean_batch_size": items / batches if batches else None,
+            "latency_ms": latency_summary(latencies),
+        }
+
+class Scheduler:
+    # Батчеры для двух моделей конвейера; detect и segment
+    # подставляются в run_models вместо одиночных вызовов
+    def __init__(self, max_batch_size=8, max_wait_ms=10):
+        from ai.teeth_detect import predict_teeth_batch
+        from ai.diagnosis import segment_zones
+
+        self.teeth = MicroBatcher("teeth", predict_teeth_batch, max_batch_size, max_wait_ms)
+        self.seg = MicroBatcher("seg", segment_zones, max_batch_size, max_wait_ms)
+
+    def detect(self, image):
+        # Декодирование — в потоке запроса, в батч идёт готовый BGR-массив
+        return self.teeth(as_scan(image).bgr)
+
+    def segment(self, crop):
+        return self.seg(crop)
+
+    def stats(self):
+        return {"teeth": self.teeth.stats(), "seg": self.seg.stats()}
+
+    def close(self):
+        self.teeth.close()
+        self.seg.close()
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+def get_scheduler():
+    # Общий планировщик процесса с параметрами из конфига
+    # (batch_max_size, batch_max_wait_ms)
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            config = get_config()
+            _scheduler = Scheduler(config["batch_max_size"], config["batch_max_wait_ms"])
+    return _scheduler
@@ -0,0 +1,261 @@
+# ai/server.py
+#
+# Сервер инференса: модели загружаются один раз, а рабочие места
+# отправляют снимки по HTTP (клиент — ai/remote.py):
+#   python -m ai.server [--host 0.0.0.0] [--port 8765] [--queue 16] [--workers 1] [--token секрет]
+#                       [--batch-size 8] [--max-wait-ms 10]
+#
+#   POST /diagnose?overlap_threshold=..&conf_threshold=..  тело — файл снимка
+#   GET  /health   состояние моделей (loading, ok, error) и очереди
+#   GET  /metrics  счётчики запросов и задержки (JSON)
+#
+# Очередь ограничена: если она заполнена, сервер сразу отвечает 503
+# с Retry-After, а не копит запросы без предела. При --batch-size больше 1
+# одновременные снимки проходят через YOLO и UNet общими батчами
+# (ai/scheduler.py), а число потоков анализа не меньше размера батча.
+# По умолчанию сервер
+# слушает только localhost; для сети клиники нужен --host 0.0.0.0
+# и желательно --token.
+
+import os
+import sys
+import json
+import time
+import queue
+import shutil
+import argparse
+import tempfile
+import threading
+from collections import deque
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+from ai.diagnosis import warmup, diagnose_image
+from ai.cache import get_cache
+from ai.config import get_config
+from ai.remote import encode_result
+from ai.scheduler import Scheduler, LATENCY_WINDOW, latency_summary
+
+MAX_UPLOAD_BYTES = 200 << 20
+# Пауза (с), которую сервер называет клиенту, пока загружает модели
+LOADING_RETRY_AFTER = 5
+
+class InferenceService:
+    # Очередь заданий и рабочие потоки, которые по очереди
+    # выполняют diagnose_image над загруженными снимками
+    def __init__(self, queue_size=16, workers=1, cache=None, batch_size=1, max_wait_ms=10):
+        self.scheduler = None
+        if batch_size > 1:
+            self.scheduler = Scheduler(batch_size, max_wait_ms)
+            workers = max(workers, batch_size)
+        self.jobs = queue.Queue(maxsize=queue_size)
+        self.queue_size = queue_size
+        self.cache = cache
+        self.tmp_dir = tempfile.mkdtemp(prefix="opg_server_")
+        self.models_ready = False
+        self.load_error = None
+        self.started = time.time()
+        self._lock = threading.Lock()
+        self.counters = {"accepted": 0, "rejected": 0, "completed": 0, "failed": 0}
+        self.in_flight = 0
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.workers = [threading.Thread(target=self._work, daemon=True) for _ in range(workers)]
+
+    def start(self):
+        # Вызывается в фоновом потоке после того, как сервер начал
+        # слушать порт: пока модели грузятся, /health отвечает "loading"
+        try:
+            warmup()
+        except Exception as e:
+            self.load_error = str(e)
+            print(f"Ошибка загрузки моделей: {e}")
+            return
+        self.models_ready = True
+        for worker in self.workers:
+            worker.start()
+        print("Модели загружены")
+
+    def submit(self, data, name, overlap_threshold, conf_threshold):
+        # Возвращает Future или None, если очередь заполнена
+        future = Future()
+        try:
+            self.jobs.put_nowait((data, name, overlap_threshold, conf_threshold, future, time.perf_counter()))
+        except queue.Full:
+            with self._lock:
+                self.counters["rejected"] += 1
+            return None
+        with self._lock:
+            self.counters["accepted"] += 1
+        return future
+
+    def _work(self):
+        while True:
+            data, name, overlap_threshold, conf_threshold, future, submitted = self.jobs.get()
+            with self._lock:
+                self.in_flight += 1
+            # Конвейер работает с путями, поэтому снимок пишется во
+            # временный файл с исходным расширением
+            ext = os.path.splitext(name)[1] or ".png"
+            fd, path = tempfile.mkstemp(suffix=ext, dir=self.tmp_dir)
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    f.write(data)
+                result = diagnose_image(path, overlap_threshold, conf_threshold, cache=self.cache, scheduler=self.scheduler)
+                future.set_result(result)
+                outcome = "completed"
+            except Exception as e:
+                future.set_exception(e)
+                outcome = "failed"
+            finally:
+                os.remove(path)
+                with self._lock:
+                    self.in_flight -= 1
+                    self.counters[outcome] += 1
+                    self.latencies.append(time.perf_counter() - submitted)
+
+    def retry_after(self):
+        # Оценка ожидания: очередь x средняя задержка / число потоков
+        with self._lock:
+            mean = sum(self.latencies) / len(self.latencies) if self.latencies else 1.0
+        return max(1, round(self.jobs.qsize() * mean / len(self.workers)))
+
+    def health(self):
+        status = "ok" if self.models_ready else "error" if self.load_error else "loading"
+        health = {
+            "status": status,
+            "queue": self.jobs.qsize(),
+            "queue_capacity": self.queue_size,
+            "in_flight": self.in_flight,
+        }
+        if self.load_error:
+            health["error"] = self.load_error
+        return health
+
+    def metrics(self):
+        with self._lock:
+            latencies = list(self.latencies)
+            counters = dict(self.counters)
+        metrics = dict(
+            counters,
+            uptime_s=time.time() - self.started,
+            queue=self.jobs.qsize(),
+            queue_capacity=self.queue_size,
+            in_flight=self.in_flight,
+            workers=len(self.workers),
+            latency_ms=latency_summary(latencies),
+        )
+        if self.scheduler is not None:
+            metrics["batching"] = self.scheduler.stats()
+        return metrics
+
+    def close(self):
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+class RequestHandler(BaseHTTPRequestHandler):
+    service = None
+    token = ""
+
+    def send_json(self, code, payload, headers=None):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def authorized(self):
+        if self.token and self.headers.get("X-OPG-Token") != self.token:
+            self.send_json(401, {"error": "неверный токен"})
+            return False
+        return True
+
+    def do_GET(self):
+        if not self.authorized():
+            return
+        path = urlparse(self.path).path
+        if path == "/health":
+            self.send_json(200, self.service.health())
+        elif path == "/metrics":
+            self.send_json(200, self.service.metrics())
+        else:
+            self.send_json(404, {"error": "не найдено"})
+
+    def do_POST(self):
+        if not self.authorized():
+            return
+        url = urlparse(self.path)
+        if url.path != "/diagnose":
+            self.send_json(404, {"error": "не найдено"})
+            return
+        length = int(self.headers.get("Content-Length", 0))
+        if length <= 0 or length > MAX_UPLOAD_BYTES:
+            self.send_json(413, {"error": "пустой или слишком большой снимок"})
+            return
+        data = self.rfile.read(length)
+        if self.service.load_error:
+            self.send_json(500, {"error": f"модели не загружены: {self.service.load_error}"})
+            return
+        if not self.service.models_ready:
+            # Клиент повторит запрос после паузы, как при заполненной очереди
+            self.send_json(503, {"error": "модели загружаются"}, {"Retry-After": str(LOADING_RETRY_AFTER)})
+            return
+
+        params = parse_qs(url.query)
+        try:
+            overlap_threshold = float(params.get("overlap_threshold", ["0.15"])[0])
+            conf_threshold = float(params.get("conf_threshold", ["0.0"])[0])
+        except ValueError:
+            self.send_json(400, {"error": "некорректные пороги"})
+            return
+        name = os.path.basename(params.get("name", ["scan.png"])[0])
+
+        future = self.service.submit(data, name, overlap_threshold, conf_threshold)
+        if future is None:
+            self.send_json(503, {"error": "очередь заполнена"}, {"Retry-After": str(self.service.retry_after())})
+            return
+        try:
+            messages, segments = future.result()
+        except Exception as e:
+            self.send_json(500, {"error": str(e)})
+            return
+        self.send_json(200, encode_result(messages, segments))
+
+    def log_message(self, format, *args):
+        # Журнал запросов http.server шумный; ошибки видны в ответах и /metrics
+        pass
+
+def serve(host="127.0.0.1", port=8765, queue_size=16, workers=1, token="", use_cache=True, batch_size=1, max_wait_ms=10):
+    service = InferenceService(queue_size, workers, get_cache() if use_cache else None, batch_size, max_wait_ms)
+    handler = type("Handler", (RequestHandler,), {"service": service, "token": token})
+    server = ThreadingHTTPServer((host, port), handler)
+    print(f"Сервер анализа: http://{host}:{port} (очередь {queue_size}, потоков {len(service.workers)}, батч {batch_size})")
+    print("Загрузка моделей...")
+    threading.Thread(target=service.start, name="warmup", daemon=True).start()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+
+def main(argv=None):
+    config = get_config()
+    parser = argparse.ArgumentParser(description="Сервер инференса для нескольких рабочих мест")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--queue", type=int, default=16, help="максимум ожидающих снимков")
+    parser.add_argument("--workers", type=int, default=1, help="потоков анализа")
+    parser.add_argument("--token", default=os.environ.get("OPG_SERVER_TOKEN", ""))
+    parser.add_argument("--no-cache", action="store_true")
+    parser.add_argument("--batch-size", type=int, default=config["batch_max_size"], help="1 — без микробатчинга")
+    parser.add_argument("--max-wait-ms", type=float, default=config["batch_max_wait_ms"])
+    args = parser.parse_args(argv)
+    serve(args.host, args.port, args.queue, args.workers, args.token, not args.no_cache, args.batch_size, args.max_wait_ms)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
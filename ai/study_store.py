@@ -0,0 +1,189 @@
+# ai/study_store.py
+#
+# Локальное хранилище проанализированных снимков. Метаданные и находки
+# лежат в SQLite (индексы по пути, дате и находке), а сами результаты
+# (сообщения и геометрия сегментов) — в отдельном blob-файле, куда они
+# только дописываются; в базе хранится смещение и длина записи.
+# Выходы моделей (ModelOutputs) — отдельная запись того же файла: смена
+# порогов перезаписывает только результат, выходы пишутся один раз.
+
+import os
+import time
+import zlib
+import pickle
+import sqlite3
+import threading
+
+DEFAULT_STORE_DIR = os.path.join(os.path.expanduser("~"), ".opg_scanner")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS studies (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    path TEXT NOT NULL,
+    name TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    n_findings INTEGER NOT NULL,
+    blob_offset INTEGER NOT NULL,
+    blob_length INTEGER NOT NULL,
+    outputs_offset INTEGER,
+    outputs_length INTEGER,
+    overlap_threshold REAL,
+    conf_threshold REAL
+);
+CREATE TABLE IF NOT EXISTS findings (
+    study_id INTEGER NOT NULL REFERENCES studies(id),
+    tooth TEXT NOT NULL,
+    label TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_studies_path ON studies(path);
+CREATE INDEX IF NOT EXISTS idx_studies_created ON studies(created_at);
+CREATE INDEX IF NOT EXISTS idx_findings_label ON findings(label, study_id);
+CREATE INDEX IF NOT EXISTS idx_findings_study ON findings(study_id);
+"""
+
+# Колонки, которых нет в базах прежних версий: добавляются при открытии
+ADDED_COLUMNS = [
+    ("outputs_offset", "INTEGER"),
+    ("outputs_length", "INTEGER"),
+    ("overlap_threshold", "REAL"),
+    ("conf_threshold", "REAL"),
+]
+
+class StudyStore:
+    def __init__(self, store_dir=DEFAULT_STORE_DIR):
+        os.makedirs(store_dir, exist_ok=True)
+        self.db_path = os.path.join(store_dir, "studies.sqlite")
+        self.blob_path = os.path.join(store_dir, "studies.blob")
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(SCHEMA)
+        columns = [row[1] for row in self._db.execute("PRAGMA table_info(studies)")]
+        with self._db:
+            for name, kind in ADDED_COLUMNS:
+                if name not in columns:
+                    self._db.execute(f"ALTER TABLE studies ADD COLUMN {name} {kind}")
+        self._blob = open(self.blob_path, "a+b")
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+            self._blob.close()
+
+    def _append(self, value):
+        # Под self._lock -> (смещение, длина) записи в blob-файле
+        data = zlib.compress(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL), 1)
+        self._blob.seek(0, os.SEEK_END)
+        offset = self._blob.tell()
+        self._blob.write(data)
+        self._blob.flush()
+        return offset, len(data)
+
+    def _read(self, offset, length):
+        self._blob.seek(offset)
+        return self._blob.read(length)
+
+    def add_study(self, path, messages, segments, outputs=None, thresholds=None):
+        # outputs — ModelOutputs анализа; без них (сервер анализа)
+        # пороги для записи изменить нельзя. thresholds —
+        # (overlap_threshold, conf_threshold), с которыми получен результат
+        findings = find_labels(segments)
+        overlap_threshold, conf_threshold = thresholds or (None, None)
+        with self._lock:
+            offset, length = self._append((messages, segments))
+            outputs_offset, outputs_length = self._append(outputs) if outputs is not None else (None, None)
+            with self._db:
+                cur = self._db.execute(
+                    "INSERT INTO studies (path, name, created_at, n_findings, blob_offset, blob_length, "
+                    "outputs_offset, outputs_length, overlap_threshold, conf_threshold) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (path, os.path.basename(path), time.time(), len(findings), offset, length,
+                     outputs_offset, outputs_length, overlap_threshold, conf_threshold),
+                )
+                study_id = cur.lastrowid
+                self._db.executemany(
+                    "INSERT INTO findings (study_id, tooth, label) VALUES (?, ?, ?)",
+                    [(study_id, tooth, label) for tooth, label in findings],
+                )
+        return study_id
+
+    def update_study(self, study_id, messages, segments, thresholds):
+        # Результат той же записи после смены порогов: новая запись в
+        # blob-файле, строка и находки в базе заменяются, выходы моделей
+        # остаются прежними
+        findings = find_labels(segments)
+        with self._lock:
+            offset, length = self._append((messages, segments))
+            with self._db:
+                self._db.execute(
+                    "UPDATE studies SET n_findings = ?, blob_offset = ?, blob_length = ?, "
+                    "overlap_threshold = ?, conf_threshold = ? WHERE id = ?",
+                    (len(findings), offset, length, thresholds[0], thresholds[1], study_id),
+                )
+                self._db.execute("DELETE FROM findings WHERE study_id = ?", (study_id,))
+                self._db.executemany(
+                    "INSERT INTO findings (study_id, tooth, label) VALUES (?, ?, ?)",
+                    [(study_id, tooth, label) for tooth, label in findings],
+                )
+
+    def recent(self, limit=200, offset=0):
+        # (id, path, name, created_at, n_findings), новые сверху
+        with self._lock:
+            return self._db.execute(
+                "SELECT id, path, name, created_at, n_findings FROM studies "
+                "ORDER BY created_at DESC LIMIT ? OFFSET ?",
+                (limit, offset),
+            ).fetchall()
+
+    def find_by_path(self, path, limit=20):
+        with self._lock:
+            return self._db.execute(
+                "SELECT id, path, name, created_at, n_findings FROM studies "
+                "WHERE path = ? ORDER BY created_at DESC LIMIT ?",
+                (path, limit),
+            ).fetchall()
+
+    def find_by_finding(self, label, limit=200):
+        with self._lock:
+            return self._db.execute(
+                "SELECT DISTINCT s.id, s.path, s.name, s.created_at, s.n_findings "
+                "FROM findings f JOIN studies s ON s.id = f.study_id "
+                "WHERE f.label = ? ORDER BY s.created_at DESC LIMIT ?",
+                (label, limit),
+            ).fetchall()
+
+    def load(self, study_id):
+        # -> (path, messages, segments, outputs, thresholds) или None;
+        # outputs и thresholds — None, если не сохранены
+        with self._lock:
+            row = self._db.execute(
+                "SELECT path, blob_offset, blob_length, outputs_offset, outputs_length, "
+                "overlap_threshold, conf_threshold FROM studies WHERE id = ?",
+                (study_id,),
+            ).fetchone()
+            if row is None:
+                return None
+            path, offset, length, outputs_offset, outputs_length, overlap_threshold, conf_threshold = row
+            data = self._read(offset, length)
+            outputs_data = self._read(outputs_offset, outputs_length) if outputs_offset is not None else None
+        messages, segments = pickle.loads(zlib.decompress(data))
+        outputs = pickle.loads(zlib.decompress(outputs_data)) if outputs_data is not None else None
+        thresholds = (overlap_threshold, conf_threshold) if overlap_threshold is not None else None
+        return path, messages, segments, outputs, thresholds
+
+def find_labels(segments):
+    # (зуб, находка) для таблицы findings
+    return [
+        (seg['label'], finding['label'])
+        for seg in segments if seg.get('is_tooth', False)
+        for finding in seg.get('findings', [])
+    ]
+
+_default_store = None
+
+def get_store():
+    # Общее хранилище процесса; папка задаётся через OPG_STORE_DIR
+    global _default_store
+    if _default_store is None:
+        _default_store = StudyStore(os.environ.get("OPG_STORE_DIR", DEFAULT_STORE_DIR))
+    return _default_store
@@ -2,62 +2,108 @@
 
 import os
 import yaml
-from collections import namedtuple
-from ultralytics import YOLO
+import numpy as np
+import threading
 
-# Полный список классов
+from ai import trace
+from ai.scan_image import ScanImage
+from ai.teeth_set import ToothSet
+from ai.engines import load_teeth_engine
+
+# Полный список классов. Имена классов есть и в самих весах YOLO
+# (results.names), поэтому data.yaml датасета читается только при первой
+# необходимости и может отсутствовать (например, в копии без данных)
 yaml_path = "ai/yolo_data/dataset/data.yaml"
-with open(yaml_path, "r", encoding="utf-8") as f:
-    data_yaml = yaml.safe_load(f)
-CLASS_NAMES = data_yaml["names"]  
+CLASS_NAMES = None
+
+def get_class_names():
+    global CLASS_NAMES
+    if CLASS_NAMES is None:
+        try:
+            with open(yaml_path, "r", encoding="utf-8") as f:
+                CLASS_NAMES = yaml.safe_load(f)["names"]
+        except (OSError, KeyError, TypeError) as e:
+            raise RuntimeError(f"Имена классов YOLO не найдены: нет {yaml_path} и results.names ({e})")
+    return CLASS_NAMES
+
+# Модель YOLO сегментации загружается при первом обращении:
+# импорт ultralytics и чтение весов занимают несколько секунд.
+# Бэкенд (PyTorch или ONNX Runtime) задаётся в конфиге, см. ai/engines.py
+WEIGHTS_PATH = "ai/yolo_data/best.pt"
+model = None
+_model_lock = threading.Lock()
+
+def get_model():
+    global model
+    with _model_lock:
+        if model is None:
+            model = load_teeth_engine(WEIGHTS_PATH)
+    return model
+
+def parse_result(results):
+    trace.debug("YOLO result names: %s", getattr(results, 'names', None))
+    trace.debug("YOLO boxes.cls: %s", getattr(results.boxes, 'cls', None))
+    trace.debug("YOLO boxes.conf: %s", getattr(results.boxes, 'conf', None))
+    trace.debug("YOLO masks.xy: %s", getattr(getattr(results, 'masks', None), 'xy', None))
 
-# Загрузка модели YOLO сегментации
-model = YOLO("ai/yolo_data/best.pt")
+    # Обработка случая без обнаружений
+    if not hasattr(results, 'masks') or results.masks is None:
+        return ToothSet.empty()
 
-def predict_teeth(image_path):
+    # Python-объекты создаются только на уровне зубов, вершины остаются
+    # в массивах; дубликаты метки отсеиваются по уверенности
+    polygons = results.masks.xy
+    classes = results.boxes.cls.cpu().numpy().astype(np.int64)
+    if results.boxes.conf is not None:
+        confidences = results.boxes.conf.cpu().numpy().astype(np.float32)
+    else:
+        confidences = np.zeros(len(classes), dtype=np.float32)
+
+    names = getattr(results, 'names', None) or get_class_names()
+    labels = [names[int(c)] for c in classes]
+    keep = [
+        i for i, label in enumerate(labels)
+        if len(polygons[i]) >= 3 and label.lower().startswith('tooth')
+    ]
+    teeth = ToothSet.from_polygons(
+        [polygons[i] for i in keep], [labels[i] for i in keep], confidences[keep]
+    ).dedup()
+    trace.count("teeth.detected", len(teeth))
+    return teeth
+
+def predict_teeth(image):
+    # image — путь или ScanImage; уже декодированный снимок
+    # передаётся в YOLO массивом и повторно не читается
     try:
-        # Проверка существования файла
-        if not os.path.exists(image_path):
-            return "Файл не найден", []
+        if isinstance(image, ScanImage):
+            source = image.bgr
+        else:
+            # Проверка существования файла
+            if not os.path.exists(image):
+                return ToothSet.empty()
+            source = image
 
         # Выполнение предсказания
-        results = model(image_path)[0]
-        
-        print("YOLO result names:", getattr(results, 'names', None))
-        print("YOLO boxes.cls:", getattr(results.boxes, 'cls', None))
-        print("YOLO boxes.conf:", getattr(results.boxes, 'conf', None))
-        print("YOLO masks.xy:", getattr(getattr(results, 'masks', None), 'xy', None))
-
-        # Обработка случая без обнаружений
-        if not hasattr(results, 'masks') or results.masks is None:
-            return []
-        
-        segments = []
-        conf_scores = []
-        if results.boxes.conf is not None:
-            conf_scores = results.boxes.conf.cpu().numpy().tolist()
-
-        for i, (mask, cls) in enumerate(zip(results.masks.xy, results.boxes.cls)):
-            try:
-                points = [(int(x), int(y)) for x, y in mask]
-                if len(points) < 3:
-                    continue
-                label = CLASS_NAMES[int(cls)]
-                conf = float(conf_scores[i]) if i < len(conf_scores) else 0.0
-                if label.lower().startswith('tooth'):
-                    segments.append({'points': points, 'label': label})
-            except Exception as mask_error:
-                print(f"Ошибка обработки маски {i}: {mask_error}")
-                continue
-
-        unique_segments = {}
-        for seg in segments:
-            lbl = seg['label']
-            conf = seg.get('confidence', 0.0)
-            if lbl not in unique_segments or conf > unique_segments[lbl].get('confidence', 0.0):
-                unique_segments[lbl] = seg
-        return list(unique_segments.values())
-        
+        model = get_model()
+        with trace.span("teeth.infer"):
+            results = model(source, verbose=trace.active())[0]
+        with trace.span("teeth.parse"):
+            return parse_result(results)
+
     except Exception as e:
         print(f"Ошибка при анализе изображения: {str(e)}")
-        return []
\ No newline at end of file
+        return ToothSet.empty()
+
+def predict_teeth_batch(images):
+    # images — список BGR-массивов (как из cv2.imread): ultralytics
+    # собирает список массивов в один батч и прогоняет его за один вызов.
+    # Ошибка модели не превращается в пустой результат: пакетная обработка
+    # записывает её и повторяет снимки при следующем запуске, планировщик
+    # передаёт её ожидающим запросам
+    if not images:
+        return []
+    model = get_model()
+    with trace.span("teeth.infer", batch=len(images)):
+        results = model(list(images), verbose=False)
+    with trace.span("teeth.parse", batch=len(images)):
+        return [parse_result(r) for r in results]
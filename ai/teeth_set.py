@@ -0,0 +1,115 @@
+# ai/teeth_set.py
+
+import numpy as np
+
+class ToothSet:
+    # Зубы одного снимка в массивах: вершины всех контуров подряд
+    # (int32, Nx2) и смещения начала каждого зуба, метки FDI,
+    # уверенности и bbox (x0, y0, x1, y1, включительно).
+    # Доступ по индексу и итерация дают словари как раньше
+    # ({'points', 'label', 'confidence', 'bbox'}), но points — срез
+    # общего буфера, а не список кортежей
+    __slots__ = ("vertices", "offsets", "labels", "confidences", "bboxes")
+
+    def __init__(self, vertices, offsets, labels, confidences, bboxes):
+        self.vertices = vertices
+        self.offsets = offsets
+        self.labels = list(labels)
+        self.confidences = confidences
+        self.bboxes = bboxes
+
+    @classmethod
+    def empty(cls):
+        return cls(
+            np.zeros((0, 2), dtype=np.int32), np.zeros(1, dtype=np.int64), [],
+            np.zeros(0, dtype=np.float32), np.zeros((0, 4), dtype=np.int32),
+        )
+
+    @classmethod
+    def from_polygons(cls, polygons, labels, confidences):
+        # polygons — список массивов Kx2 (как masks.xy у ultralytics).
+        # Координаты отбрасывают дробную часть, как int() раньше
+        if not polygons:
+            return cls.empty()
+        lengths = np.array([len(p) for p in polygons], dtype=np.int64)
+        offsets = np.zeros(len(polygons) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        vertices = np.concatenate([np.asarray(p, dtype=np.float32).reshape(-1, 2) for p in polygons]).astype(np.int32)
+        starts = offsets[:-1]
+        bboxes = np.column_stack([
+            np.minimum.reduceat(vertices[:, 0], starts), np.minimum.reduceat(vertices[:, 1], starts),
+            np.maximum.reduceat(vertices[:, 0], starts), np.maximum.reduceat(vertices[:, 1], starts),
+        ]).astype(np.int32)
+        return cls(vertices, offsets, labels, np.asarray(confidences, dtype=np.float32), bboxes)
+
+    @classmethod
+    def from_segments(cls, segments):
+        # Из списка словарей {'points', 'label'[, 'confidence']}
+        if isinstance(segments, ToothSet):
+            return segments
+        return cls.from_polygons(
+            [seg['points'] for seg in segments],
+            [seg['label'] for seg in segments],
+            [seg.get('confidence', 0.0) for seg in segments],
+        )
+
+    def select(self, indices):
+        indices = np.asarray(indices, dtype=np.int64)
+        if len(indices) == 0:
+            return ToothSet.empty()
+        starts, ends = self.offsets[indices], self.offsets[indices + 1]
+        lengths = ends - starts
+        offsets = np.zeros(len(indices) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        # Индексы вершин выбранных зубов одним массивом, без цикла по зубам
+        rows = np.repeat(starts - offsets[:-1], lengths) + np.arange(offsets[-1])
+        return ToothSet(
+            self.vertices[rows], offsets, [self.labels[i] for i in indices],
+            self.confidences[indices], self.bboxes[indices],
+        )
+
+    def dedup(self):
+        # По одному зубу на метку FDI — с наибольшей уверенностью
+        # (при равной — первый найденный). Порядок зубов сохраняется
+        if len(self) == 0:
+            return self
+        labels = np.array(self.labels)
+        order = np.lexsort((np.arange(len(self)), -self.confidences, labels))
+        sorted_labels = labels[order]
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = sorted_labels[1:] != sorted_labels[:-1]
+        keep = np.sort(order[first])
+        return self if len(keep) == len(self) else self.select(keep)
+
+    def _index(self, i):
+        # Отрицательный индекс — с конца, как у списка: срез offsets[-1]:offsets[0]
+        # дал бы пустой контур
+        n = len(self)
+        if not -n <= i < n:
+            raise IndexError(f"Нет зуба с индексом {i} (зубов: {n})")
+        return i + n if i < 0 else i
+
+    def points(self, i):
+        i = self._index(i)
+        return self.vertices[self.offsets[i]:self.offsets[i + 1]]
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return self.select(np.arange(len(self))[i])
+        i = self._index(i)
+        return {
+            'points': self.points(i),
+            'label': self.labels[i],
+            'confidence': float(self.confidences[i]),
+            'bbox': tuple(int(v) for v in self.bboxes[i]),
+        }
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __repr__(self):
+        return f"ToothSet({len(self)} зубов: {', '.join(self.labels)})"
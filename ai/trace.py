@@ -0,0 +1,129 @@
+# ai/trace.py
+#
+# Трассировка конвейера: именованные интервалы (span), счётчики и
+# отладочные сообщения. Включается в config.yaml:
+#
+#   trace: true
+#   trace_path: trace.json   # Chrome trace (chrome://tracing, Perfetto), пишется при выходе
+#   trace_log: true          # интервалы и отладка в лог "opg" (stderr)
+#
+# Выключенная трассировка почти ничего не стоит: span() отдаёт один и тот
+# же пустой контекст, count() и debug() сразу возвращаются, а аргументы
+# debug() форматируются только при включённой трассировке. Дорогие
+# вычисления ради отладки стоит оборачивать в if trace.active().
+# В памяти хранятся только последние trace_max_events событий, так что
+# включённая трассировка в сервере или GUI не растёт без предела.
+
+import os
+import json
+import time
+import atexit
+import logging
+import threading
+import contextlib
+from collections import defaultdict, deque
+
+from ai.config import get_config
+
+logger = logging.getLogger("opg")
+
+_enabled = False
+_log = False
+_path = None
+_events = deque(maxlen=get_config()["trace_max_events"])
+_counters = defaultdict(float)
+_lock = threading.Lock()
+_start = time.perf_counter()
+_NULL_SPAN = contextlib.nullcontext()
+
+def _now_us():
+    return (time.perf_counter() - _start) * 1e6
+
+def active():
+    return _enabled
+
+def enable(path=None, log=False):
+    global _enabled, _log, _path
+    _enabled, _log, _path = True, log, path
+    if log and not logger.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter("%(asctime)s [%(threadName)s] %(message)s"))
+        logger.addHandler(handler)
+        logger.setLevel(logging.DEBUG)
+
+def disable():
+    global _enabled, _log
+    _enabled = _log = False
+
+def reset():
+    with _lock:
+        _events.clear()
+        _counters.clear()
+
+def span(name, **args):
+    # with trace.span("seg.infer", batch=4): ...
+    if not _enabled:
+        return _NULL_SPAN
+    return _span(name, args)
+
+@contextlib.contextmanager
+def _span(name, args):
+    start = _now_us()
+    try:
+        yield
+    finally:
+        end = _now_us()
+        event = {
+            "name": name, "ph": "X", "ts": start, "dur": end - start,
+            "pid": os.getpid(), "tid": threading.get_ident(),
+        }
+        if args:
+            event["args"] = args
+        with _lock:
+            _events.append(event)
+        if _log:
+            logger.info("%s: %.1f мс", name, (end - start) / 1000)
+
+def count(name, value=1):
+    if not _enabled:
+        return
+    with _lock:
+        _counters[name] += value
+        _events.append({
+            "name": name, "ph": "C", "ts": _now_us(),
+            "pid": os.getpid(), "tid": threading.get_ident(),
+            "args": {"value": _counters[name]},
+        })
+
+def debug(message, *args):
+    # Форматирование в стиле logging: debug("маски %s", shape)
+    if not _enabled:
+        return
+    text = message % args if args else message
+    with _lock:
+        _events.append({
+            "name": text, "ph": "i", "s": "t", "ts": _now_us(),
+            "pid": os.getpid(), "tid": threading.get_ident(),
+        })
+    if _log:
+        logger.debug(text)
+
+def counters():
+    with _lock:
+        return dict(_counters)
+
+def save_chrome_trace(path):
+    with _lock:
+        data = {"traceEvents": list(_events), "displayTimeUnit": "ms"}
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, default=str)
+
+def _save_at_exit():
+    if _enabled and _path:
+        save_chrome_trace(_path)
+
+atexit.register(_save_at_exit)
+
+_config = get_config()
+if _config["trace"]:
+    enable(_config["trace_path"] or None, _config["trace_log"])
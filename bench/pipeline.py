@@ -0,0 +1,241 @@
+# bench/pipeline.py
+#
+# Бенчмарк конвейера diagnose_image по этапам:
+#   python -m bench.pipeline run [-o bench.json] [--repeats 5] [--real] [--no-gui]
+#   python -m bench.pipeline compare старый.json новый.json [--tolerance 0.2]
+# По умолчанию модели заменяются заглушками (bench/stubs.py), а снимок
+# синтетический, так что измеряется код вокруг моделей. С --real
+# используются настоящие веса из конфига.
+# Время — медиана по повторам без tracemalloc; пиковая память этапа
+# снимается отдельным прогоном под tracemalloc (прирост над началом этапа);
+# он видит Python и numpy, но не буферы внутри PIL, OpenCV и Qt.
+# compare завершается с кодом 1, если медиана какого-то этапа выросла
+# больше допуска — так результаты двух версий сравниваются в CI.
+
+import os
+import io
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+import tracemalloc
+import contextlib
+import numpy as np
+import cv2
+
+from ai.config import get_config
+from ai.diagnosis import check_teeth, prepare_zone, segment_zones, associate, ModelOutputs
+from ai.teeth_detect import predict_teeth
+from ai.scan_image import ScanImage
+from bench.stubs import OPG_SIZE, make_opg, install_stubs
+
+STAGES = ["decode", "detect", "fullness", "crop", "segment", "associate"]
+GUI_STAGES = ["canvas_load", "canvas_paint", "canvas_repaint"]
+
+class StageTimer:
+    # Замер одного прогона: время каждого этапа и, при memory=True,
+    # пик выделенной памяти относительно начала этапа
+    def __init__(self, memory=False):
+        self.memory = memory
+        self.times = {}
+        self.peaks = {}
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        if self.memory:
+            tracemalloc.reset_peak()
+            base = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        # Отладочный вывод конвейера не должен попадать в замер консоли
+        with contextlib.redirect_stdout(io.StringIO()):
+            yield
+        self.times[name] = time.perf_counter() - start
+        if self.memory:
+            self.peaks[name] = max(0, tracemalloc.get_traced_memory()[1] - base)
+
+def run_pipeline_stages(image_path, timer):
+    with timer.stage("decode"):
+        scan = ScanImage.open(image_path)
+    with timer.stage("detect"):
+        teeth = predict_teeth(scan)
+    with timer.stage("fullness"):
+        results, error_message = check_teeth(teeth)
+    if error_message:
+        raise RuntimeError(error_message)
+    with timer.stage("crop"):
+        crop, zone = prepare_zone(scan, teeth)
+    with timer.stage("segment"):
+        masks_seg = segment_zones([crop])[0]
+    with timer.stage("associate"):
+        messages, segments = associate(ModelOutputs(teeth, masks_seg, zone, results, None))
+    return scan, segments
+
+def run_canvas_stages(app, scan, segments, timer):
+    from gui.canvas import Canvas
+
+    canvas = Canvas()
+    canvas.resize(1280, 720)
+    with timer.stage("canvas_load"):
+        canvas.set_image(scan)
+        # Дожидаемся фоновой пирамиды, чтобы отрисовка шла с уменьшенного уровня
+        if canvas.pyramid_builder is not None:
+            canvas.pyramid_builder.wait()
+        app.processEvents()
+        canvas.set_segments(segments)
+        canvas.fit_to_window()
+    with timer.stage("canvas_paint"):
+        canvas.grab()
+    with timer.stage("canvas_repaint"):
+        canvas.grab()
+    canvas.deleteLater()
+    app.processEvents()
+
+def summarize(samples):
+    ms = np.array(samples) * 1000
+    return {
+        "median_ms": float(np.median(ms)),
+        "mean_ms": float(ms.mean()),
+        "min_ms": float(ms.min()),
+        "max_ms": float(ms.max()),
+    }
+
+def git_revision():
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=5)
+        return out.stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+def run_benchmark(width, height, repeats=5, warmup=1, real=False, gui=True, seed=0):
+    if not real:
+        install_stubs()
+
+    app = None
+    stages = list(STAGES)
+    if gui:
+        from PyQt5.QtWidgets import QApplication
+        app = QApplication.instance() or QApplication(sys.argv[:1])
+        stages += GUI_STAGES
+
+    workdir = tempfile.mkdtemp(prefix="opg_bench_")
+    try:
+        image_path = os.path.join(workdir, "opg.png")
+        cv2.imwrite(image_path, make_opg(width, height, seed))
+
+        def one_run(timer):
+            scan, segments = run_pipeline_stages(image_path, timer)
+            if gui:
+                run_canvas_stages(app, scan, segments, timer)
+
+        for _ in range(warmup):
+            one_run(StageTimer())
+
+        samples = {name: [] for name in stages}
+        for _ in range(repeats):
+            timer = StageTimer()
+            one_run(timer)
+            for name in stages:
+                samples[name].append(timer.times[name])
+
+        tracemalloc.start()
+        try:
+            mem_timer = StageTimer(memory=True)
+            one_run(mem_timer)
+        finally:
+            tracemalloc.stop()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "meta": {
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "opencv": cv2.__version__,
+            "machine": platform.machine(),
+            "image_size": [width, height],
+            "repeats": repeats,
+            "models": "real" if real else "stub",
+            "config": get_config(),
+        },
+        "stages": {},
+    }
+    for name in stages:
+        report["stages"][name] = dict(summarize(samples[name]), peak_kb=mem_timer.peaks[name] / 1024)
+    return report
+
+def print_report(report):
+    meta = report["meta"]
+    print(f"Ревизия {meta['revision']}, снимок {meta['image_size'][0]}x{meta['image_size'][1]}, "
+          f"модели: {meta['models']}, повторов: {meta['repeats']}")
+    print(f"{'этап':16s} {'медиана, мс':>12s} {'мин, мс':>10s} {'пик, КБ':>12s}")
+    for name, s in report["stages"].items():
+        print(f"{name:16s} {s['median_ms']:12.2f} {s['min_ms']:10.2f} {s['peak_kb']:12.0f}")
+
+def compare_reports(old, new, tolerance=0.2, min_ms=1.0):
+    # Регрессия — рост медианы больше чем на tolerance и больше чем на
+    # min_ms (чтобы шум быстрых этапов не срабатывал)
+    regressions = []
+    print(f"{'этап':16s} {'было, мс':>10s} {'стало, мс':>10s} {'изм.':>8s} {'пик было':>10s} {'пик стало':>10s}")
+    for name, s in new["stages"].items():
+        if name not in old["stages"]:
+            print(f"{name:16s} {'—':>10s} {s['median_ms']:10.2f}")
+            continue
+        o = old["stages"][name]
+        change = s["median_ms"] / o["median_ms"] - 1 if o["median_ms"] > 0 else 0.0
+        regressed = change > tolerance and s["median_ms"] - o["median_ms"] > min_ms
+        if regressed:
+            regressions.append(name)
+        print(f"{name:16s} {o['median_ms']:10.2f} {s['median_ms']:10.2f} {change * 100:+7.1f}% "
+              f"{o['peak_kb']:10.0f} {s['peak_kb']:10.0f}{'  РЕГРЕССИЯ' if regressed else ''}")
+    return regressions
+
+def parse_size(text):
+    w, h = text.lower().split("x")
+    return int(w), int(h)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Бенчмарк этапов конвейера анализа")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = sub.add_parser("run", help="замерить этапы и сохранить JSON")
+    run_parser.add_argument("-o", "--output", help="файл для результатов (JSON)")
+    run_parser.add_argument("--size", type=parse_size, default=OPG_SIZE, help="размер снимка, например 2900x1450")
+    run_parser.add_argument("--repeats", type=int, default=5)
+    run_parser.add_argument("--warmup", type=int, default=1)
+    run_parser.add_argument("--seed", type=int, default=0)
+    run_parser.add_argument("--real", action="store_true", help="настоящие модели вместо заглушек")
+    run_parser.add_argument("--no-gui", action="store_true", help="не замерять отрисовку Canvas")
+
+    cmp_parser = sub.add_parser("compare", help="сравнить два JSON с результатами")
+    cmp_parser.add_argument("old")
+    cmp_parser.add_argument("new")
+    cmp_parser.add_argument("--tolerance", type=float, default=0.2, help="допустимый рост медианы (доля)")
+    cmp_parser.add_argument("--min-ms", type=float, default=1.0)
+    args = parser.parse_args(argv)
+
+    if args.command == "compare":
+        with open(args.old, "r", encoding="utf-8") as f:
+            old = json.load(f)
+        with open(args.new, "r", encoding="utf-8") as f:
+            new = json.load(f)
+        regressions = compare_reports(old, new, args.tolerance, args.min_ms)
+        if regressions:
+            print(f"Регрессии: {', '.join(regressions)}")
+            return 1
+        return 0
+
+    width, height = args.size
+    report = run_benchmark(width, height, args.repeats, args.warmup, args.real, not args.no_gui, args.seed)
+    print_report(report)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
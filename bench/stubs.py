@@ -0,0 +1,119 @@
+# bench/stubs.py
+#
+# Синтетический снимок размером с ОПТГ и заглушки моделей для бенчмарка.
+# Заглушки повторяют интерфейсы движков (ai/engines.py): YOLO вызывается
+# с путём или списком массивов и отдаёт results с masks.xy и boxes,
+# UNet принимает батч NCHW и возвращает логиты. Веса не нужны,
+# поэтому бенчмарк работает офлайн и на любой машине.
+
+import numpy as np
+import cv2
+
+from ai import teeth_detect, disease_seg
+from ai.classes import CLASSES
+
+OPG_SIZE = (2900, 1450)
+
+# Яркость на синтетическом снимке (0..255) и класс UNet, который
+# заглушка ставит пикселям такой яркости
+BACKGROUND = 90
+TOOTH = 155
+CARIES = 205
+FILLING = 250
+
+def tooth_labels():
+    # Постоянный прикус: 11..18, 21..28, 31..38, 41..48
+    return [f"tooth {row}{pos}" for row in (1, 2, 3, 4) for pos in range(1, 9)]
+
+def tooth_polygons(width, height, points_per_tooth=200):
+    # Зубы — эллипсы по двум дугам (верхняя и нижняя челюсть).
+    # Квадранты 1 и 4 — справа от пациента, то есть слева на снимке
+    t = np.linspace(0, 2 * np.pi, points_per_tooth, endpoint=False)
+    rx, ry = width * 0.012, height * 0.11
+    polygons = {}
+    for label in tooth_labels():
+        num = int(label.split()[-1])
+        row, pos = num // 10, num % 10
+        side = -1 if row in (1, 4) else 1
+        u = side * (pos - 0.5) / 8  # -1..1 вдоль дуги
+        cx = width * (0.5 + 0.34 * u)
+        upper = row in (1, 2)
+        curve = height * 0.08 * u * u
+        cy = height * (0.36 if upper else 0.64) + (curve if upper else -curve)
+        polygons[label] = np.column_stack([cx + rx * np.cos(t), cy + ry * np.sin(t)]).astype(np.float32)
+    return polygons
+
+def make_opg(width=OPG_SIZE[0], height=OPG_SIZE[1], seed=0):
+    # BGR-снимок: фон с шумом, зубы, пломбы и кариозные пятна на части зубов
+    rng = np.random.default_rng(seed)
+    image = np.full((height, width), BACKGROUND, dtype=np.uint8)
+    polygons = tooth_polygons(width, height)
+    for i, pts in enumerate(polygons.values()):
+        cv2.fillPoly(image, [np.round(pts).astype(np.int32)], TOOTH)
+        cx, cy = pts.mean(axis=0)
+        r = int(width * 0.01)
+        if i % 3 == 0:
+            cv2.circle(image, (int(cx), int(cy - r)), r, FILLING, -1)
+        if i % 5 == 0:
+            cv2.circle(image, (int(cx), int(cy + 2 * r)), int(r * 1.3), CARIES, -1)
+    noise = rng.integers(-6, 7, size=image.shape, dtype=np.int16)
+    image = np.clip(image.astype(np.int16) + noise, 0, 255).astype(np.uint8)
+    return cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+
+class _Array(np.ndarray):
+    # Массив с методами cpu()/numpy(), как у тензоров в results ultralytics
+    def cpu(self):
+        return self
+
+    def numpy(self):
+        return np.asarray(self)
+
+class _Result:
+    def __init__(self, polygons, class_ids, names):
+        self.names = names
+        self.masks = type("Masks", (), {"xy": polygons})()
+        self.boxes = type("Boxes", (), {
+            "cls": np.asarray(class_ids, dtype=np.float32).view(_Array),
+            "conf": np.full(len(class_ids), 0.9, dtype=np.float32).view(_Array),
+        })()
+
+class StubTeethEngine:
+    # Возвращает зубы синтетического снимка по его размеру; как и YOLO,
+    # сам декодирует снимок, если передан путь
+    def __init__(self):
+        # Свои имена классов, как в весах YOLO: data.yaml датасета не нужен
+        self.names = dict(enumerate(tooth_labels()))
+        self.class_ids = {label: idx for idx, label in self.names.items()}
+
+    def __call__(self, source, verbose=True):
+        sources = source if isinstance(source, list) else [source]
+        results = []
+        for src in sources:
+            if isinstance(src, str):
+                src = cv2.imread(src)
+            h, w = src.shape[:2]
+            polygons = tooth_polygons(w, h)
+            labels = [label for label in polygons if label in self.class_ids]
+            results.append(_Result([polygons[l] for l in labels], [self.class_ids[l] for l in labels], self.names))
+        return results
+
+class StubSegEngine:
+    # Класс пикселя по яркости входа: пломбы и кариес синтетического
+    # снимка становятся масками filling и caries
+    def __init__(self, num_classes=len(CLASSES)):
+        self.num_classes = num_classes
+        self.filling = CLASSES.index("filling")
+        self.caries = CLASSES.index("caries")
+
+    def predict(self, batch):
+        gray = batch.mean(axis=1)
+        logits = np.zeros((batch.shape[0], self.num_classes) + gray.shape[1:], dtype=np.float32)
+        # Разрыв логитов даёт уверенность находок ~0.99 — выше conf_threshold
+        logits[:, 0] = 5.0
+        logits[:, self.filling] = 10.0 * (gray > (FILLING - 15) / 255)
+        logits[:, self.caries] = 10.0 * (np.abs(gray - CARIES / 255) < 15 / 255)
+        return logits
+
+def install_stubs():
+    teeth_detect.model = StubTeethEngine()
+    disease_seg.model = StubSegEngine(disease_seg.NUM_CLASSES)
@@ -1,49 +1,68 @@
 # gui/canvas.py
-import numpy as np
-from PyQt5.QtWidgets import QWidget
-from PyQt5.QtGui import QPixmap, QPainter, QColor, QBrush, QCursor, QRegion, QPolygonF
-from PyQt5.QtCore import Qt, QTimer, QPointF, QPoint
-
-from ai.classes import CLASSES, PATHOLOGIES, EXTRA, RAW_TO_HUMAN
-
-DISEASE_COLORS = {
-    "Periodontit": QColor(255, 60, 60, 180),
-    "caries": QColor(255, 120, 60, 180),
-    "cyst": QColor(255, 80, 180, 180),
-    "radix": QColor(200, 60, 255, 180),
-    "supplemental": QColor(230, 180, 60, 180),
-    "missing teeth": QColor(255, 80, 80, 180),
-    # Приглушённые цвета для следов лечения и extra
-    "filling": QColor(60, 180, 255, 80),
-    "crown": QColor(130, 190, 255, 80),
-    "implant": QColor(60, 120, 220, 70),
-    "mini implant": QColor(120, 180, 220, 70),
-    "sealed channel": QColor(100, 150, 220, 70),
-    "artefact": QColor(150, 150, 150, 40),
-    "bracket": QColor(200, 200, 80, 60),
-    "eights": QColor(100, 100, 180, 30),
-    "retailer": QColor(150, 100, 200, 40),
-}
+from collections import defaultdict
+from PyQt5.QtWidgets import QWidget, QToolTip
+from PyQt5.QtGui import QPixmap, QPainter, QPainterPath, QPen, QColor, QBrush
+from PyQt5.QtCore import Qt, QTimer, QPointF, QPoint, QRectF, pyqtSignal
+
+from ai.classes import RAW_TO_HUMAN, CLASS_COLORS
+from gui.tiles import TilePyramid, PyramidBuilder, TILE_SIZE, bgr_to_qimage
+from gui.geometry import SegmentGeometry
+from gui.spatial_index import GridIndex
+from ai.diagnosis import get_row_from_label
+from ai.scan_image import as_scan
+
+DISEASE_COLORS = {label: QColor(*rgba) for label, rgba in CLASS_COLORS.items()}
+
+# Сдвиг мыши (в пикселях), после которого нажатие считается перемещением, а не кликом
+CLICK_TOLERANCE = 4
+
+def segment_key(segment):
+    # Сегмент одного анализа: зуб — по метке FDI, находка — по классу и номеру
+    if segment.get('is_tooth', False):
+        return ("tooth", segment['label'])
+    return ("pathology" if segment.get('is_pathology', False) else "extra", segment['label'], segment.get('instance'))
 
 class Canvas(QWidget):
+    segment_selected = pyqtSignal(object)
+
     def __init__(self, parent=None):
         super().__init__(parent)
         self.image = None
         self.image_path = None
+        self.scan = None
+        self.preview = None
+        self.pyramid = None
+        self.pyramid_builder = None
+        # Отменённые построители могут ещё работать: их тоже ждём при закрытии
+        self.pyramid_builders = []
+        self.pyramid_generation = 0
         self.segments = []
+        self.geometry = {}  # id(сегмента) -> SegmentGeometry
+        self.hit_index = GridIndex()
+        self.pathology_teeth = {}  # (метка, номер находки) -> номера зубов
+        self.hovered_segment = None
+        self.selected_segment = None
+        self.press_pos = None
         self.visible_segments = []
         self.active_labels = set()
 
-        # Для масштабирования и перемещения
-        self.scaled_cache = None
+        # Для масштабирования и перемещения.
+        # Снимок рисуется тайлами с ближайшего уровня пирамиды, поверх —
+        # готовый прозрачный слой: затемнение, подсветка зубов и заливки.
+        # Слой строится в разрешении того же уровня и пересобирается только
+        # при смене уровня, сегментов или фильтров
+        self.overlay_cache = None
+        self.overlay_level = None
+        self.overlay_labels = []
+        self.teeth_layer = None  # (ключ, слой затемнения и зубов, подписи)
         self.scale_factor = 1.0
-        self.scale_factor_changed = True 
         self.drag_pos = QPoint() 
         self.image_offset = QPointF(0, 0)
 
 
         # Для анимации
         self.analysis_progress = 0
+        self.analysis_stage = ""
         self.animating = False
         self.timer = QTimer()
         self.timer.timeout.connect(self.update_animation)
@@ -56,33 +75,150 @@ class Canvas(QWidget):
         self.setMouseTracking(True)  # Включаем отслеживание мыши
 
 
-    def set_image(self, image_path):
-        self.image = QPixmap(image_path)
-        self.image_path = image_path
+    def set_image(self, image):
+        # Путь или ScanImage: QImage строится поверх его BGR-буфера без
+        # копирования, поэтому ScanImage хранится, пока показан снимок.
+        # 16-битный снимок сначала показывается по превью, а полный
+        # 8-битный буфер строится в фоне (PyramidBuilder)
+        self.scan = as_scan(image)
+        self.image_path = self.scan.path
         self.scale_factor = 1.0
-        self.scale_factor_changed = True
-        self.scaled_cache = None  # Сбрасываем кэш при новой картинке
+        if self.scan.decoded:
+            self.preview = None
+            self.image = bgr_to_qimage(self.scan.bgr)
+            self.pyramid = TilePyramid(self.image)
+        else:
+            self.preview = self.scan.preview()
+            self.image = bgr_to_qimage(self.preview)
+            self.pyramid = TilePyramid(self.image, self.scan.width, self.scan.height)
+        self.start_pyramid_build()
+        self.invalidate_overlay()
+
+    def has_image(self):
+        return self.image is not None and not self.image.isNull()
+
+    def start_pyramid_build(self):
+        # Уменьшенные уровни строятся в фоне; пока их нет, рисуется уровень 0
+        if self.pyramid_builder is not None:
+            self.pyramid_builder.cancel()
+        self.pyramid_generation += 1
+        if self.preview is None:
+            builder = PyramidBuilder(self.pyramid_generation, self.image, self)
+        else:
+            builder = PyramidBuilder(self.pyramid_generation, None, self, scan=self.scan)
+            builder.base_ready.connect(self.on_pyramid_base)
+        builder.level_ready.connect(self.on_pyramid_level)
+        builder.finished.connect(lambda: self.on_pyramid_builder_finished(builder))
+        self.pyramid_builder = builder
+        self.pyramid_builders.append(builder)
+        builder.start()
+
+    def on_pyramid_builder_finished(self, builder):
+        self.pyramid_builders.remove(builder)
+        if self.pyramid_builder is builder:
+            self.pyramid_builder = None
+        builder.deleteLater()
+
+    def cancel_pyramid_build(self):
+        if self.pyramid_builder is not None:
+            self.pyramid_builder.cancel()
+            self.pyramid_builder = None
+        for builder in list(self.pyramid_builders):
+            builder.wait()
+
+    def on_pyramid_base(self, generation, image):
+        # Полный 8-битный буфер готов: превью заменяется исходником
+        if generation != self.pyramid_generation:
+            return
+        self.preview = None
+        self.image = image
+        self.pyramid = TilePyramid(image)
+        self.invalidate_overlay()
+
+    def on_pyramid_level(self, generation, level, image):
+        if generation != self.pyramid_generation:
+            return
+        self.pyramid.add_level(level, image)
         self.update()
 
     def update_animation(self):
         if not self.animating:
             return
+        # Линия сканирования бежит по кругу, пока идёт анализ
         self.analysis_progress += 5
         if self.analysis_progress > self.width():
-            self.animating = False
-            self.timer.stop()
+            self.analysis_progress = 0
+        self.update()
+
+    def start_analysis_animation(self):
+        self.analysis_progress = 0
+        self.analysis_stage = ""
+        self.animating = True
+        self.timer.start(30)
+        self.update()
+
+    def set_analysis_stage(self, text):
+        self.analysis_stage = text
+        self.update()
+
+    def stop_analysis_animation(self):
+        self.animating = False
+        self.timer.stop()
+        self.update()
+
+    def draw_analysis_progress(self, painter):
+        painter.setPen(QColor(80, 200, 255, 200))
+        painter.drawLine(self.analysis_progress, 0, self.analysis_progress, self.height())
+        if self.analysis_stage:
+            painter.setPen(Qt.white)
+            painter.drawText(10, self.height() - 10, self.analysis_stage)
+
+    def invalidate_overlay(self):
+        self.overlay_cache = None
         self.update()
 
     def set_segments(self, segments):
+        self.geometry = {id(seg): SegmentGeometry(seg['points']) for seg in segments}
+        self.apply_segments(segments)
+
+    def update_segments(self, segments):
+        # Те же выходы моделей, сопоставленные с другими порогами: контуры
+        # не меняются, поэтому геометрия берётся от прежних сегментов с тем
+        # же ключом и строится только для новых
+        by_key = {segment_key(seg): self.geometry[id(seg)] for seg in self.segments}
+        selected = segment_key(self.selected_segment) if self.selected_segment is not None else None
+        self.geometry = {
+            id(seg): by_key.get(segment_key(seg)) or SegmentGeometry(seg['points']) for seg in segments
+        }
+        self.apply_segments(segments)
+        if selected is not None:
+            self.selected_segment = next((seg for seg in segments if segment_key(seg) == selected), None)
+
+    def apply_segments(self, segments):
         self.segments = segments
+        self.hit_index = GridIndex()
+        self.pathology_teeth = defaultdict(list)
+        for seg in segments:
+            geom = self.geometry[id(seg)]
+            if geom.is_valid():
+                self.hit_index.insert(seg, geom)
+            for finding in seg.get('findings', []):
+                self.pathology_teeth[(finding['label'], finding.get('instance'))].append(seg['label'].split()[-1])
+        self.hovered_segment = None
+        self.selected_segment = None
         self.visible_segments = segments
         self.active_labels = set(s['label'] for s in segments)
-        self.update() 
+        self.invalidate_overlay()
+
+    def set_visible_segments(self, visible):
+        self.visible_segments = visible
+        self.active_labels = {seg['label'] for seg in visible}
+        self.invalidate_overlay()
 
     def reveal_next_segment(self):
         if len(self.visible_segments) < len(self.segments):
             self.visible_segments.append(self.segments[len(self.visible_segments)])
-            self.update()
+            self.invalidate_overlay()
         else:
             self.detection_timer.stop()
 
@@ -91,28 +227,24 @@ class Canvas(QWidget):
             labels = set(seg['label'] for seg in self.segments)
         self.active_labels = labels
         self.visible_segments = [seg for seg in self.segments if seg['label'] in self.active_labels]
-        self.update()
+        self.invalidate_overlay()
 
     def zoom_in(self):
         self.scale_factor *= 1.25
-        self.scale_factor_changed = True
         self.update()
 
     def zoom_out(self):
         self.scale_factor *= 0.8
-        self.scale_factor_changed = True
         self.update()
 
     def fit_to_window(self):
-        if not self.image:
+        if not self.has_image():
             return
         widget_size = self.size()
-        img_size = self.image.size()
-        scale_w = widget_size.width() / img_size.width()
-        scale_h = widget_size.height() / img_size.height()
+        scale_w = widget_size.width() / self.pyramid.width
+        scale_h = widget_size.height() / self.pyramid.height
         self.scale_factor = min(scale_w, scale_h)
         self.image_offset = QPointF(0, 0)
-        self.scale_factor_changed = True
         self.update()
 
     def wheelEvent(self, event):
@@ -126,12 +258,55 @@ class Canvas(QWidget):
         
         # Ограничиваем масштаб
         self.scale_factor = max(0.1, min(self.scale_factor, 10.0))
-        self.scale_factor_changed = True
         self.update()
 
+    def image_origin(self):
+        # Положение левого верхнего угла снимка в координатах виджета
+        x = (self.width() - self.pyramid.width * self.scale_factor) / 2 + self.image_offset.x()
+        y = (self.height() - self.pyramid.height * self.scale_factor) / 2 + self.image_offset.y()
+        return x, y
+
+    def segment_at(self, pos):
+        # Сегмент под курсором среди видимых; находки лежат поверх зубов
+        if not self.has_image() or not self.segments:
+            return None
+        x, y = self.image_origin()
+        hits = self.hit_index.query((pos.x() - x) / self.scale_factor, (pos.y() - y) / self.scale_factor)
+        visible = {id(seg) for seg in self.visible_segments if seg['label'] in self.active_labels}
+        hits = [seg for seg in hits if id(seg) in visible]
+        for seg in hits:
+            if seg.get('is_pathology', False):
+                return seg
+        for seg in hits:
+            if seg.get('is_tooth', False):
+                return seg
+        return hits[0] if hits else None
+
+    def describe_segment(self, segment):
+        if segment.get('is_tooth', False):
+            number = segment['label'].split()[-1]
+            row = get_row_from_label(segment['label']).replace("\n", " ")
+            lines = [f"Зуб {number} ({row})"]
+            if 'confidence' in segment:
+                lines[0] += f", уверенность {segment['confidence']:.2f}"
+            for finding in segment.get('findings', []):
+                lines.append(f"{finding['human_label']}, уверенность {finding['confidence']:.2f}")
+            if len(lines) == 1:
+                lines.append("Патологии не обнаружены")
+            return "\n".join(lines)
+
+        lines = [RAW_TO_HUMAN.get(segment['label'], segment['label'])]
+        if 'confidence' in segment:
+            lines[0] += f", уверенность {segment['confidence']:.2f}"
+        teeth = self.pathology_teeth.get((segment['label'], segment.get('instance')))
+        if teeth:
+            lines.append("Зубы: " + ", ".join(teeth))
+        return "\n".join(lines)
+
     def mousePressEvent(self, event):
         if event.button() == Qt.LeftButton:
             self.drag_pos = event.pos()
+            self.press_pos = event.pos()
             self.setCursor(Qt.ClosedHandCursor)
 
     def mouseMoveEvent(self, event):
@@ -140,120 +315,159 @@ class Canvas(QWidget):
             self.drag_pos = event.pos()
             self.image_offset += delta
             self.update()
+            return
+
+        # Подсказка обновляется только при смене сегмента под курсором
+        segment = self.segment_at(event.pos())
+        if segment is self.hovered_segment:
+            return
+        self.hovered_segment = segment
+        if segment is None:
+            QToolTip.hideText()
+        else:
+            QToolTip.showText(event.globalPos(), self.describe_segment(segment), self)
 
     def mouseReleaseEvent(self, event):
         if event.button() == Qt.LeftButton:
             self.setCursor(Qt.ArrowCursor)
+            if self.press_pos is not None and (event.pos() - self.press_pos).manhattanLength() <= CLICK_TOLERANCE:
+                self.selected_segment = self.segment_at(event.pos())
+                self.segment_selected.emit(self.selected_segment)
+                self.update()
+            self.press_pos = None
+
+    def build_teeth_layer(self, level, teeth):
+        # Затемняем снимок всюду, кроме отмеченных зубов, а зубы подсвечиваем.
+        # Белая заливка с альфой 70 поверх снимка даёт тот же результат,
+        # что Screen-режим с тем же цветом. -> (слой, подписи зубов)
+        overlay = QPixmap(self.pyramid.levels[level].size())
+        overlay.fill(Qt.transparent)
+        painter = QPainter(overlay)
+        painter.setRenderHint(QPainter.Antialiasing)
+        lod_scale = 1 / self.pyramid.level_factor(level)
+        painter.scale(lod_scale, lod_scale)
+
+        labels = []
+        teeth_area = QPainterPath()
+        teeth_area.setFillRule(Qt.WindingFill)
+        for segment, geom in teeth:
+            teeth_area.addPolygon(geom.polygon(lod_scale))
+            label_x, label_y = geom.centroid
+            labels.append((label_x, label_y, segment['label'].split()[-1], Qt.white))
+        dark_area = QPainterPath()
+        dark_area.addRect(QRectF(0, 0, self.pyramid.width, self.pyramid.height))
+        dark_area = dark_area.subtracted(teeth_area)
+        dark_color = QColor(0, 0, 0, 170)  # 170 из 255 ~70% затемнение
+        painter.fillPath(dark_area, dark_color)
+        painter.fillPath(teeth_area, QColor(255, 255, 255, 70))
+        painter.end()
+        return overlay, labels
+
+    def build_overlay(self, level):
+        # Слой в разрешении уровня пирамиды; снимок в нём не рисуется.
+        # Контуры заданы в координатах снимка и переводятся в слой одним
+        # преобразованием painter. Слой зубов (самая дорогая часть)
+        # переиспользуется, пока не изменились уровень и видимые зубы:
+        # при смене порогов меняются только заливки находок
+        segments = [seg for seg in self.visible_segments if seg['label'] in self.active_labels]
+        teeth = [
+            (seg, self.geometry[id(seg)]) for seg in segments
+            if (seg.get('is_tooth', False) or seg['label'].startswith("tooth")) and self.geometry[id(seg)].is_valid()
+        ]
+        key = (self.pyramid, level, tuple(geom for _, geom in teeth))
+        if self.teeth_layer is None or self.teeth_layer[0] != key:
+            self.teeth_layer = (key,) + self.build_teeth_layer(level, teeth)
+
+        # Подписи рисуются в экранных координатах при каждой отрисовке,
+        # чтобы не масштабироваться вместе со слоем
+        _, overlay, labels = self.teeth_layer
+        overlay = QPixmap(overlay)
+        self.overlay_labels = list(labels)
+        painter = QPainter(overlay)
+        painter.setRenderHint(QPainter.Antialiasing)
+        lod_scale = 1 / self.pyramid.level_factor(level)
+        painter.scale(lod_scale, lod_scale)
+
+        painter.setPen(Qt.NoPen)
+        for segment in segments:
+            label = segment['label']
+            geom = self.geometry[id(segment)]
+            if not geom.is_valid():
+                continue
+            # Патологии
+            if segment.get('is_pathology', False):
+                painter.setBrush(QBrush(DISEASE_COLORS.get(label, QColor(255, 0, 0, 160))))
+                painter.drawPolygon(geom.polygon(lod_scale))
+                cx, cy = geom.centroid
+                self.overlay_labels.append((cx, cy, RAW_TO_HUMAN[label], Qt.yellow))
+
+            elif segment.get('is_extra', False):
+                painter.setBrush(QBrush(DISEASE_COLORS.get(label, QColor(80, 130, 180, 60))))
+                painter.drawPolygon(geom.polygon(lod_scale))
+
+        painter.end()
+        return overlay
 
     def paintEvent(self, event):
-        if not self.image:
+        if not self.has_image():
             return
 
         painter = QPainter(self)
         painter.setRenderHint(QPainter.Antialiasing)
-        # Обновляем кэш при необходимости
-        if self.scaled_cache is None or self.scale_factor_changed:
-            self.scaled_cache = self.image.scaled(
-                int(self.image.width() * self.scale_factor),
-                int(self.image.height() * self.scale_factor),
-                Qt.KeepAspectRatio,
-                Qt.SmoothTransformation
-            )
-            self.scale_factor_changed = False
+        painter.setRenderHint(QPainter.SmoothPixmapTransform)
 
         # Центрирование изображения
-        x = int((self.width() - self.scaled_cache.width()) // 2 + self.image_offset.x())
-        y = int((self.height() - self.scaled_cache.height()) // 2 + self.image_offset.y())
-        painter.drawPixmap(x, y, self.scaled_cache)
-
-        # Затемняем весь снимок
-        dark_color = QColor(0, 0, 0, 170)  # 170 из 255 ~70% затемнение
-        painter.setCompositionMode(QPainter.CompositionMode_SourceOver)
-        painter.fillRect(x, y, self.scaled_cache.width(), self.scaled_cache.height(), dark_color)
-
-        # Ярко выделяем только отмеченные зубы (поверх затемнения)
-        img_w, img_h = self.image.width(), self.image.height()
-        scale_w = self.scaled_cache.width() / img_w
-        scale_h = self.scaled_cache.height() / img_h
-        for segment in self.visible_segments:
-            if segment['label'] not in self.active_labels:
-                continue
-
-            # Только для зубов!
-            if segment.get('is_tooth', False) or segment['label'].startswith("tooth"):
-                # Создаем QPixmap-маску
-                tooth_mask = QPixmap(self.scaled_cache.size())
-                tooth_mask.fill(Qt.transparent)
-                tooth_painter = QPainter(tooth_mask)
-                tooth_painter.setRenderHint(QPainter.Antialiasing)
-                path = []
-                for px, py in np.array(segment['points']):
-                    sx = int(px * scale_w)
-                    sy = int(py * scale_h)
-                    path.append(QPointF(sx, sy))
-                if len(path) > 2:
-                    # Маска зуба — белым цветом
-                    tooth_painter.setPen(Qt.NoPen)
-                    tooth_painter.setBrush(QBrush(Qt.white))
-                    tooth_painter.drawPolygon(*path)
-                tooth_painter.end()
-
-                # Вырезаем область зуба с оригинального снимка
-                tooth_pixmap = QPixmap(self.scaled_cache.size())
-                tooth_pixmap.fill(Qt.transparent)
-                cut_painter = QPainter(tooth_pixmap)
-                cut_painter.setClipRegion(QRegion(QPolygonF(path).toPolygon()))
-                cut_painter.drawPixmap(0, 0, self.scaled_cache)
-                cut_painter.end()
-
-                # Повышаем яркость (белым Screen-режимом)
-                highlight_painter = QPainter(tooth_pixmap)
-                highlight_painter.setCompositionMode(QPainter.CompositionMode_Screen)
-                highlight_painter.setClipRegion(QRegion(QPolygonF(path).toPolygon()))
-                highlight_painter.fillRect(tooth_pixmap.rect(), QColor(255, 255, 255, 70))
-                highlight_painter.end()
-
-                # Рисуем выделенный зуб поверх затемнения
-                painter.drawPixmap(x, y, tooth_pixmap)
-
-                # Подпись номера зуба
-                painter.setPen(Qt.white)
-                label_x = sum(p.x() for p in path) / len(path)
-                label_y = sum(p.y() for p in path) / len(path)
-                pos = segment['label'].split()[-1]
-                font = painter.font()
-                font.setBold(True)
-                font.setPointSize(14)  # Можно изменить размер
-                painter.setFont(font)
-                painter.drawText(int(label_x) + x, int(label_y) + y, pos)
-
-             # Патологии 
-            elif segment.get('is_pathology', False):
-                label = segment['label']
-                path = [
-                    QPointF(x + (px * scale_w), y + (py * scale_h))
-                    for px, py in segment['points']
-                ]
-                if len(path) > 2:
-                    color = DISEASE_COLORS.get(label, QColor(255, 0, 0, 160))
-                    painter.setPen(Qt.NoPen)
-                    painter.setBrush(QBrush(color))
-                    painter.drawPolygon(*path)
-                    cx = sum(p.x() for p in path) / len(path)
-                    cy = sum(p.y() for p in path) / len(path)
-                    painter.setPen(Qt.yellow)
-                    painter.drawText(int(cx), int(cy), RAW_TO_HUMAN[label])
-                continue
-
-            if segment.get('is_extra', False):
-                label = segment['label']
-                path = [
-                    QPointF(x + (px * scale_w), y + (py * scale_h))
-                    for px, py in segment['points']
-                ]
-                if len(path) > 2:
-                    color = DISEASE_COLORS.get(label, QColor(80, 130, 180, 60))
-                    painter.setPen(Qt.NoPen)
-                    painter.setBrush(QBrush(color))
-                    painter.drawPolygon(*path)
-                continue
\ No newline at end of file
+        scale = self.scale_factor
+        img_w, img_h = self.pyramid.width, self.pyramid.height
+        x, y = self.image_origin()
+
+        # Видимая часть снимка в его координатах
+        vx0 = max(0.0, -x / scale)
+        vy0 = max(0.0, -y / scale)
+        vx1 = min(float(img_w), (self.width() - x) / scale)
+        vy1 = min(float(img_h), (self.height() - y) / scale)
+
+        if vx1 > vx0 and vy1 > vy0:
+            level = self.pyramid.level_for_scale(scale)
+            f = self.pyramid.level_factor(level)
+            step = f * scale  # экранных пикселей на пиксель уровня
+
+            # Только тайлы, попадающие в окно; края округляются одинаково
+            # для соседних тайлов, чтобы между ними не было щелей
+            for tx, ty in self.pyramid.visible_tiles(level, vx0, vy0, vx1, vy1):
+                tile = self.pyramid.tile(level, tx, ty)
+                lx, ly = tx * TILE_SIZE, ty * TILE_SIZE
+                left, top = round(x + lx * step), round(y + ly * step)
+                right = round(x + (lx + tile.width()) * step)
+                bottom = round(y + (ly + tile.height()) * step)
+                painter.drawPixmap(QRectF(left, top, right - left, bottom - top), tile, QRectF(tile.rect()))
+
+            if self.overlay_cache is None or self.overlay_level != level:
+                self.overlay_cache = self.build_overlay(level)
+                self.overlay_level = level
+            target = QRectF(x + vx0 * scale, y + vy0 * scale, (vx1 - vx0) * scale, (vy1 - vy0) * scale)
+            source = QRectF(vx0 / f, vy0 / f, (vx1 - vx0) / f, (vy1 - vy0) / f)
+            painter.drawPixmap(target, self.overlay_cache, source)
+
+            # Подпись номера зуба
+            font = painter.font()
+            font.setBold(True)
+            font.setPointSize(14)  # Можно изменить размер
+            painter.setFont(font)
+            for lx, ly, text, color in self.overlay_labels:
+                painter.setPen(color)
+                painter.drawText(int(x + lx * scale), int(y + ly * scale), text)
+
+            if self.selected_segment is not None and id(self.selected_segment) in self.geometry:
+                painter.save()
+                painter.translate(x, y)
+                painter.scale(scale, scale)
+                pen = QPen(Qt.yellow, 2)
+                pen.setCosmetic(True)
+                painter.setPen(pen)
+                painter.setBrush(Qt.NoBrush)
+                painter.drawPolygon(self.geometry[id(self.selected_segment)].polygon(scale))
+                painter.restore()
+
+        if self.animating:
+            self.draw_analysis_progress(painter)
@@ -1,16 +1,29 @@
 # gui/filter_panel.py
 import os
-from PyQt5.QtWidgets import QWidget, QGridLayout, QVBoxLayout, QLabel, QPushButton, QCheckBox, QSizePolicy, QStyle, QHBoxLayout
+from PyQt5.QtWidgets import QWidget, QGridLayout, QVBoxLayout, QLabel, QPushButton, QCheckBox, QSizePolicy, QStyle, QHBoxLayout, QSlider
 from PyQt5.QtGui import QIcon
-from PyQt5.QtCore import QSize
+from PyQt5.QtCore import QSize, Qt
+
+from ai import trace
+
+# Шаг ползунков порогов: значения 0..1 в сотых
+THRESHOLD_STEPS = 100
 
 class FilterPanel(QWidget):
-    def __init__(self, on_filter_changed=None, parent=None):
+    def __init__(self, on_filter_changed=None, on_thresholds_changed=None, parent=None):
         super().__init__(parent)
         self.on_filter_changed = on_filter_changed
+        self.on_thresholds_changed = on_thresholds_changed
         self.layout = QVBoxLayout(self)
         self.setLayout(self.layout)
 
+        # ---- Пороги сопоставления находок ----
+        # Меняют только сопоставление, модели заново не запускаются
+        self.layout.addWidget(QLabel("Чувствительность"))
+        self.overlap_label, self.overlap_slider = self.add_threshold_slider(0.15)
+        self.conf_label, self.conf_slider = self.add_threshold_slider(0.0)
+        self.update_threshold_labels()
+
         # ---- Панель для зубов ----
         self.layout.addWidget(QLabel("Ряды зубов"))
         self.top_row_layout = QHBoxLayout()
@@ -27,6 +40,43 @@ class FilterPanel(QWidget):
         self.disease_layout = QVBoxLayout()
         self.layout.addLayout(self.disease_layout)
         self.disease_checkboxes = {}
+        # Отметки классов, пропавших из списка при смене порогов
+        self.disease_states = {}
+
+    def add_threshold_slider(self, value):
+        label = QLabel()
+        slider = QSlider(Qt.Horizontal)
+        slider.setRange(0, THRESHOLD_STEPS - 1)
+        slider.setValue(int(round(value * THRESHOLD_STEPS)))
+        slider.valueChanged.connect(self._trigger_thresholds)
+        self.layout.addWidget(label)
+        self.layout.addWidget(slider)
+        return label, slider
+
+    def update_threshold_labels(self):
+        overlap, conf = self.get_thresholds()
+        self.overlap_label.setText(f"Перекрытие с зубом: {overlap:.2f}")
+        self.conf_label.setText(f"Уверенность: {conf:.2f}")
+
+    def set_thresholds_enabled(self, enabled):
+        # Без сохранённых выходов моделей (сервер анализа, старая запись
+        # истории) пороги для показанного результата не меняются
+        for slider in (self.overlap_slider, self.conf_slider):
+            slider.setEnabled(enabled)
+            slider.setToolTip("" if enabled else "Для этого результата нет выходов моделей: пороги применятся к следующему анализу")
+
+    def set_thresholds(self, overlap_threshold, conf_threshold):
+        # Без on_thresholds_changed: значения восстанавливаются вместе
+        # с результатом, для которого они уже применены
+        for slider, value in ((self.overlap_slider, overlap_threshold), (self.conf_slider, conf_threshold)):
+            slider.blockSignals(True)
+            slider.setValue(int(round(value * THRESHOLD_STEPS)))
+            slider.blockSignals(False)
+        self.update_threshold_labels()
+
+    def get_thresholds(self):
+        # (overlap_threshold, conf_threshold)
+        return self.overlap_slider.value() / THRESHOLD_STEPS, self.conf_slider.value() / THRESHOLD_STEPS
 
     ICON_EYE = os.path.join(os.path.dirname(__file__), "icons_data/eye-regular.svg")
     ICON_EYE_SLASH = os.path.join(os.path.dirname(__file__), "icons_data/eye-regular-slash.svg")
@@ -79,8 +129,16 @@ class FilterPanel(QWidget):
             self.row_grid.addWidget(btn, r_idx, c_idx)
             self.row_buttons[row] = btn
 
-    def update_diseases(self, disease_labels):
-        print("UPDATE_DISEASES called with:", disease_labels)
+    def update_diseases(self, disease_labels, keep_states=False):
+        # keep_states — тот же снимок после смены порогов: отметки классов,
+        # которые уже были в списке, сохраняются, появившиеся классы включены
+        trace.debug("update_diseases: %s", disease_labels)
+        if keep_states:
+            if set(disease_labels) == set(self.disease_checkboxes):
+                return
+            self.disease_states.update((name, cb.isChecked()) for name, cb in self.disease_checkboxes.items())
+        else:
+            self.disease_states = {}
         for i in reversed(range(self.disease_layout.count())):
             widget = self.disease_layout.itemAt(i).widget()
             if widget:
@@ -88,7 +146,7 @@ class FilterPanel(QWidget):
         self.disease_checkboxes.clear()
         for disease in sorted(disease_labels):
             cb = QCheckBox(disease)
-            cb.setChecked(True)
+            cb.setChecked(self.disease_states.get(disease, True))
             cb.stateChanged.connect(self._trigger_callback)
             cb.setProperty("diseaseBox", True)
             self.disease_layout.addWidget(cb)
@@ -123,3 +181,8 @@ class FilterPanel(QWidget):
     def _trigger_callback(self):
         if self.on_filter_changed:
             self.on_filter_changed()
+
+    def _trigger_thresholds(self):
+        self.update_threshold_labels()
+        if self.on_thresholds_changed:
+            self.on_thresholds_changed()
@@ -0,0 +1,53 @@
+# gui/geometry.py
+
+import numpy as np
+import cv2
+from PyQt5.QtGui import QPolygonF
+from PyQt5.QtCore import QPointF
+
+# Допуски упрощения контура в пикселях снимка (0 — исходный контур)
+LOD_TOLERANCES = (0, 1, 2, 4, 8, 16)
+# Допустимое отклонение упрощённого контура на экране, пикселей
+SCREEN_TOLERANCE = 0.75
+
+class SegmentGeometry:
+    # Геометрия сегмента, подготовленная один раз при получении результатов:
+    # вершины в numpy, центр и bbox, а также упрощённые варианты контура
+    # для мелких масштабов в виде готовых QPolygonF (в координатах снимка)
+    __slots__ = ("points", "centroid", "bbox", "lods")
+
+    def __init__(self, points):
+        self.points = np.asarray(points, dtype=np.float32).reshape(-1, 2)
+        if len(self.points):
+            cx, cy = self.points.mean(axis=0)
+            x0, y0 = self.points.min(axis=0)
+            x1, y1 = self.points.max(axis=0)
+        else:
+            cx = cy = x0 = y0 = x1 = y1 = 0.0
+        self.centroid = (float(cx), float(cy))
+        self.bbox = (float(x0), float(y0), float(x1), float(y1))
+
+        self.lods = []
+        prev_count = None
+        for tolerance in LOD_TOLERANCES:
+            if tolerance == 0:
+                pts = self.points
+            else:
+                pts = cv2.approxPolyDP(self.points.reshape(-1, 1, 2), tolerance, True).reshape(-1, 2)
+            if len(pts) < 3 or len(pts) == prev_count:
+                continue
+            prev_count = len(pts)
+            self.lods.append((tolerance, QPolygonF([QPointF(x, y) for x, y in pts.tolist()])))
+
+    def is_valid(self):
+        return bool(self.lods)
+
+    def polygon(self, scale=1.0):
+        # Самый грубый контур, отклонение которого на экране
+        # при данном масштабе не превышает SCREEN_TOLERANCE
+        best = self.lods[0][1]
+        for tolerance, polygon in self.lods:
+            if tolerance * scale > SCREEN_TOLERANCE:
+                break
+            best = polygon
+        return best
@@ -1,22 +1,67 @@
 # gui/main_window.py
 
-import sys
+import os
 from PyQt5.QtWidgets import (
-    QApplication, QWidget, QLabel, QPushButton, QTextEdit, QListWidget, QCheckBox,
-    QVBoxLayout, QHBoxLayout, QFileDialog, QListWidgetItem, QFrame
+    QWidget, QLabel, QPushButton, QTextEdit, QListWidget,
+    QVBoxLayout, QHBoxLayout, QFileDialog, QListWidgetItem
 )
-from PyQt5.QtGui import QPixmap, QFont, QColor
-from PyQt5.QtCore import Qt
+from PyQt5.QtCore import Qt, QTimer
 from gui.canvas import Canvas
 from gui.filter_panel import FilterPanel
-from ai.diagnosis import diagnose_image, get_row_from_label
+from gui.workers import ModelLoader, AnalysisWorker
+from ai.diagnosis import get_row_from_label, associate
+from ai.study_store import get_store
+from ai.remote import get_client
+from ai.scan_image import ScanImage
+from ai.report import export_report
+from ai import trace
+
+# Пауза после последнего движения ползунка порогов (мс), после которой
+# в лог пишется итог, а запись в истории обновляется
+THRESHOLD_SETTLE_MS = 400
+
+# Повторные проверки сервера анализа, если он недоступен или ещё
+# загружает модели: пауза удваивается от первой до максимальной (мс)
+MODEL_RETRY_FIRST_MS = 1000
+MODEL_RETRY_MAX_MS = 30000
+
+STAGE_NAMES = {
+    "detect": "Поиск зубов",
+    "crop": "Выделение зоны интереса",
+    "segment": "Сегментация патологий",
+    "associate": "Сопоставление находок",
+}
+
+def disease_labels(segments):
+    return set(seg['label'] for seg in segments if not seg['label'].startswith('tooth'))
 
 class DentalDiagnosisApp(QWidget):
     def __init__(self):
         super().__init__()
         self.setWindowTitle("OPG Scanner")
         self.setMinimumSize(1000, 700)
+        self.models_ready = False
+        self.model_retry_ms = None
+        self.analysis_job = 0
+        self.analysis_worker = None
+        # Все запущенные окном потоки (загрузка моделей, анализ, включая
+        # отменённые, но ещё не вышедшие из инференса): их ждём при закрытии
+        self.threads = []
+        self.closing = False
+        # Последний показанный результат (для отчёта) и выходы моделей для
+        # него: с ними смена порогов повторяет только сопоставление
+        self.current_result = None
+        self.model_outputs = None
+        self.analysis_thresholds = None
+        # Запись истории для показанного результата (StudyStore)
+        self.study_id = None
+        self.threshold_timer = QTimer(self)
+        self.threshold_timer.setSingleShot(True)
+        self.threshold_timer.setInterval(THRESHOLD_SETTLE_MS)
+        self.threshold_timer.timeout.connect(self.on_thresholds_settled)
         self.init_ui()
+        self.load_recent_scans()
+        self.start_model_loading()
 
     def init_ui(self):
         # Левая панель
@@ -27,7 +72,11 @@ class DentalDiagnosisApp(QWidget):
         self.zoom_out_btn = QPushButton("Уменьшить")
         self.fit_btn = QPushButton("Выровнять по окну")
 
+        self.model_status = QLabel("Загрузка моделей...")
+        self.model_status.setWordWrap(True)
+
         left_layout = QVBoxLayout()
+        left_layout.addWidget(self.model_status)
         left_layout.addWidget(self.load_btn)
         left_layout.addWidget(self.save_btn)
         left_layout.addWidget(self.zoom_in_btn)
@@ -40,7 +89,10 @@ class DentalDiagnosisApp(QWidget):
         self.canvas.setMinimumSize(400, 400)
 
         # Правая панель
-        self.filter_panel = FilterPanel(on_filter_changed=self.on_filter_changed)
+        self.filter_panel = FilterPanel(
+            on_filter_changed=self.on_filter_changed,
+            on_thresholds_changed=self.on_thresholds_changed,
+        )
         self.recent_label = QLabel("Последние сканирования")
         self.recent_scans = QListWidget()
         right_layout = QVBoxLayout()
@@ -79,18 +131,114 @@ class DentalDiagnosisApp(QWidget):
         self.zoom_in_btn.clicked.connect(self.canvas.zoom_in)
         self.zoom_out_btn.clicked.connect(self.canvas.zoom_out)
         self.fit_btn.clicked.connect(self.canvas.fit_to_window)
+        self.recent_scans.itemClicked.connect(self.open_recent_scan)
+        self.canvas.segment_selected.connect(self.on_segment_selected)
+
+    def start_thread(self, thread):
+        self.threads.append(thread)
+        thread.finished.connect(lambda: self.threads.remove(thread))
+        thread.start()
+
+    def start_model_loading(self):
+        if self.closing:
+            return
+        # При повторной проверке сервера кнопка остаётся доступной
+        if self.model_retry_ms is None:
+            self.load_btn.setEnabled(False)
+        self.model_loader = ModelLoader(self)
+        self.model_loader.ready.connect(self.on_models_ready)
+        self.model_loader.failed.connect(self.on_models_failed)
+        self.start_thread(self.model_loader)
+
+    def on_models_ready(self):
+        self.models_ready = True
+        if self.model_retry_ms is not None:
+            self.log("Сервер анализа доступен")
+        self.model_retry_ms = None
+        self.model_status.setText("Сервер анализа готов" if get_client() is not None else "Модели готовы")
+        self.load_btn.setEnabled(True)
+
+    def on_models_failed(self, error):
+        # Снимок можно открыть и без готовых моделей: анализ сообщит
+        # об ошибке сам, а окно не остаётся заблокированным
+        self.load_btn.setEnabled(True)
+        if get_client() is None:
+            self.model_status.setText("Ошибка загрузки моделей")
+            self.log(f"[Ошибка] Не удалось загрузить модели: {error}")
+            return
+        if self.model_retry_ms is None:
+            self.log(f"[Ошибка] Сервер анализа недоступен: {error}")
+            self.model_retry_ms = MODEL_RETRY_FIRST_MS
+        else:
+            self.model_retry_ms = min(self.model_retry_ms * 2, MODEL_RETRY_MAX_MS)
+        self.model_status.setText(f"Сервер анализа недоступен, повтор через {self.model_retry_ms // 1000} с")
+        QTimer.singleShot(self.model_retry_ms, self.start_model_loading)
 
     def log(self, text):
         self.log_output.append(text)
 
     def load_image(self):
-        path, _ = QFileDialog.getOpenFileName(self, "Выбрать снимок", "", "Изображения (*.png *.jpg *.jpeg)")
+        path, _ = QFileDialog.getOpenFileName(self, "Выбрать снимок", "", "Изображения (*.png *.jpg *.jpeg *.tif *.tiff *.raw)")
         if path:
-            self.canvas.set_image(path)
+            # Снимок декодируется один раз: тот же буфер показывает Canvas
+            # и получает анализ
+            # Битый или неподдерживаемый файл не должен ронять окно
+            try:
+                self.canvas.set_image(ScanImage.open(path))
+            except Exception as e:
+                self.log(f"[Ошибка] Не удалось открыть снимок: {e}")
+                return
             self.log(f"Загружен снимок: {path.split('/')[-1]}")
-            self.recent_scans.addItem(f"Снимок: {path.split('/')[-1]}")
+            # Пороги задаются для нового анализа, в том числе на сервере
+            self.filter_panel.set_thresholds_enabled(True)
             self.analyze_image()
 
+    def load_recent_scans(self, limit=200):
+        # В списке только последние записи; остальные остаются в хранилище
+        self.recent_scans.clear()
+        for study_id, path, name, created_at, n_findings in get_store().recent(limit):
+            self.add_recent_item(study_id, name)
+
+    def add_recent_item(self, study_id, name, on_top=False):
+        item = QListWidgetItem(f"Снимок: {name}")
+        item.setData(Qt.UserRole, study_id)
+        if on_top:
+            self.recent_scans.insertItem(0, item)
+        else:
+            self.recent_scans.addItem(item)
+
+    def open_recent_scan(self, item):
+        # Восстановление сохранённого результата без повторного анализа
+        study_id = item.data(Qt.UserRole)
+        study = get_store().load(study_id)
+        if study is None:
+            self.log("[Ошибка] Запись не найдена в хранилище")
+            return
+        path, messages, segments, outputs, thresholds = study
+        if not os.path.exists(path):
+            self.log(f"[Ошибка] Файл снимка не найден: {path}")
+            return
+        self.cancel_analysis()
+        self.analysis_job += 1
+        self.canvas.stop_analysis_animation()
+        try:
+            self.canvas.set_image(path)
+        except Exception as e:
+            self.log(f"[Ошибка] Не удалось открыть снимок: {e}")
+            return
+        self.log(f"Открыт сохранённый снимок: {os.path.basename(path)}")
+        self.model_outputs = outputs
+        self.study_id = study_id
+        # Ползунки — в положение, с которым сохранён результат
+        if thresholds is not None:
+            self.filter_panel.set_thresholds(*thresholds)
+        self.filter_panel.set_thresholds_enabled(outputs is not None)
+        self.show_results(messages, segments)
+
+    def on_segment_selected(self, segment):
+        if segment is not None:
+            self.log(self.canvas.describe_segment(segment))
+
     def on_filter_changed(self):
         active_rows = self.filter_panel.get_active_rows()
         active_diseases = self.filter_panel.get_active_diseases()
@@ -102,34 +250,148 @@ class DentalDiagnosisApp(QWidget):
             elif seg.get('is_pathology', False) or seg.get('is_extra', False):
                 if seg['label'] in active_diseases:
                     visible.append(seg)
-        self.canvas.visible_segments = visible
-        self.canvas.active_labels = {seg['label'] for seg in visible}
-        self.canvas.update()
+        self.canvas.set_visible_segments(visible)
 
     def analyze_image(self):
-        if not hasattr(self.canvas, 'image_path'):
+        if self.canvas.scan is None:
             self.log("[Ошибка] Изображение не загружено")
             return
-        try:
-            self.log("Начало анализа...")
-            messages, segments = diagnose_image(self.canvas.image_path)
-            print("Передано в canvas: ", [s['label'] for s in segments])
+        # Новый снимок отменяет незавершённый анализ предыдущего
+        self.cancel_analysis()
+        self.analysis_job += 1
+        self.log("Начало анализа...")
+        self.canvas.set_segments([])
+        self.current_result = None
+        self.model_outputs = None
+        self.study_id = None
+        self.canvas.start_analysis_animation()
+
+        self.analysis_thresholds = self.filter_panel.get_thresholds()
+        worker = AnalysisWorker(self.analysis_job, self.canvas.scan, self, *self.analysis_thresholds)
+        worker.progress.connect(self.on_analysis_progress)
+        worker.done.connect(self.on_analysis_done)
+        worker.failed.connect(self.on_analysis_failed)
+        worker.finished.connect(worker.deleteLater)
+        self.analysis_worker = worker
+        self.start_thread(worker)
+
+    def cancel_analysis(self):
+        if self.analysis_worker is not None:
+            self.analysis_worker.cancel()
+            self.analysis_worker = None
+
+    def closeEvent(self, event):
+        # Повторная проверка сервера по таймеру больше не запускается
+        self.closing = True
+        self.cancel_analysis()
+        for thread in list(self.threads):
+            thread.wait()
+        self.canvas.cancel_pyramid_build()
+        super().closeEvent(event)
+
+    def on_analysis_progress(self, job_id, stage, percent):
+        if job_id != self.analysis_job:
+            return
+        self.canvas.set_analysis_stage(f"{STAGE_NAMES.get(stage, stage)}... {percent}%")
+
+    def on_analysis_done(self, job_id, messages, segments, outputs):
+        if job_id != self.analysis_job:
+            return
+        self.analysis_worker = None
+        self.model_outputs = outputs
+        self.canvas.stop_analysis_animation()
+        # Пороги сдвинули во время анализа — сопоставление по новым
+        thresholds = self.filter_panel.get_thresholds()
+        if outputs is not None and thresholds != self.analysis_thresholds:
+            messages, segments = associate(outputs, *thresholds)
+        else:
+            thresholds = self.analysis_thresholds
+        self.study_id = get_store().add_study(self.canvas.image_path, messages, segments, outputs, thresholds)
+        self.add_recent_item(self.study_id, os.path.basename(self.canvas.image_path), on_top=True)
+        self.filter_panel.set_thresholds_enabled(outputs is not None)
+        self.show_results(messages, segments)
+
+    def show_results(self, messages, segments):
+        self.current_result = (messages, segments)
+        if trace.active():
+            trace.debug("Передано в canvas: %s", [s['label'] for s in segments])
+        with trace.span("canvas.set_segments", count=len(segments)):
             self.canvas.set_segments(segments)
-            for msg in messages:
-                self.log(msg)
-            row_names = set(get_row_from_label(seg['label']) for seg in segments if seg['label'].startswith('tooth'))
-            disease_labels = set(seg['label'] for seg in segments if not seg['label'].startswith('tooth'))
-            self.filter_panel.update_rows(row_names)
-            self.filter_panel.update_diseases(disease_labels)
+        for msg in messages:
+            self.log(msg)
+        row_names = set(get_row_from_label(seg['label']) for seg in segments if seg['label'].startswith('tooth'))
+        self.filter_panel.update_rows(row_names)
+        self.filter_panel.update_diseases(disease_labels(segments))
+        self.on_filter_changed()
+
+    def on_thresholds_changed(self):
+        # Сопоставление по сохранённым выходам моделей занимает миллисекунды,
+        # поэтому находки и наложение обновляются сразу, при каждом шаге
+        # ползунка. Лог — один раз, когда ползунок остановился
+        self.threshold_timer.start()
+        if self.model_outputs is None:
+            return
+        overlap_threshold, conf_threshold = self.filter_panel.get_thresholds()
+        with trace.span("gui.reassociate"):
+            messages, segments = associate(self.model_outputs, overlap_threshold, conf_threshold)
+            self.current_result = (messages, segments)
+            self.canvas.update_segments(segments)
+            # Классы, прошедшие или выпавшие по новому порогу, — в списке
+            # фильтра, иначе их находки не попадут на наложение
+            self.filter_panel.update_diseases(disease_labels(segments), keep_states=True)
             self.on_filter_changed()
-        except Exception as e:
-            self.log(f"[Ошибка] {str(e)}")
-            import traceback
-            print(f"Полная ошибка: {traceback.format_exc()}")
+
+    def on_thresholds_settled(self):
+        # Без выходов моделей ползунки для результата выключены, а во время
+        # анализа новые пороги применит on_analysis_done
+        if self.model_outputs is None or self.current_result is None:
+            return
+        overlap_threshold, conf_threshold = self.filter_panel.get_thresholds()
+        self.log(f"Пороги: перекрытие {overlap_threshold:.2f}, уверенность {conf_threshold:.2f}")
+        messages, segments = self.current_result
+        for msg in messages:
+            self.log(msg)
+        # Та же запись истории, а не новая
+        if self.study_id is not None:
+            get_store().update_study(self.study_id, messages, segments, (overlap_threshold, conf_threshold))
+
+    def on_analysis_failed(self, job_id, error):
+        if job_id != self.analysis_job:
+            return
+        self.analysis_worker = None
+        self.canvas.stop_analysis_animation()
+        self.log(f"[Ошибка] {error}")
 
     def save_result(self):
-        path, _ = QFileDialog.getSaveFileName(self, "Сохранить отчет", "", "Text Files (*.txt)")
-        if path:
+        # Текстовый лог или структурированный отчёт (zip: JSON с масками
+        # в RLE, при желании с наложением в разрешении снимка)
+        text_filter = "Текст (*.txt)"
+        report_filter = "Отчёт (*.zip)"
+        overlay_filter = "Отчёт с наложением (*.zip)"
+        path, selected = QFileDialog.getSaveFileName(
+            self, "Сохранить отчет", "", ";;".join([text_filter, report_filter, overlay_filter])
+        )
+        if not path:
+            return
+        if selected == text_filter:
             with open(path, "w", encoding="utf-8") as f:
                 f.write(self.log_output.toPlainText())
-            self.log("Отчет сохранен")
\ No newline at end of file
+            self.log("Отчет сохранен")
+            return
+
+        if self.current_result is None or self.canvas.scan is None:
+            self.log("[Ошибка] Нет результата анализа для отчёта")
+            return
+        if not path.lower().endswith(".zip"):
+            path += ".zip"
+        messages, segments = self.current_result
+        overlap_threshold, conf_threshold = self.filter_panel.get_thresholds()
+        try:
+            export_report(
+                path, self.canvas.scan, messages, segments,
+                overlap_threshold, conf_threshold, overlay=selected == overlay_filter,
+            )
+        except OSError as e:
+            self.log(f"[Ошибка] Не удалось сохранить отчет: {e}")
+            return
+        self.log(f"Отчет сохранен: {os.path.basename(path)}")
@@ -0,0 +1,41 @@
+# gui/spatial_index.py
+
+import math
+from collections import defaultdict
+from PyQt5.QtCore import Qt, QPointF
+
+class GridIndex:
+    # Равномерная сетка по координатам снимка: в каждой ячейке —
+    # элементы, чей bbox её задевает. Запрос по точке проверяет только
+    # элементы одной ячейки: сначала bbox, затем точный тест полигона
+    def __init__(self, cell_size=128):
+        self.cell_size = cell_size
+        self.cells = defaultdict(list)
+        self.items = []
+
+    def _cell_range(self, x0, y0, x1, y1):
+        c = self.cell_size
+        return range(int(math.floor(x0 / c)), int(math.floor(x1 / c)) + 1), \
+            range(int(math.floor(y0 / c)), int(math.floor(y1 / c)) + 1)
+
+    def insert(self, item, geometry):
+        index = len(self.items)
+        self.items.append((item, geometry))
+        xs, ys = self._cell_range(*geometry.bbox)
+        for cy in ys:
+            for cx in xs:
+                self.cells[(cx, cy)].append(index)
+
+    def query(self, x, y):
+        # Все элементы, чей полигон содержит точку, в порядке добавления
+        c = self.cell_size
+        hits = []
+        point = QPointF(x, y)
+        for index in self.cells.get((int(math.floor(x / c)), int(math.floor(y / c))), ()):
+            item, geometry = self.items[index]
+            x0, y0, x1, y1 = geometry.bbox
+            if not (x0 <= x <= x1 and y0 <= y <= y1):
+                continue
+            if geometry.polygon().containsPoint(point, Qt.OddEvenFill):
+                hits.append(item)
+        return hits
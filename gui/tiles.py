@@ -0,0 +1,104 @@
+# gui/tiles.py
+
+import math
+from collections import OrderedDict
+from PyQt5.QtGui import QImage, QPixmap
+from PyQt5.QtCore import Qt, QThread, QRect, pyqtSignal
+
+TILE_SIZE = 256
+MAX_TILES = 256      # ~64 МБ тайлов ARGB 256x256 в кэше
+MIN_LEVEL_SIZE = 512  # уровни строятся, пока большая сторона больше этого
+
+def bgr_to_qimage(bgr):
+    # QImage поверх BGR-массива без копирования: массив должен
+    # жить, пока жив QImage
+    return QImage(bgr.data, bgr.shape[1], bgr.shape[0], bgr.strides[0], QImage.Format_BGR888)
+
+class PyramidBuilder(QThread):
+    # Строит уменьшенные вдвое копии снимка вне GUI-потока.
+    # QImage можно масштабировать в любом потоке, QPixmap — только в GUI.
+    # Для 16-битного снимка (scan) сначала строится его 8-битный буфер,
+    # и готовый полный уровень приходит сигналом base_ready
+    level_ready = pyqtSignal(int, int, QImage)
+    base_ready = pyqtSignal(int, QImage)
+
+    def __init__(self, generation, image, parent=None, scan=None):
+        super().__init__(parent)
+        self.generation = generation
+        self.image = image
+        self.scan = scan
+        self._cancelled = False
+
+    def cancel(self):
+        self._cancelled = True
+
+    def run(self):
+        if self.image is None:
+            self.image = bgr_to_qimage(self.scan.bgr)
+            if self._cancelled:
+                return
+            self.base_ready.emit(self.generation, self.image)
+        level, current = 0, self.image
+        while max(current.width(), current.height()) > MIN_LEVEL_SIZE and not self._cancelled:
+            level += 1
+            current = current.scaled(
+                math.ceil(current.width() / 2),
+                math.ceil(current.height() / 2),
+                Qt.IgnoreAspectRatio,
+                Qt.SmoothTransformation,
+            )
+            self.level_ready.emit(self.generation, level, current)
+
+class TilePyramid:
+    # Уровень 0 — исходный снимок, уровень k — уменьшенный в 2^k раз.
+    # Тайлы нарезаются из уровня при первом обращении и хранятся в LRU.
+    # width и height — размер исходника; пока он не декодирован, уровнем 0
+    # может быть превью меньшего размера (масштаб уровня считается по размерам)
+    def __init__(self, image, width=None, height=None):
+        self.levels = [image]
+        self.width = width or image.width()
+        self.height = height or image.height()
+        self._tiles = OrderedDict()
+
+    def add_level(self, level, image):
+        if level == len(self.levels):
+            self.levels.append(image)
+
+    def level_for_scale(self, scale):
+        # Самый грубый из готовых уровней, разрешение которого
+        # не ниже отображаемого
+        level = 0
+        while level + 1 < len(self.levels) and self.levels[level + 1].width() >= self.width * scale:
+            level += 1
+        return level
+
+    def level_factor(self, level):
+        # Сколько пикселей исходника приходится на пиксель уровня
+        return self.width / self.levels[level].width()
+
+    def tile(self, level, tx, ty):
+        key = (level, tx, ty)
+        pixmap = self._tiles.get(key)
+        if pixmap is not None:
+            self._tiles.move_to_end(key)
+            return pixmap
+        img = self.levels[level]
+        rect = QRect(tx * TILE_SIZE, ty * TILE_SIZE, TILE_SIZE, TILE_SIZE).intersected(img.rect())
+        pixmap = QPixmap.fromImage(img.copy(rect))
+        self._tiles[key] = pixmap
+        while len(self._tiles) > MAX_TILES:
+            self._tiles.popitem(last=False)
+        return pixmap
+
+    def visible_tiles(self, level, x0, y0, x1, y1):
+        # Тайлы уровня, пересекающие прямоугольник (x0, y0, x1, y1)
+        # в координатах исходного снимка
+        f = self.level_factor(level)
+        img = self.levels[level]
+        tx0 = max(0, int(x0 / f) // TILE_SIZE)
+        ty0 = max(0, int(y0 / f) // TILE_SIZE)
+        tx1 = min((img.width() - 1) // TILE_SIZE, int(math.ceil(x1 / f) - 1) // TILE_SIZE)
+        ty1 = min((img.height() - 1) // TILE_SIZE, int(math.ceil(y1 / f) - 1) // TILE_SIZE)
+        for ty in range(ty0, ty1 + 1):
+            for tx in range(tx0, tx1 + 1):
+                yield tx, ty
@@ -0,0 +1,89 @@
+# gui/workers.py
+
+from PyQt5.QtCore import QThread, pyqtSignal
+
+from ai.diagnosis import warmup, analyze_image, associate, AnalysisCancelled, STAGES
+from ai.cache import get_cache
+from ai.remote import get_client
+
+class ModelLoader(QThread):
+    # Загрузка весов и прогревочный прогон моделей в фоне,
+    # чтобы окно появлялось сразу после запуска. С сервером анализа
+    # (remote_url в конфиге) вместо этого проверяется его доступность
+    ready = pyqtSignal()
+    failed = pyqtSignal(str)
+
+    def run(self):
+        try:
+            client = get_client()
+            if client is None:
+                warmup()
+            else:
+                health = client.health()
+                if health["status"] == "loading":
+                    raise RuntimeError("сервер анализа ещё загружает модели")
+                if health["status"] != "ok":
+                    raise RuntimeError(health.get("error", health["status"]))
+        except Exception as e:
+            self.failed.emit(str(e))
+            return
+        self.ready.emit()
+
+class AnalysisWorker(QThread):
+    # Анализ снимка вне главного потока. Сигналы доставляются в GUI-поток
+    # через очередь событий Qt, job_id позволяет отбросить устаревшие результаты.
+    # done передаёт и выходы моделей (ModelOutputs), чтобы при смене порогов
+    # повторять только сопоставление; с сервером анализа их нет (None)
+    progress = pyqtSignal(int, str, int)
+    done = pyqtSignal(int, list, list, object)
+    failed = pyqtSignal(int, str)
+
+    def __init__(self, job_id, scan, parent=None, overlap_threshold=0.15, conf_threshold=0.0):
+        # scan — ScanImage, уже открытый для показа на Canvas
+        super().__init__(parent)
+        self.job_id = job_id
+        self.scan = scan
+        self.overlap_threshold = overlap_threshold
+        self.conf_threshold = conf_threshold
+        self._cancelled = False
+
+    def cancel(self):
+        self._cancelled = True
+
+    def is_cancelled(self):
+        return self._cancelled
+
+    def report_stage(self, stage):
+        percent = int(100 * STAGES.index(stage) / len(STAGES))
+        self.progress.emit(self.job_id, stage, percent)
+
+    def run(self):
+        try:
+            client = get_client()
+            outputs = None
+            if client is not None:
+                messages, segments = client.diagnose_image(
+                    self.scan,
+                    self.overlap_threshold,
+                    self.conf_threshold,
+                    progress=self.report_stage,
+                    cancelled=self.is_cancelled,
+                )
+            else:
+                outputs = analyze_image(
+                    self.scan,
+                    progress=self.report_stage,
+                    cancelled=self.is_cancelled,
+                    cache=get_cache(),
+                )
+                self.report_stage("associate")
+                messages, segments = associate(outputs, self.overlap_threshold, self.conf_threshold)
+        except AnalysisCancelled:
+            return
+        except Exception as e:
+            import traceback
+            print(f"Полная ошибка: {traceback.format_exc()}")
+            self.failed.emit(self.job_id, str(e))
+            return
+        if not self._cancelled:
+            self.done.emit(self.job_id, messages, segments, outputs)
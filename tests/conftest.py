@@ -0,0 +1,39 @@
+# tests/conftest.py
+#
+# Тесты идут на заглушках моделей из bench/stubs.py: весов и ultralytics
+# не нужно. Пути к весам в конвейере относительные, поэтому тесты
+# запускаются из корня репозитория.
+
+import os
+import sys
+import pytest
+import cv2
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+# Маленький снимок: полный прикус заглушки, но быстрые тесты
+SCAN_SIZE = (1160, 580)
+
+@pytest.fixture(autouse=True)
+def repo_root(monkeypatch):
+    monkeypatch.chdir(ROOT)
+
+@pytest.fixture
+def stubs(monkeypatch):
+    from ai import teeth_detect, disease_seg
+    from bench.stubs import StubTeethEngine, StubSegEngine
+
+    monkeypatch.setattr(teeth_detect, "model", StubTeethEngine())
+    monkeypatch.setattr(disease_seg, "model", StubSegEngine(disease_seg.NUM_CLASSES))
+
+@pytest.fixture
+def make_scan(tmp_path):
+    from bench.stubs import make_opg
+
+    def make(name="scan.png", seed=0):
+        path = str(tmp_path / name)
+        cv2.imwrite(path, make_opg(*SCAN_SIZE, seed=seed))
+        return path
+    return make
@@ -0,0 +1,28 @@
+# tests/test_associate.py
+
+from ai.diagnosis import analyze_image, associate
+
+def without_confidence(outputs):
+    masks_seg = dict(outputs.masks_seg)
+    masks_seg["pathologies"] = [{k: v for k, v in item.items() if k != "confidence"}
+                                for item in masks_seg["pathologies"]]
+    return outputs._replace(masks_seg=masks_seg)
+
+def test_default_thresholds_match_baseline_without_confidence(stubs, make_scan):
+    # До появления уверенности сегментации порог уверенности ничего не
+    # отсекал: по умолчанию находки должны остаться прежними даже при
+    # низкой уверенности
+    outputs = analyze_image(make_scan())
+    for item in outputs.masks_seg["pathologies"]:
+        item["confidence"] = 0.05
+    assert outputs.masks_seg["pathologies"]
+
+    def findings(segments):
+        return [(seg["label"], [f["label"] for f in seg.get("findings", [])]) for seg in segments]
+
+    messages, segments = associate(outputs)
+    base_messages, base_segments = associate(without_confidence(outputs))
+    # Сообщения отличаются только выведенным значением уверенности
+    assert len(messages) == len(base_messages)
+    assert findings(segments) == findings(base_segments)
+    assert any(labels for _, labels in findings(segments))
@@ -0,0 +1,83 @@
+# tests/test_batch.py
+
+import json
+
+from ai import batch, teeth_detect
+
+def read_records(output):
+    records = []
+    with open(output, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                continue
+    return records
+
+def test_resume_skips_done_and_retries_failed(stubs, make_scan, tmp_path, monkeypatch):
+    paths = [make_scan(f"s{i}.png", seed=i) for i in range(4)]
+    output = str(tmp_path / "out.jsonl")
+
+    # Второй батч падает целиком: его снимки записаны с ошибкой
+    real_analyze = batch.analyze_batch
+    def fail_second(batch_paths, *args, **kwargs):
+        if batch_paths[0] == paths[2]:
+            raise MemoryError("временный сбой")
+        return real_analyze(batch_paths, *args, **kwargs)
+    with monkeypatch.context() as m:
+        m.setattr(batch, "analyze_batch", fail_second)
+        batch.run_batch(paths, output, batch_size=2)
+    assert batch.read_done(output) == set(paths[:2])
+
+    seen = []
+    def record_calls(batch_paths, *args, **kwargs):
+        seen.extend(batch_paths)
+        return real_analyze(batch_paths, *args, **kwargs)
+    monkeypatch.setattr(batch, "analyze_batch", record_calls)
+    batch.run_batch(paths, output, batch_size=2)
+    assert seen == paths[2:]
+    assert batch.read_done(output) == set(paths)
+    assert "error" not in read_records(output)[-1]
+
+def test_truncated_last_line_is_redone(stubs, make_scan, tmp_path):
+    paths = [make_scan(f"s{i}.png", seed=i) for i in range(2)]
+    output = str(tmp_path / "out.jsonl")
+    batch.run_batch(paths, output)
+    with open(output, "r", encoding="utf-8") as f:
+        lines = f.readlines()
+    # Аварийная остановка посреди записи второй строки
+    with open(output, "w", encoding="utf-8") as f:
+        f.write(lines[0] + lines[1][:20])
+    assert batch.read_done(output) == {paths[0]}
+
+    batch.run_batch(paths, output)
+    assert batch.read_done(output) == set(paths)
+    assert len(read_records(output)[-1]["teeth"]) > 0
+
+def test_success_after_error_marks_scan_done(tmp_path):
+    output = str(tmp_path / "out.jsonl")
+    with open(output, "w", encoding="utf-8") as f:
+        f.write(json.dumps({"path": "a.png", "error": "сбой"}) + "\n")
+        f.write(json.dumps({"path": "a.png", "messages": []}) + "\n")
+        f.write(json.dumps({"path": "b.png", "error": "сбой"}) + "\n")
+    assert batch.read_done(output) == {"a.png"}
+
+def test_model_and_decode_failures_are_retried(stubs, make_scan, tmp_path, monkeypatch):
+    paths = [make_scan(f"s{i}.png", seed=i) for i in range(2)]
+    broken = str(tmp_path / "broken.png")
+    with open(broken, "wb") as f:
+        f.write(b"not an image")
+    output = str(tmp_path / "out.jsonl")
+
+    class Failing:
+        def __call__(self, *args, **kwargs):
+            raise MemoryError("временный сбой")
+    stub = teeth_detect.model
+    monkeypatch.setattr(teeth_detect, "model", Failing())
+    batch.run_batch(paths + [broken], output, batch_size=2)
+    assert batch.read_done(output) == set()
+    assert all("error" in record for record in read_records(output))
+
+    monkeypatch.setattr(teeth_detect, "model", stub)
+    batch.run_batch(paths + [broken], output, batch_size=2)
+    assert batch.read_done(output) == set(paths)
@@ -0,0 +1,37 @@
+# tests/test_cache.py
+
+from ai import teeth_detect
+from ai.cache import ResultCache, make_key
+from ai.diagnosis import diagnose_image
+
+def test_unwritable_cache_dir_does_not_break_analysis(stubs, make_scan, tmp_path):
+    path = make_scan()
+    # Вместо папки кэша — файл: makedirs падает с NotADirectoryError
+    blocker = tmp_path / "cache"
+    blocker.write_text("")
+    cache = ResultCache(str(blocker / "results"))
+
+    messages, segments = diagnose_image(path, cache=cache)
+    assert segments
+    again, again_segments = diagnose_image(path, cache=cache)
+    assert again == messages
+    assert len(again_segments) == len(segments)
+
+def test_transient_model_failure_is_not_cached(stubs, make_scan, tmp_path, monkeypatch):
+    path = make_scan()
+    cache = ResultCache(str(tmp_path / "cache"))
+    stub = teeth_detect.model
+
+    class Failing:
+        def __call__(self, *args, **kwargs):
+            raise MemoryError("временный сбой")
+    monkeypatch.setattr(teeth_detect, "model", Failing())
+    messages, segments = diagnose_image(path, cache=cache)
+    assert segments == []
+    assert cache.get(make_key(path)) is None
+
+    # Модель восстановилась — снимок анализируется заново
+    monkeypatch.setattr(teeth_detect, "model", stub)
+    messages, segments = diagnose_image(path, cache=cache)
+    assert segments
+    assert cache.get(make_key(path)) is not None
@@ -0,0 +1,65 @@
+# tests/test_disease_seg.py
+
+import numpy as np
+
+from ai.classes import CLASSES
+from ai.disease_seg import masks_to_results
+
+CARIES = CLASSES.index("caries")
+FILLING = CLASSES.index("filling")
+
+def test_components_become_numbered_instances():
+    masks = np.zeros((64, 64), dtype=np.int64)
+    masks[5:15, 5:15] = CARIES
+    masks[40:50, 30:45] = CARIES
+    masks[20:30, 50:60] = FILLING
+    results = masks_to_results(masks, min_area=1)
+
+    assert results["shape"] == (64, 64)
+    assert "label_map" not in results
+    caries = results["pathologies"]
+    assert [item["instance"] for item in caries] == [0, 1]
+    assert [item["area"] for item in caries] == [100, 150]
+    assert [item["bbox"] for item in caries] == [(5, 5, 15, 15), (30, 40, 45, 50)]
+    assert (caries[1]["mask"].decode() == (masks == CARIES) & (np.arange(64)[:, None] >= 40)).all()
+    assert [(item["label"], item["instance"]) for item in results["extra"]] == [("filling", 0)]
+
+def test_diagonal_pixels_are_one_component():
+    masks = np.zeros((16, 16), dtype=np.int64)
+    for i in range(6):
+        masks[i + 2, i + 2] = CARIES
+    results = masks_to_results(masks, min_area=1)
+    assert len(results["pathologies"]) == 1
+    assert results["pathologies"][0]["area"] == 6
+
+def test_min_area_drops_noise_without_gaps_in_numbering():
+    masks = np.zeros((64, 64), dtype=np.int64)
+    masks[2:4, 2:4] = CARIES      # 4 пикселя — шум
+    masks[10:20, 10:20] = CARIES
+    masks[30:31, 30:33] = CARIES  # 3 пикселя — шум
+    masks[40:50, 40:50] = CARIES
+    results = masks_to_results(masks, min_area=10)
+    caries = results["pathologies"]
+    assert [item["area"] for item in caries] == [100, 100]
+    assert [item["instance"] for item in caries] == [0, 1]
+
+def test_min_area_defaults_to_config(monkeypatch):
+    from ai import disease_seg
+
+    masks = np.zeros((32, 32), dtype=np.int64)
+    masks[5:8, 5:8] = CARIES
+    monkeypatch.setattr(disease_seg, "get_config", lambda: {"seg_min_area": 10})
+    assert masks_to_results(masks)["pathologies"] == []
+    monkeypatch.setattr(disease_seg, "get_config", lambda: {"seg_min_area": 9})
+    assert len(masks_to_results(masks)["pathologies"]) == 1
+
+def test_confidence_is_mean_probability_of_instance():
+    masks = np.zeros((32, 32), dtype=np.int64)
+    masks[2:6, 2:6] = CARIES
+    masks[20:24, 20:24] = CARIES
+    prob_map = np.full((32, 32), 0.9, dtype=np.float32)
+    prob_map[20:22, 20:24] = 0.5
+    caries = masks_to_results(masks, min_area=1, prob_map=prob_map)["pathologies"]
+    assert np.isclose(caries[0]["confidence"], 0.9)
+    assert np.isclose(caries[1]["confidence"], 0.7)
+    assert "confidence" not in masks_to_results(masks, min_area=1)["pathologies"][0]
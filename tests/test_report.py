@@ -0,0 +1,100 @@
+# tests/test_report.py
+
+import sys
+import json
+import zipfile
+import subprocess
+import numpy as np
+
+from ai.diagnosis import diagnose_image
+from ai.report import ReportArchive, build_record, iter_records, render_overlay
+
+def diagnose(path):
+    messages, segments = diagnose_image(path)
+    assert any(seg.get('is_pathology') for seg in segments)
+    return messages, segments
+
+def test_archive_roundtrip(stubs, make_scan, tmp_path):
+    path = make_scan()
+    messages, segments = diagnose(path)
+    archive_path = str(tmp_path / "report.zip")
+    with ReportArchive(archive_path) as archive:
+        archive.add(build_record(path, messages, segments), render_overlay(path, segments))
+
+    names = zipfile.ZipFile(archive_path).namelist()
+    assert "meta.json" in names
+    record, = iter_records(archive_path, masks=True)
+    assert record["path"] == path
+    assert record["overlay"] in names
+    assert [t["label"] for t in record["teeth"]] == [s["label"] for s in segments if s.get('is_tooth')]
+
+    pathologies = [s for s in segments if s.get('is_pathology')]
+    assert len(record["pathologies"]) == len(pathologies)
+    for item, seg in zip(record["pathologies"], pathologies):
+        assert np.array_equal(item["mask"].decode(), seg["mask"].decode())
+        assert item["zone"] == dict(zip(("x_min", "pad_top", "scale"), map(float, seg["zone"])))
+
+def test_unclosed_archive_survives_restart(stubs, make_scan, tmp_path):
+    # Запуск прерван до close(): записи остаются в папке рядом с архивом
+    # и попадают в архив при следующем открытии
+    archive_path = str(tmp_path / "report.zip")
+    first, second = make_scan("a.png"), make_scan("b.png", seed=1)
+    archive = ReportArchive(archive_path)
+    archive.add(build_record(first, *diagnose(first)))
+    del archive
+
+    with ReportArchive(archive_path) as archive:
+        assert first in archive.paths
+        # Уже записанный снимок не дублируется
+        archive.add(build_record(first, *diagnose(first)))
+        archive.add(build_record(second, *diagnose(second)))
+    assert [r["path"] for r in iter_records(archive_path)] == [first, second]
+
+    with ReportArchive(archive_path) as archive:
+        assert set(archive.paths) == {first, second}
+    assert len(list(iter_records(archive_path))) == 2
+
+def test_record_is_json(stubs, make_scan):
+    path = make_scan()
+    record = build_record(path, *diagnose(path))
+    json.loads(json.dumps(record, default=lambda v: v.tolist()))
+
+KILLED_RUN = """
+import os, sys
+sys.path.insert(0, os.getcwd())
+from ai import batch, teeth_detect, disease_seg
+from bench.stubs import StubTeethEngine, StubSegEngine
+teeth_detect.model = StubTeethEngine()
+disease_seg.model = StubSegEngine(disease_seg.NUM_CLASSES)
+real_analyze = batch.analyze_batch
+calls = []
+def analyze_then_die(*args, **kwargs):
+    # Второй батч: процесс убит без финализации (как при SIGKILL)
+    if calls:
+        os._exit(1)
+    calls.append(1)
+    return real_analyze(*args, **kwargs)
+batch.analyze_batch = analyze_then_die
+batch.run_batch(sys.argv[1:-2], sys.argv[-2], batch_size=2, archive_path=sys.argv[-1])
+"""
+
+def test_batch_resume_keeps_archive(stubs, make_scan, tmp_path):
+    from ai import batch
+
+    paths = [make_scan(f"s{i}.png", seed=i) for i in range(4)]
+    output, archive_path = str(tmp_path / "out.jsonl"), str(tmp_path / "report.zip")
+    run = subprocess.run([sys.executable, "-c", KILLED_RUN] + paths + [output, archive_path], capture_output=True)
+    assert run.returncode == 1
+    assert len(batch.read_done(output)) == 2
+
+    batch.run_batch(paths, output, batch_size=2, archive_path=archive_path)
+    assert sorted(r["path"] for r in iter_records(archive_path)) == sorted(paths)
+
+def test_batch_requeues_done_scans_missing_from_archive(stubs, make_scan, tmp_path):
+    from ai import batch
+
+    paths = [make_scan(f"s{i}.png", seed=i) for i in range(3)]
+    output, archive_path = str(tmp_path / "out.jsonl"), str(tmp_path / "report.zip")
+    batch.run_batch(paths, output, batch_size=2)
+    batch.run_batch(paths, output, batch_size=2, archive_path=archive_path)
+    assert sorted(r["path"] for r in iter_records(archive_path)) == sorted(paths)
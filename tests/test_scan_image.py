@@ -0,0 +1,26 @@
+# tests/test_scan_image.py
+
+import numpy as np
+import pytest
+
+from ai.scan_image import ScanImage
+
+def test_compressed_rgba_tiff_gives_contiguous_bgr(tmp_path):
+    tifffile = pytest.importorskip("tifffile")
+    rgba = np.zeros((40, 60, 4), dtype=np.uint8)
+    rgba[..., 0] = 200  # R
+    rgba[..., 3] = 255
+    path = str(tmp_path / "scan.tif")
+    # Сжатый файл не отображается в память: снимок читает OpenCV
+    tifffile.imwrite(path, rgba, photometric="rgb", compression="zlib")
+
+    bgr = ScanImage.open(path).bgr
+    assert bgr.shape == (40, 60, 3)
+    assert bgr.flags.c_contiguous
+    assert bgr[0, 0].tolist() == [0, 0, 200]
+
+def test_from_array_makes_view_contiguous():
+    rgba = np.full((10, 20, 4), 7, dtype=np.uint8)
+    bgr = ScanImage.from_array(rgba[..., :3]).bgr
+    assert bgr.flags.c_contiguous
+    assert ScanImage.from_array(rgba).bgr.shape == (10, 20, 3)
@@ -0,0 +1,70 @@
+# tests/test_scheduler.py
+
+import threading
+
+import pytest
+
+from ai.diagnosis import diagnose_image
+from ai.scheduler import MicroBatcher, Scheduler, latency_summary
+
+def test_concurrent_requests_share_a_batch():
+    sizes = []
+    def double(items):
+        sizes.append(len(items))
+        return [x * 2 for x in items]
+    batcher = MicroBatcher("test", double, max_batch_size=4, max_wait_ms=200)
+    results = [None] * 4
+    def go(i):
+        results[i] = batcher(i)
+    threads = [threading.Thread(target=go, args=(i,)) for i in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    batcher.close()
+    assert results == [0, 2, 4, 6]
+    assert sizes == [4]
+
+def raise_memory_error(items):
+    raise MemoryError("временный сбой")
+
+def raise_system_exit(items):
+    raise SystemExit(1)
+
+def drop_last(items):
+    return items[:-1]
+
+@pytest.mark.parametrize("fn, error", [
+    (raise_memory_error, MemoryError),
+    (raise_system_exit, SystemExit),
+    (drop_last, RuntimeError),
+])
+def test_batch_failure_reaches_every_request_and_batcher_survives(fn, error):
+    sizes = []
+    def flaky(items):
+        sizes.append(len(items))
+        return fn(items) if "bad" in items else items
+    batcher = MicroBatcher("test", flaky, max_batch_size=3, max_wait_ms=500)
+    futures = [batcher.submit(item) for item in ("a", "bad", "c")]
+    for future in futures:
+        with pytest.raises(error):
+            future.result(timeout=5)
+    assert sizes == [3]
+    assert batcher.submit("ok").result(timeout=5) == "ok"
+    batcher.close()
+
+def test_latency_summary():
+    assert latency_summary([]) == {"p50": None, "p95": None, "max": None}
+    summary = latency_summary([i / 1000 for i in range(100, 0, -1)])
+    assert summary == pytest.approx({"p50": 51.0, "p95": 96.0, "max": 100.0})
+
+def test_scheduled_diagnosis_matches_direct(stubs, make_scan):
+    path = make_scan()
+    scheduler = Scheduler(max_batch_size=2, max_wait_ms=5)
+    try:
+        messages, segments = diagnose_image(path, scheduler=scheduler)
+    finally:
+        scheduler.close()
+    direct_messages, direct_segments = diagnose_image(path)
+    assert messages == direct_messages
+    assert [s["label"] for s in segments] == [s["label"] for s in direct_segments]
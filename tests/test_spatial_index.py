@@ -0,0 +1,95 @@
+# tests/test_spatial_index.py
+
+import os
+
+import numpy as np
+import pytest
+
+pytest.importorskip("PyQt5")
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+from PyQt5.QtCore import Qt, QPoint
+from PyQt5.QtWidgets import QApplication
+
+from ai.scan_image import ScanImage
+from gui.geometry import SegmentGeometry
+from gui.spatial_index import GridIndex
+
+def square(x0, y0, x1, y1):
+    return [[x0, y0], [x1, y0], [x1, y1], [x0, y1]]
+
+def make_index(polygons, cell_size=128):
+    index = GridIndex(cell_size)
+    for name, points in polygons:
+        index.insert(name, SegmentGeometry(points))
+    return index
+
+def test_point_inside_and_outside_polygon():
+    # Треугольник: угол bbox вне полигона отсекается точным тестом
+    index = make_index([("t", [[0, 0], [100, 0], [0, 100]])])
+    assert index.query(10, 10) == ["t"]
+    assert index.query(90, 90) == []
+    assert index.query(150, 10) == []
+    assert index.query(-5, 10) == []
+
+def test_overlapping_segments_in_insertion_order():
+    index = make_index([("a", square(0, 0, 100, 100)), ("b", square(50, 50, 150, 150))])
+    assert index.query(75, 75) == ["a", "b"]
+    assert index.query(25, 25) == ["a"]
+    assert index.query(125, 125) == ["b"]
+
+def test_polygon_spanning_cell_boundaries():
+    # Квадрат на стыке четырёх ячеек: находится из каждой
+    index = make_index([("s", square(100, 100, 300, 300))], cell_size=128)
+    for x, y in [(101, 101), (127.9, 127.9), (128, 128), (255.9, 200), (256, 256), (299, 299)]:
+        assert index.query(x, y) == ["s"], (x, y)
+    assert index.query(301, 128) == []
+    assert index.query(128, 99) == []
+
+@pytest.fixture
+def canvas():
+    from gui.canvas import Canvas
+
+    app = QApplication.instance() or QApplication([])
+    canvas = Canvas()
+    canvas.resize(400, 300)
+    canvas.set_image(ScanImage.from_array(np.zeros((100, 200, 3), dtype=np.uint8)))
+    canvas.cancel_pyramid_build()
+    tooth = {"label": "tooth 11", "is_tooth": True, "points": square(10, 10, 90, 90)}
+    caries = {"label": "caries", "is_pathology": True, "instance": 1, "points": square(40, 40, 60, 60)}
+    canvas.set_segments([tooth, caries])
+    yield canvas, tooth, caries
+    canvas.deleteLater()
+    app.processEvents()
+
+def widget_pos(canvas, x, y):
+    # Точка снимка -> координаты виджета при текущих масштабе и сдвиге
+    ox, oy = canvas.image_origin()
+    return QPoint(int(round(ox + x * canvas.scale_factor)), int(round(oy + y * canvas.scale_factor)))
+
+def test_segment_at_with_scale_and_offset(canvas):
+    canvas, tooth, caries = canvas
+    for scale, offset in [(1.0, (0, 0)), (2.0, (-120, 30)), (0.5, (15, -10))]:
+        canvas.scale_factor = scale
+        canvas.image_offset.setX(offset[0])
+        canvas.image_offset.setY(offset[1])
+        # Находка лежит поверх зуба
+        assert canvas.segment_at(widget_pos(canvas, 50, 50)) is caries
+        assert canvas.segment_at(widget_pos(canvas, 20, 20)) is tooth
+        assert canvas.segment_at(widget_pos(canvas, 150, 50)) is None
+
+def test_hidden_segment_is_not_hit(canvas):
+    canvas, tooth, caries = canvas
+    canvas.set_visible_segments([tooth])
+    assert canvas.segment_at(widget_pos(canvas, 50, 50)) is tooth
+
+def test_click_selects_segment(canvas):
+    from PyQt5.QtTest import QTest
+
+    canvas, tooth, caries = canvas
+    selected = []
+    canvas.segment_selected.connect(selected.append)
+    canvas.scale_factor = 2.0
+    QTest.mouseClick(canvas, Qt.LeftButton, Qt.NoModifier, widget_pos(canvas, 20, 20))
+    assert selected == [tooth]
+    assert canvas.selected_segment is tooth
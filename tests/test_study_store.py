@@ -0,0 +1,46 @@
+# tests/test_study_store.py
+
+import sqlite3
+
+from ai.diagnosis import analyze_image, associate
+from ai.study_store import StudyStore
+
+def test_update_study_replaces_result_without_new_record(stubs, make_scan, tmp_path):
+    path = make_scan()
+    outputs = analyze_image(path)
+    messages, segments = associate(outputs)
+    store = StudyStore(str(tmp_path / "store"))
+    study_id = store.add_study(path, messages, segments, outputs, (0.15, 0.0))
+
+    strict_messages, strict_segments = associate(outputs, overlap_threshold=0.99)
+    store.update_study(study_id, strict_messages, strict_segments, (0.99, 0.0))
+
+    assert [row[0] for row in store.recent()] == [study_id]
+    loaded_path, loaded_messages, loaded_segments, loaded_outputs, thresholds = store.load(study_id)
+    assert loaded_path == path
+    assert thresholds == (0.99, 0.0)
+    assert loaded_messages == strict_messages
+    assert len(loaded_segments) == len(strict_segments)
+    # Выходы моделей пережили обновление: пороги можно менять снова
+    assert associate(loaded_outputs)[0] == messages
+    n_findings = sum(len(seg.get("findings", [])) for seg in strict_segments if seg.get("is_tooth"))
+    assert store.recent()[0][4] == n_findings
+    store.close()
+
+def test_store_without_outputs_columns_is_migrated(tmp_path):
+    store_dir = tmp_path / "store"
+    store_dir.mkdir()
+    # Схема прежней версии: без колонок выходов моделей
+    db = sqlite3.connect(str(store_dir / "studies.sqlite"))
+    db.execute(
+        "CREATE TABLE studies (id INTEGER PRIMARY KEY AUTOINCREMENT, path TEXT NOT NULL, "
+        "name TEXT NOT NULL, created_at REAL NOT NULL, n_findings INTEGER NOT NULL, "
+        "blob_offset INTEGER NOT NULL, blob_length INTEGER NOT NULL)"
+    )
+    db.commit()
+    db.close()
+
+    store = StudyStore(str(store_dir))
+    study_id = store.add_study("a.png", ["Зубы не обнаружены"], [])
+    assert store.load(study_id) == ("a.png", ["Зубы не обнаружены"], [], None, None)
+    store.close()
@@ -0,0 +1,47 @@
+# tests/test_teeth_set.py
+
+import numpy as np
+import pytest
+
+from ai.teeth_set import ToothSet
+
+def square(x, size=10):
+    return np.array([[x, 0], [x + size, 0], [x + size, size], [x, size]], dtype=np.float32)
+
+def test_dedup_keeps_most_confident_detection_per_label():
+    teeth = ToothSet.from_polygons(
+        [square(0), square(20), square(40), square(60)],
+        ["tooth 11", "tooth 21", "tooth 11", "tooth 22"],
+        [0.4, 0.8, 0.9, 0.7],
+    ).dedup()
+    # Второй «11» увереннее первого; порядок остальных зубов сохранён
+    assert teeth.labels == ["tooth 21", "tooth 11", "tooth 22"]
+    assert teeth.confidences.tolist() == pytest.approx([0.8, 0.9, 0.7])
+    assert teeth.points(1)[0].tolist() == [40, 0]
+    assert teeth[1]["bbox"] == (40, 0, 50, 10)
+
+def test_dedup_tie_keeps_first_detection():
+    teeth = ToothSet.from_polygons([square(0), square(20)], ["tooth 11", "tooth 11"], [0.5, 0.5]).dedup()
+    assert len(teeth) == 1
+    assert teeth.points(0)[0].tolist() == [0, 0]
+
+def test_dedup_without_duplicates_returns_same_set():
+    teeth = ToothSet.from_polygons([square(0), square(20)], ["tooth 11", "tooth 21"], [0.5, 0.6])
+    assert teeth.dedup() is teeth
+
+def test_negative_index_counts_from_end():
+    teeth = ToothSet.from_polygons([square(0), square(20, size=5)], ["tooth 11", "tooth 21"], [0.5, 0.6])
+    assert teeth.points(-1).tolist() == teeth.points(1).tolist()
+    assert len(teeth.points(-1)) == 4
+    assert teeth[-1]["label"] == "tooth 21"
+    assert teeth[-2]["bbox"] == (0, 0, 10, 10)
+
+def test_out_of_range_index_raises():
+    teeth = ToothSet.from_polygons([square(0)], ["tooth 11"], [0.5])
+    for i in (1, -2):
+        with pytest.raises(IndexError):
+            teeth.points(i)
+        with pytest.raises(IndexError):
+            teeth[i]
+    with pytest.raises(IndexError):
+        ToothSet.empty()[0]
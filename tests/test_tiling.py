@@ -0,0 +1,86 @@
+# tests/test_tiling.py
+
+import numpy as np
+import pytest
+
+from ai import disease_seg
+from ai.classes import CLASSES
+from ai.disease_seg import tile_positions, blend_window, predict_masks_tiled, predict_masks_batch
+
+CARIES = CLASSES.index("caries")
+FILLING = CLASSES.index("filling")
+
+class ConstantSeg:
+    # Одни и те же логиты в каждом пикселе
+    def __init__(self, logits):
+        self.logits = np.asarray(logits, dtype=np.float32)
+
+    def predict(self, batch):
+        n, _, h, w = batch.shape
+        return np.broadcast_to(self.logits[None, :, None, None], (n, len(self.logits), h, w)).copy()
+
+class PixelSeg:
+    # Класс пикселя зависит только от его яркости: склейка тайлов
+    # должна совпасть с попиксельным ответом для всего снимка
+    def predict(self, batch):
+        gray = batch.mean(axis=1)
+        logits = np.zeros((batch.shape[0], len(CLASSES)) + gray.shape[1:], dtype=np.float32)
+        logits[:, 0] = 2.0
+        logits[:, CARIES] = 4.0 * (gray > 0.5)
+        return logits
+
+def test_tile_positions_cover_axis():
+    assert tile_positions(100, 256, 192) == [0]
+    assert tile_positions(256, 256, 192) == [0]
+    assert tile_positions(448, 256, 192) == [0, 192]
+    # Длина не кратна шагу: последний тайл прижат к краю
+    positions = tile_positions(517, 256, 192)
+    assert positions == [0, 192, 261]
+    for length in (257, 300, 517, 1000, 1160):
+        positions = tile_positions(length, 256, 192)
+        assert positions[0] == 0 and positions[-1] == length - 256
+        assert all(b - a <= 192 for a, b in zip(positions, positions[1:]))
+
+def test_blend_window_ramps_and_is_symmetric():
+    window = blend_window(256, 64)
+    assert window.shape == (256, 256)
+    assert (window > 0).all()
+    assert np.allclose(window, window.T)
+    assert np.allclose(window, window[::-1, ::-1])
+    assert window[128, 128] == 1.0
+    assert window[0, 128] < window[32, 128] < window[63, 128] <= 1.0
+    assert (blend_window(256, 0) == 1).all()
+
+@pytest.mark.parametrize("size", [(100, 80), (256, 256), (300, 517)])
+def test_constant_logits_match_non_tiled(monkeypatch, size):
+    logits = np.zeros(len(CLASSES))
+    logits[CARIES] = 3.0
+    monkeypatch.setattr(disease_seg, "model", ConstantSeg(logits))
+    image = np.zeros(size + (3,), dtype=np.uint8)
+
+    tiled = predict_masks_tiled(image)
+    plain = predict_masks_batch([image])[0]
+    assert tiled["shape"] == size
+    assert len(tiled["pathologies"]) == len(plain["pathologies"]) == 1
+    item = tiled["pathologies"][0]
+    assert item["label"] == "caries"
+    assert item["area"] == size[0] * size[1]
+    # Вероятность нормируется на сумму весов: совпадает с одним прогоном
+    assert item["confidence"] == pytest.approx(plain["pathologies"][0]["confidence"], rel=1e-5)
+
+@pytest.mark.parametrize("size", [(100, 80), (300, 517), (600, 700)])
+def test_stitched_map_has_no_seams(monkeypatch, size):
+    monkeypatch.setattr(disease_seg, "model", PixelSeg())
+    rng = np.random.default_rng(0)
+    image = np.zeros(size + (3,), dtype=np.uint8)
+    # Прямоугольники поперёк стыков тайлов
+    for _ in range(5):
+        y, x = rng.integers(0, size[0] - 40), rng.integers(0, size[1] - 40)
+        image[y:y + 40, x:x + 60] = 255
+    expected = image.mean(axis=2) / 255 > 0.5
+
+    result = predict_masks_tiled(image)
+    mask = np.zeros(size, dtype=bool)
+    for item in result["pathologies"]:
+        mask |= item["mask"].decode().astype(bool)
+    assert (mask == expected).all()
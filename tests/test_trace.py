@@ -0,0 +1,17 @@
+# tests/test_trace.py
+
+from collections import deque
+
+from ai import trace
+
+def test_events_are_bounded(monkeypatch):
+    monkeypatch.setattr(trace, "_events", deque(maxlen=5))
+    monkeypatch.setattr(trace, "_enabled", True)
+    for i in range(20):
+        trace.debug("событие %s", i)
+        trace.count("n")
+    events = list(trace._events)
+    assert len(events) == 5
+    assert events[-2]["name"] == "событие 19"
+    assert trace.counters()["n"] == 20
+    trace.reset()